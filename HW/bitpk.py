@@ -1,98 +1,646 @@
-﻿import sys
+﻿"""
+    FPGA bit file packer.
 
-def load_segment_1(fstream):
-    bt = fstream.read(1)
-    while True:
-        if not bt:
-            return
-        if bt[0] == 0:
-            # Read zero string
-            length = 1
-            while True:
-                bt = fstream.read(1)
-                if not bt:
-                    yield 0, length
-                    return
-                if bt[0] != 0:
-                    yield 0, length
-                    break
-                length += 1
-        else:
-            result = bt[:]
-            while True:
-                bt = fstream.read(1)
-                if not bt:
-                    yield 1, result
-                    return
-                if bt[0] == 0:
-                    yield 1, result
-                    break
-                result += bt
+    Packed stream is a sequence of alternating data and zero segments, starting from data one.
+    Each segment starts from length: 1 byte (0-254) or 0xFF + 2 bytes little endian.
+    Data segment is followed by 'length' bytes of data, zero segment means 'length' zero bytes.
+
+    Version 2 stream starts from FF 00 00 <version> (3 byte form of empty data segment, never emitted by version 1 packer),
+    followed by commands:
+        0LLLLLLL                - literal, L+1 bytes of data follows
+        10LLLLLL <byte>         - run of L+3 copies of <byte>
+        11LLLLLL <dist:2>       - copy L+4 bytes from 'dist' bytes back (1-4096, may overlap copied bytes)
+    L == 63 in run or copy means length in 2 bytes little endian follows control byte.
+    Decoder needs only 4K window of output.
+
+    Chunked container (version byte 3) holds fixed size input chunks packed independently (by version 1 or 2):
+        FF 00 00 03 | chunk version: u8 | chunk size: u32 | count: u32 | unpacked size: u64 | count * packed chunk size: u32 | chunks
+    Chunks are packed and unpacked in parallel by process pool.
+
+    API (src is bytes-like object, file object or iterable of bytes-like chunks):
+        pack(src, dst=None, version=1)  - pack to file object 'dst', or return packed bytes
+        unpack(src, dst=None)           - unpack (any version) to file object 'dst', or return unpacked bytes
+        pack_parallel(src, dst=None)    - pack to chunked container by all cores
+        unpack_parallel(src, dst=None)  - unpack (any version) by all cores
+        process_dir(src_dir, dst_dir)   - pack (or unpack) all files of directory in one process pool
+        pack_iter(src)          - generator of packed chunks
+        unpack_iter(src)        - generator of unpacked chunks
+
+    Random access (packed is bytes-like object or seekable file object):
+        build_index(packed)                     - PackIndex with offsets of every N-th segment (saved as side file)
+        read_range(packed, index, offset, size) - part of unpacked stream, decoded from nearest indexed segment
+"""
+import sys
+import re
+import io
+import os
+import time
+import argparse
+import bisect
+import itertools
+
+from concurrent.futures import ProcessPoolExecutor, Executor, Future
+
+from dataclasses import dataclass, field
+from struct import Struct
+
+from typing import *
+
+BLOCK_SIZE = 0x10000        # I/O block size
+MAX_LENGTH = 0xFFFF         # Maximum segment length (3 byte form)
+ZEROS = bytes(MAX_LENGTH)   # Source for zero segments in unpack
+ZERO_RUN = re.compile(rb'\x00+')
+
+V2_PREFIX = b'\xFF\x00\x00'  # Version 2 stream header (followed by version byte)
+V2_VERSION = 2
+WINDOW = 0x1000             # Maximum copy distance
+MIN_RUN = 3
+MIN_MATCH = 4
+MAX_LITERAL = 128
+EXT_LENGTH = 63             # Length field of run/copy command for 2 byte length
+SAME_BYTES = re.compile(rb'(.)\1*', re.S)
+
+CHUNKED_VERSION = 3         # Chunked container
+CHUNK_SIZE = 0x10000        # Default input chunk size of container
+CHUNKED_HEADER = Struct('<3sBBIIQ')
+
+Source = Union[bytes, bytearray, memoryview, BinaryIO, Iterable[bytes]]
+
+def iter_blocks(src: Source, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """
+        Input blocks from bytes-like object, file object (anything with 'read') or iterable of bytes-like chunks
+    """
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        view = memoryview(src)
+        for pos in range(0, len(view), block_size):
+            yield view[pos:pos+block_size]
+    elif hasattr(src, 'read'):
+        while block := src.read(block_size):
+            yield block
+    else:
+        for block in src:
+            if block:
+                yield block
+
+def drain(chunks: Iterator[bytes], dst: Optional[BinaryIO]) -> Optional[bytes]:
+    if dst is None:
+        return b''.join(chunks)
+    for chunk in chunks:
+        dst.write(chunk)
 
-def load_segment_2(fstream):
-    pending = b''
-    for tp, data in load_segment_1(fstream):
+def load_segment_1(src: Source, block_size: int = BLOCK_SIZE):
+    """
+        Split input to alternating (1, data) and (0, zero-count) segments.
+        Input is read by blocks, zero runs are found by regex scan over block, not byte by byte
+    """
+    data = bytearray()
+    zeros = 0
+    for block in iter_blocks(src, block_size):
+        pos = 0
+        for mtch in ZERO_RUN.finditer(block):
+            if mtch.start() > pos:
+                if zeros:
+                    yield 0, zeros
+                    zeros = 0
+                data += block[pos:mtch.start()]
+            if data:
+                yield 1, data
+                data = bytearray()
+            zeros += mtch.end() - mtch.start()
+            pos = mtch.end()
+        if pos < len(block):
+            if zeros:
+                yield 0, zeros
+                zeros = 0
+            data += block[pos:]
+    if data:
+        yield 1, data
+    if zeros:
+        yield 0, zeros
+
+def load_segment_2(src: Source, block_size: int = BLOCK_SIZE):
+    pending = bytearray()
+    for tp, data in load_segment_1(src, block_size):
         if tp == 1:
             pending += data
         elif data <= 3 and pending: # Append zeros, because generate segment for less than 3 zero is not effective
-            pending += data * b'\0'
+            pending += ZEROS[:data]
         else:
             if pending:
                 yield 1, pending
-                pending = b''
+                pending = bytearray()
             yield 0, data
     if pending:
         yield 1, pending
 
+def put_length(out: bytearray, length: int):
+    if length >= 255:
+        out.append(255)
+        out += length.to_bytes(2, byteorder='little')
+    else:
+        out.append(length)
 
-def pack(fstream_in, fstream_out):
+def pack_iter(src: Source, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """
+        Segments longer than MAX_LENGTH are split by empty segment of other type,
+        input started from zero got empty data segment first (unpacker always starts from data segment)
+    """
+    out = bytearray()
     last_type = 0
-    for tp, data in load_segment_2(fstream_in):
-        assert last_type != tp
+    for tp, data in load_segment_2(src, block_size):
+        if last_type == tp:
+            put_length(out, 0)
         last_type = tp
         length = len(data) if tp else data
-        if length >= 255:
-            fstream_out.write(b'\xFF')
-            fstream_out.write(length.to_bytes(2, byteorder='little'))
-        else:
-            fstream_out.write(length.to_bytes(1, byteorder='little'))
+        view = memoryview(data) if tp else None
+        while length > MAX_LENGTH:
+            put_length(out, MAX_LENGTH)
+            if tp:
+                out += view[:MAX_LENGTH]
+                view = view[MAX_LENGTH:]
+            put_length(out, 0)
+            length -= MAX_LENGTH
+        put_length(out, length)
         if tp:
-            fstream_out.write(data)
+            out += view
+        if len(out) >= block_size:
+            yield bytes(out)
+            out.clear()
+    if out:
+        yield bytes(out)
 
+def unpack_iter(src: Source, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """
+        Format version is detected by stream header
+    """
+    blocks = iter_blocks(src, block_size)
+    head = b''
+    for block in blocks:
+        head += block
+        if len(head) > len(V2_PREFIX):
+            break
+    blocks = itertools.chain([head], blocks) if head else blocks
+    if head.startswith(V2_PREFIX) and head[len(V2_PREFIX)] == CHUNKED_VERSION:
+        yield from unpack_chunked_iter(blocks, block_size)
+    elif head.startswith(V2_PREFIX):
+        yield from unpack_v2_iter(blocks, block_size)
+    else:
+        yield from unpack_v1_iter(blocks, block_size)
 
-def unpack(fstream_in, fstream_out):
+def unpack_v1_iter(src: Source, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
     cur_type = 1
-    while True:
-        b = fstream_in.read(1)
-        if not b:
-            return
-        if b[0] == 255:
-            b = fstream_in.read(2)
-            length = int.from_bytes(b, byteorder='little')
+    rest = 0        # Bytes of current data segment not copied yet
+    tail = b''      # Segment header split between blocks
+    out = bytearray()
+    for block in iter_blocks(src, block_size):
+        buf = tail + block if tail else block
+        view = memoryview(buf)
+        pos = 0
+        while pos < len(buf):
+            if rest:
+                chunk = view[pos:pos+rest]
+                out += chunk
+                pos += len(chunk)
+                rest -= len(chunk)
+                continue
+            length = buf[pos]
+            if length == 255:
+                if len(buf) - pos < 3:
+                    break
+                length = int.from_bytes(buf[pos+1:pos+3], byteorder='little')
+                pos += 3
+            else:
+                pos += 1
+            if cur_type:
+                rest = length
+            else:
+                out += ZEROS[:length]
+            cur_type = 1-cur_type
+        tail = bytes(buf[pos:])
+        if len(out) >= block_size:
+            yield bytes(out)
+            out.clear()
+    if out:
+        yield bytes(out)
+
+def pack(src: Source, dst: Optional[BinaryIO] = None, block_size: int = BLOCK_SIZE, version: int = 1) -> Optional[bytes]:
+    """
+        Pack 'src' to file object 'dst'. Without 'dst' return packed bytes
+    """
+    assert version in (1, V2_VERSION), f'Unsupported format version {version}'
+    return drain((pack_v2_iter if version == V2_VERSION else pack_iter)(src, block_size), dst)
+
+def unpack(src: Source, dst: Optional[BinaryIO] = None, block_size: int = BLOCK_SIZE) -> Optional[bytes]:
+    """
+        Unpack 'src' to file object 'dst'. Without 'dst' return unpacked bytes
+    """
+    return drain(unpack_iter(src, block_size), dst)
+
+#################################################################################################
+## Version 2 codec
+
+def put_v2_command(out: bytearray, ctl: int, length: int):
+    if length < EXT_LENGTH:
+        out.append(ctl | length)
+    else:
+        out.append(ctl | EXT_LENGTH)
+        out += length.to_bytes(2, byteorder='little')
+
+def match_length(data: bytes, src: int, dst: int, limit: int) -> int:
+    length = 0
+    while length + 32 <= limit and data[src+length:src+length+32] == data[dst+length:dst+length+32]:
+        length += 32
+    while length < limit and data[src+length] == data[dst+length]:
+        length += 1
+    return length
+
+def pack_v2_iter(src: Source, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """
+        Greedy packer: at each position take longest of byte run and copy from last position with same 4 bytes
+        (whole input is loaded to memory - bitstreams are small)
+    """
+    data = b''.join(iter_blocks(src, block_size))
+    size = len(data)
+    out = bytearray(V2_PREFIX)
+    out.append(V2_VERSION)
+    heads: dict[bytes, int] = {}
+    literal = 0     # Start of pending literal
+    pos = 0
+
+    def flush_literal():
+        nonlocal literal
+        while literal < pos:
+            length = min(pos - literal, MAX_LITERAL)
+            out.append(length - 1)
+            out.extend(data[literal:literal+length])
+            literal += length
+
+    while pos < size:
+        limit = min(MAX_LENGTH, size - pos)
+        run = 0
+        if limit >= MIN_RUN and data[pos] == data[pos+1] == data[pos+2]:
+            run = min(SAME_BYTES.match(data, pos).end() - pos, limit)
+        match = 0
+        if limit >= MIN_MATCH:
+            key = data[pos:pos+MIN_MATCH]
+            prev = heads.get(key)
+            heads[key] = pos
+            if prev is not None and pos - prev <= WINDOW:
+                match = match_length(data, prev, pos, limit)
+        if match >= MIN_MATCH and match > run:
+            flush_literal()
+            put_v2_command(out, 0xC0, match - MIN_MATCH)
+            out += (pos - prev).to_bytes(2, byteorder='little')
+            pos += match
+            literal = pos
+        elif run >= MIN_RUN:
+            flush_literal()
+            put_v2_command(out, 0x80, run - MIN_RUN)
+            out.append(data[pos])
+            pos += run
+            literal = pos
         else:
-            length = b[0]
-        if cur_type:
-            b = fstream_in.read(length)
-            fstream_out.write(b)
+            pos += 1
+        if len(out) >= block_size:
+            yield bytes(out)
+            out.clear()
+    flush_literal()
+    if out:
+        yield bytes(out)
+
+def unpack_v2_iter(src: Source, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    data = b''.join(iter_blocks(src, block_size))
+    assert data[len(V2_PREFIX)] == V2_VERSION, f'Unsupported format version {data[len(V2_PREFIX)]}'
+    pos = len(V2_PREFIX) + 1
+    out = bytearray()
+    while pos < len(data):
+        ctl = data[pos]
+        pos += 1
+        if ctl < 0x80:
+            out += data[pos:pos+ctl+1]
+            pos += ctl+1
         else:
-            fstream_out.write(length * b'\0')
+            length = ctl & EXT_LENGTH
+            if length == EXT_LENGTH:
+                length = int.from_bytes(data[pos:pos+2], byteorder='little')
+                pos += 2
+            if ctl < 0xC0:
+                out += data[pos:pos+1] * (length + MIN_RUN)
+                pos += 1
+            else:
+                length += MIN_MATCH
+                dist = int.from_bytes(data[pos:pos+2], byteorder='little')
+                pos += 2
+                assert 0 < dist <= min(len(out), WINDOW), 'Broken packed stream'
+                start = len(out) - dist
+                if dist >= length:
+                    out += out[start:start+length]
+                else:
+                    out += (out[start:] * (length // dist + 1))[:length]
+        if len(out) >= block_size + WINDOW:
+            yield bytes(out[:-WINDOW])
+            del out[:-WINDOW]
+    if out:
+        yield bytes(out)
+
+def compare(data: bytes, repeat: int = 3) -> list[tuple[int, int, float, float]]:
+    """
+        (version, packed size, pack time, unpack time) for each format version. Best time of 'repeat' runs
+    """
+    result = []
+    for version in (1, V2_VERSION):
+        pack_time = unpack_time = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            packed = pack(data, version=version)
+            pack_time = min(pack_time, time.perf_counter() - start)
+            start = time.perf_counter()
+            assert unpack(packed) == data, f'Version {version} round trip failed'
+            unpack_time = min(unpack_time, time.perf_counter() - start)
+        result.append((version, len(packed), pack_time, unpack_time))
+    return result
+
+def print_compare(fname: str, data: bytes):
+    print(f'{fname}: {len(data)} bytes')
+    print(f'{"version":>7} {"size":>10} {"ratio":>7} {"pack MB/s":>10} {"unpack MB/s":>12}')
+    for version, size, pack_time, unpack_time in compare(data):
+        print(f'{version:>7} {size:>10} {size / max(len(data), 1):>7.1%} {len(data) / pack_time / 1e6:>10.2f} {len(data) / unpack_time / 1e6:>12.2f}')
+
+#################################################################################################
+## Chunked container
+
+def pack_chunk(data: bytes, version: int) -> bytes:
+    return pack(data, version=version)
+
+def unpack_chunk(data: bytes) -> bytes:
+    return unpack(data)
+
+def submit_pack(executor: Executor, data: bytes, chunk_size: int, version: int) -> list[Future]:
+    return [executor.submit(pack_chunk, data[pos:pos+chunk_size], version) for pos in range(0, len(data), chunk_size)]
+
+def build_container(chunks: list[bytes], unpacked_size: int, chunk_size: int, version: int) -> bytes:
+    result = bytearray(CHUNKED_HEADER.pack(V2_PREFIX, CHUNKED_VERSION, version, chunk_size, len(chunks), unpacked_size))
+    for chunk in chunks:
+        result += len(chunk).to_bytes(4, byteorder='little')
+    for chunk in chunks:
+        result += chunk
+    return bytes(result)
+
+def parse_container(data: bytes) -> tuple[int, list[bytes]]:
+    """
+        Unpacked size and packed chunks of container
+    """
+    prefix, container, _, _, count, unpacked_size = CHUNKED_HEADER.unpack_from(data)
+    assert prefix == V2_PREFIX and container == CHUNKED_VERSION, 'Not a chunked container'
+    pos = CHUNKED_HEADER.size + count * 4
+    chunks = []
+    for (size,) in Struct('<I').iter_unpack(data[CHUNKED_HEADER.size:pos]):
+        chunks.append(data[pos:pos+size])
+        pos += size
+    assert pos == len(data), 'Broken chunked container'
+    return unpacked_size, chunks
+
+def is_chunked(data: bytes) -> bool:
+    return data[:len(V2_PREFIX)+1] == V2_PREFIX + bytes([CHUNKED_VERSION])
+
+def unpack_chunked_iter(src: Source, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    unpacked_size, chunks = parse_container(b''.join(iter_blocks(src, block_size)))
+    for chunk in chunks:
+        yield from unpack_iter(chunk, block_size)
+
+def pack_parallel(src: Source, dst: Optional[BinaryIO] = None, chunk_size: int = CHUNK_SIZE, version: int = 1, jobs: Optional[int] = None) -> Optional[bytes]:
+    """
+        Pack 'src' to chunked container by 'jobs' processes (all cores by default)
+    """
+    data = b''.join(iter_blocks(src))
+    with ProcessPoolExecutor(jobs) as executor:
+        chunks = [future.result() for future in submit_pack(executor, data, chunk_size, version)]
+    return drain(iter([build_container(chunks, len(data), chunk_size, version)]), dst)
+
+def unpack_parallel(src: Source, dst: Optional[BinaryIO] = None, jobs: Optional[int] = None) -> Optional[bytes]:
+    """
+        Unpack chunked container by 'jobs' processes. Other formats are unpacked in this process
+    """
+    data = b''.join(iter_blocks(src))
+    if not is_chunked(data):
+        return unpack(data, dst)
+    unpacked_size, chunks = parse_container(data)
+    with ProcessPoolExecutor(jobs) as executor:
+        result = drain(executor.map(unpack_chunk, chunks), dst)
+    assert result is None or len(result) == unpacked_size, 'Broken chunked container'
+    return result
+
+def process_dir(src_dir: str, dst_dir: str, unpack_mode: bool = False, chunk_size: int = CHUNK_SIZE, version: int = 1, jobs: Optional[int] = None):
+    """
+        Pack each file of 'src_dir' to chunked container with same name in 'dst_dir' (or unpack with 'unpack_mode').
+        Chunks of all files go to one process pool
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    names = sorted(name for name in os.listdir(src_dir) if os.path.isfile(os.path.join(src_dir, name)))
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = []
+        for name in names:
+            with open(os.path.join(src_dir, name), 'rb') as f:
+                data = f.read()
+            if not unpack_mode:
+                pending.append((name, len(data), submit_pack(executor, data, chunk_size, version)))
+            elif is_chunked(data):
+                pending.append((name, None, [executor.submit(unpack_chunk, chunk) for chunk in parse_container(data)[1]]))
+            else:
+                pending.append((name, None, [executor.submit(unpack_chunk, data)]))
+        for name, unpacked_size, futures in pending:
+            chunks = [future.result() for future in futures]
+            with open(os.path.join(dst_dir, name), 'wb') as f:
+                f.write(b''.join(chunks) if unpacked_size is None else build_container(chunks, unpacked_size, chunk_size, version))
+
+#################################################################################################
+## Random access index
+
+@dataclass
+class PackIndex:
+    """
+        Offsets (in packed and unpacked streams) of every 'stride'-th segment.
+        'stride' is even - all indexed segments are data segments
+
+        Side file format (little endian):
+            'BPKX' | stride: u32 | count: u32 | unpacked size: u64 | count * (packed offset: u64, unpacked offset: u64)
+    """
+    stride: int
+    unpacked_size: int = 0
+    packed: list[int] = field(default_factory=list)
+    unpacked: list[int] = field(default_factory=list)
+
+    MAGIC = b'BPKX'
+    HEADER = Struct('<4sIIQ')
+    ENTRY = Struct('<QQ')
+
+    def lookup(self, offset: int) -> tuple[int, int]:
+        """
+            Nearest indexed segment at or before 'offset' of unpacked stream: (packed offset, unpacked offset)
+        """
+        pos = bisect.bisect_right(self.unpacked, offset) - 1
+        if pos < 0:
+            return 0, 0
+        return self.packed[pos], self.unpacked[pos]
+
+    def to_bytes(self) -> bytes:
+        result = bytearray(self.HEADER.pack(self.MAGIC, self.stride, len(self.packed), self.unpacked_size))
+        for entry in zip(self.packed, self.unpacked):
+            result += self.ENTRY.pack(*entry)
+        return bytes(result)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'PackIndex':
+        magic, stride, count, unpacked_size = cls.HEADER.unpack_from(data)
+        assert magic == cls.MAGIC, 'Not a bitpk index'
+        assert len(data) == cls.HEADER.size + count * cls.ENTRY.size, 'Broken bitpk index'
+        result = cls(stride, unpacked_size)
+        for packed, unpacked in cls.ENTRY.iter_unpack(memoryview(data)[cls.HEADER.size:]):
+            result.packed.append(packed)
+            result.unpacked.append(unpacked)
+        return result
+
+    def save(self, fname: str):
+        with open(fname, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, fname: str) -> 'PackIndex':
+        with open(fname, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+def as_seekable(packed: Union[bytes, bytearray, memoryview, BinaryIO]) -> BinaryIO:
+    return packed if hasattr(packed, 'seek') else io.BytesIO(packed)
+
+def read_length(f: BinaryIO) -> Optional[int]:
+    """
+        Read segment length, None on end of stream
+    """
+    hdr = f.read(1)
+    if not hdr:
+        return None
+    if hdr[0] == 255:
+        return int.from_bytes(f.read(2), byteorder='little')
+    return hdr[0]
+
+def build_index(packed: Union[bytes, bytearray, memoryview, BinaryIO], stride: int = 64) -> PackIndex:
+    """
+        Walk segment headers of packed stream (data is skipped, not read)
+    """
+    f = as_seekable(packed)
+    f.seek(0)
+    assert f.read(len(V2_PREFIX)) != V2_PREFIX, 'Random access index is supported for version 1 format only'
+    f.seek(0)
+    index = PackIndex(stride + stride % 2)
+    unpacked_pos = 0
+    cur_type = 1
+    seg_n = 0
+    while True:
+        packed_pos = f.tell()
+        length = read_length(f)
+        if length is None:
+            break
+        if seg_n % index.stride == 0:
+            index.packed.append(packed_pos)
+            index.unpacked.append(unpacked_pos)
+        if cur_type:
+            f.seek(length, os.SEEK_CUR)
+        unpacked_pos += length
         cur_type = 1-cur_type
+        seg_n += 1
+    index.unpacked_size = unpacked_pos
+    return index
 
+def read_range(packed: Union[bytes, bytearray, memoryview, BinaryIO], index: PackIndex, offset: int, size: int) -> bytes:
+    """
+        'size' bytes of unpacked stream from 'offset' (less at end of stream)
+    """
+    f = as_seekable(packed)
+    packed_pos, unpacked_pos = index.lookup(offset)
+    f.seek(packed_pos)
+    end = offset + size
+    cur_type = 1
+    out = bytearray()
+    while unpacked_pos < end:
+        length = read_length(f)
+        if length is None:
+            break
+        seg_end = unpacked_pos + length
+        if seg_end > offset:
+            lo = max(offset, unpacked_pos) - unpacked_pos
+            hi = min(end, seg_end) - unpacked_pos
+            if cur_type:
+                f.seek(lo, os.SEEK_CUR)
+                out += f.read(hi - lo)
+                f.seek(length - hi, os.SEEK_CUR)
+            else:
+                out += ZEROS[:hi - lo]
+        elif cur_type:
+            f.seek(length, os.SEEK_CUR)
+        unpacked_pos = seg_end
+        cur_type = 1-cur_type
+    return bytes(out)
 
-if len(sys.argv) > 1 and sys.argv[1] == '-u':
-    do_unpack = True
-    del sys.argv[1]
-else:
-    do_unpack = False
-
-if len(sys.argv) < 3:
-    print("""FPGA bit file packer. 
-Usage: bitpk.py [-u] <in-file> <out-file>
-    -u - Unpack <in-file> to <out-file>
-         Otherwise pack <in-file> to <out-file>""")
-else:
-    with open(sys.argv[1], 'rb') as src, open(sys.argv[2], 'wb') as dst:
-        if do_unpack:
-            unpack(src, dst)
-        else:
-            pack(src, dst)
+def index_name(fname: str) -> str:
+    return fname + '.idx'
+
+def load_or_build_index(fname: str, f: BinaryIO) -> PackIndex:
+    if os.path.exists(index_name(fname)):
+        return PackIndex.load(index_name(fname))
+    return build_index(f)
+
+def parse_range(text: str) -> tuple[int, int]:
+    offset, _, size = text.partition(':')
+    return int(offset, 0), int(size, 0)
+
+#################################################################################################
+
+def main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='bitpk.py', description='FPGA bit file packer')
+    parser.add_argument('in_file', help='Input file (or directory)')
+    parser.add_argument('out_file', nargs='?', help='Output file (or directory)')
+    parser.add_argument('-u', '--unpack', action='store_true', help='Unpack <in-file> to <out-file>. Otherwise pack <in-file> to <out-file>')
+    parser.add_argument('-v', '--version', type=int, choices=(1, V2_VERSION), default=1, help='Packed format version (unpack detects it)')
+    parser.add_argument('--compare', action='store_true', help='Print size and speed of all format versions for <in-file>')
+    parser.add_argument('-c', '--chunked', action='store_true', help='Pack to chunked container by all cores (unpack detects it). Always used for directories')
+    parser.add_argument('--chunk-size', type=lambda x: int(x, 0), default=CHUNK_SIZE, help='Input chunk size of chunked container')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes for chunked container (default - number of cores)')
+    parser.add_argument('-i', '--index', action='store_true', help='Write random access index <packed-file>.idx (after packing, or for packed <in-file> if there is no <out-file>)')
+    parser.add_argument('--stride', type=int, default=64, help='Index every N-th segment')
+    parser.add_argument('-r', '--range', type=parse_range, metavar='OFFSET:SIZE', help='Extract part of unpacked stream from packed <in-file> to <out-file> (uses <in-file>.idx if exists)')
+    args = parser.parse_args(argv[1:])
+
+    if os.path.isdir(args.in_file):
+        assert args.out_file, 'Output directory expected'
+        process_dir(args.in_file, args.out_file, args.unpack, args.chunk_size, args.version, args.jobs)
+    elif args.compare:
+        with open(args.in_file, 'rb') as src:
+            print_compare(args.in_file, src.read())
+    elif args.range:
+        assert args.out_file, 'Output file expected'
+        with open(args.in_file, 'rb') as src:
+            data = read_range(src, load_or_build_index(args.in_file, src), *args.range)
+        with open(args.out_file, 'wb') as dst:
+            dst.write(data)
+    elif args.index and not args.out_file:
+        with open(args.in_file, 'rb') as src:
+            build_index(src, args.stride).save(index_name(args.in_file))
+    else:
+        assert args.out_file, 'Output file expected'
+        with open(args.in_file, 'rb') as src, open(args.out_file, 'wb') as dst:
+            if args.unpack:
+                unpack_parallel(src, dst, args.jobs)
+            elif args.chunked:
+                pack_parallel(src, dst, args.chunk_size, args.version, args.jobs)
+            else:
+                pack(src, dst, version=args.version)
+        if args.index and not args.unpack:
+            with open(args.out_file, 'rb') as src:
+                build_index(src, args.stride).save(index_name(args.out_file))
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv)
+    except AssertionError as exp:
+        print(f'ERROR: {exp}', file=sys.stderr)
+        sys.exit(1)
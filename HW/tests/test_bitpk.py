@@ -0,0 +1,104 @@
+﻿"""
+    bitpk formats: round trip of all versions, chunked container and random access index.
+    Run: python -m pytest HW/tests
+"""
+import io
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bitpk
+
+def bitstream(seed: int = 1, size: int = 300000) -> bytes:
+    """
+        FPGA bit file lookalike: zero runs (some longer than segment limit), 0xFF runs, repeated frames and noise
+    """
+    rnd = random.Random(seed)
+    frame = rnd.randbytes(97)
+    out = bytearray()
+    while len(out) < size:
+        match rnd.randrange(5):
+            case 0: out += bytes(rnd.choice((1, 3, 200, 255, 256, 70000)))
+            case 1: out += b'\xFF' * rnd.randrange(1, 600)
+            case 2: out += frame * rnd.randrange(1, 5)
+            case 3: out += rnd.randbytes(rnd.randrange(1, 300))
+            case 4: out += bytes([rnd.randrange(256)]) * rnd.randrange(1, 10)
+    return bytes(out[:size])
+
+DATA = bitstream()
+SAMPLES = {
+    'empty': b'',
+    'zero': b'\0',
+    'zeros': bytes(bitpk.MAX_LENGTH * 2 + 5),
+    'data': b'\x01',
+    'short': b'\1\2\0\0\0\3',
+    'bitstream': DATA,
+}
+
+@pytest.mark.parametrize('version', [1, 2])
+@pytest.mark.parametrize('sample', SAMPLES)
+def test_round_trip(sample, version):
+    data = SAMPLES[sample]
+    packed = bitpk.pack(data, version=version)
+    assert bitpk.unpack(packed) == data
+    assert bitpk.unpack(packed, block_size=7) == data
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_streams(version):
+    # Source can be file or iterable of chunks, result can go to file
+    chunks = [DATA[pos:pos+1000] for pos in range(0, len(DATA), 1000)]
+    packed = io.BytesIO()
+    assert bitpk.pack(iter(chunks), packed, version=version) is None
+    assert packed.getvalue() == bitpk.pack(DATA, version=version)
+    packed.seek(0)
+    assert b''.join(bitpk.unpack_iter(packed, block_size=333)) == DATA
+
+def test_v2_is_smaller():
+    assert len(bitpk.pack(DATA, version=2)) < len(bitpk.pack(DATA, version=1)) < len(DATA)
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_chunked(version):
+    packed = bitpk.pack_parallel(DATA, chunk_size=0x8000, version=version, jobs=2)
+    assert bitpk.is_chunked(packed)
+    unpacked_size, chunks = bitpk.parse_container(packed)
+    assert unpacked_size == len(DATA) and len(chunks) == (len(DATA) + 0x7FFF) // 0x8000
+    assert bitpk.unpack_chunk(chunks[1]) == DATA[0x8000:0x10000]    # Each chunk is independent
+    assert bitpk.unpack_parallel(packed, jobs=2) == DATA
+    assert bitpk.unpack(packed) == DATA
+
+def test_unpack_parallel_plain():
+    packed = bitpk.pack(DATA)
+    assert bitpk.unpack_parallel(packed) == DATA
+
+def test_broken_container():
+    packed = bitpk.pack_parallel(DATA, chunk_size=0x10000, jobs=1)
+    with pytest.raises(AssertionError):
+        bitpk.parse_container(packed[:-1])
+
+@pytest.mark.parametrize('stride', [1, 2, 64])
+def test_read_range(stride):
+    packed = bitpk.pack(DATA)
+    index = bitpk.build_index(packed, stride)
+    assert index.stride % 2 == 0 and index.unpacked_size == len(DATA)
+    rnd = random.Random(stride)
+    ranges = [(0, 10), (0, len(DATA)), (len(DATA) - 5, 100), (len(DATA), 10), (69999, 3)]
+    ranges += [(rnd.randrange(len(DATA)), rnd.randrange(1, 5000)) for _ in range(50)]
+    for offset, size in ranges:
+        assert bitpk.read_range(packed, index, offset, size) == DATA[offset:offset+size]
+
+def test_index_file(tmp_path):
+    packed = bitpk.pack(DATA)
+    index = bitpk.build_index(io.BytesIO(packed), 16)
+    fname = str(tmp_path / 'x.bpk.idx')
+    index.save(fname)
+    assert bitpk.PackIndex.load(fname) == index
+    with pytest.raises(AssertionError):
+        bitpk.PackIndex.from_bytes(index.to_bytes()[:-1])
+    assert bitpk.read_range(io.BytesIO(packed), bitpk.PackIndex.load(fname), 12345, 678) == DATA[12345:13023]
+
+def test_index_v2():
+    with pytest.raises(AssertionError, match='version 1'):
+        bitpk.build_index(bitpk.pack(DATA, version=2))
@@ -0,0 +1,289 @@
+﻿#!/usr/bin/python3
+"""
+    Benchmarks of cfg_compiler and bitpk hot paths.
+
+    All inputs are synthetic and seeded (large setup_data.h, bitstreams, link conditions of tftp_emu) - runs are comparable.
+    Results go to JSON, and can be compared with stored baseline:
+
+        python benchmark.py -o baseline.json
+        python benchmark.py --baseline baseline.json    # Exit code 1 if something is slower than baseline by tolerance
+
+    Reference baseline is benchmark_baseline.json (machine it was taken on is in its 'meta'). Timings are machine specific -
+    compare against baseline from the same machine. Refresh it after intended performance change (or on new reference machine):
+
+        python benchmark.py -q -o benchmark_baseline.json
+"""
+import argparse
+import sys
+import os
+import re
+import time
+import json
+import random
+import platform
+import tempfile
+import importlib.util
+
+from dataclasses import dataclass, field
+from typing import *
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'HW'))
+
+import crc32
+import bitpk
+from tftp_emu import DeviceEmulator, Impairment
+
+def load_mstd():
+    spec = importlib.util.spec_from_file_location('mstd_cfg', os.path.join(HERE, 'mstd.cfg.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+mstd = load_mstd()
+
+@dataclass
+class Result:
+    name: str
+    seconds: float              # Best time of one call
+    size: int = 0               # Bytes processed by one call (0 - not a throughput benchmark)
+    extra: dict = field(default_factory=dict)
+
+    @property
+    def mb_s(self) -> float:
+        return self.size / self.seconds / 1e6 if self.size and self.seconds else 0.0
+
+    def __str__(self):
+        result = f'{self.name:<32} {self.seconds*1e6:12.1f} us'
+        if self.size:
+            result += f' {self.mb_s:9.2f} MB/s'
+        return result + ''.join(f' {k}={v}' for k, v in self.extra.items())
+
+def measure(func: Callable, repeat: int, min_time: float = 0.05) -> float:
+    """
+        Best time of one call: calls are batched to run at least 'min_time', best of 'repeat' batches
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+#################################################################################################
+## Synthetic inputs
+
+def synthetic_header(fname: str, groups: int = 200, enums: int = 20, seed: int = 1):
+    """
+        setup_data.h with 'enums' enums and 'groups' of 4 byte aligned fields (~4*groups bytes Config)
+    """
+    rnd = random.Random(seed)
+    lines = ['#pragma once', '', 'static constexpr size_t MAX_CFG_SIZE = 4096;', '']
+    for n in range(enums):
+        lines.append(f'enum Enum{n} : uint8_t {{')
+        lines += [f'    E{n}M_V{i} = 0x{i:02X}, // Value {i}' for i in range(8)]
+        lines.append(f'    E{n}M_MASK = 0x07,')
+        lines += [f'    E{n}F_Flag{i} = 0x{8 << i:02X}, // Flag {i}' for i in range(5)]
+        lines.append('};')
+    lines += ['', 'static constexpr uint8_t ConfigVersion = 1;', 'static constexpr uint8_t LC_ConfigVersion = 1;', '']
+    lines += ['struct Config_V1 {', '    uint32_t crc;', '    uint16_t size;', '    uint8_t version;', '    uint8_t pad0 = 0;']
+    for n in range(groups):
+        match rnd.randrange(4):
+            case 0:
+                lines.append(f'    uint32_t u32_{n} = {rnd.randrange(1 << 32)}; // 32 bit value')
+            case 1:
+                lines += [f'    int16_t i16_{n}_{i} = {rnd.randrange(-1000, 1000)};' for i in range(2)]
+            case 2:
+                for i in range(4):
+                    e = rnd.randrange(enums)
+                    lines.append(f'    Enum{e} e_{n}_{i} = E{e}M_V{rnd.randrange(8)}|E{e}F_Flag{rnd.randrange(5)}; // enum')
+            case 3:
+                lines.append(f'    char s_{n}[{4 * rnd.randrange(1, 5)}] = {{0}};')
+    lines += ['    uint32_t reserved = 0;', '};', '']
+    with open(fname, 'w') as f:
+        f.write('\n'.join(lines))
+
+def synthetic_bitstream(size: int, seed: int = 1) -> bytes:
+    """
+        Bitstream-like data: zero runs, 0xFF fill, repeated frames and random bytes
+    """
+    rnd = random.Random(seed)
+    frames = [bytes(rnd.choice((0, 0, 0, 0, 1, 2, 0x80, 0xFF)) for _ in range(336)) for _ in range(32)]
+    result = bytearray()
+    while len(result) < size:
+        match rnd.randrange(4):
+            case 0: result += bytes(rnd.randrange(1, 2000))
+            case 1: result += b'\xFF' * rnd.randrange(1, 500)
+            case 2: result += rnd.choice(frames)
+            case 3: result += rnd.randbytes(rnd.randrange(1, 300))
+    return bytes(result[:size])
+
+#################################################################################################
+## Benchmarks
+#
+# Benchmark groups yield (name, run) pairs - 'run' measures and returns Result, so filtered out benchmarks are not measured
+
+Case = tuple[str, Callable[[], Result]]
+
+def case(name: str, func: Callable, repeat: int, size: int = 0, extra: Optional[dict] = None, per_call: int = 1) -> Case:
+    """
+        Benchmark of 'func' ('per_call' - number of operations in one call of 'func')
+    """
+    return name, lambda: Result(name, measure(func, repeat) / per_call, size, extra or {})
+
+def bench_crc(repeat: int) -> Iterator[Case]:
+    for size in (4096, 1 << 20):
+        data = random.Random(size).randbytes(size)
+        yield case(f'crc.eval_crc.{size}', lambda data=data: crc32.eval_crc(data), repeat, size)
+    data = random.Random(1).randbytes(4096)
+    yield case('crc.table.4096', lambda: crc32.crc32_table(data), repeat, len(data))
+
+def bench_config(repeat: int, tmp_dir: str) -> Iterator[Case]:
+    header = os.path.join(tmp_dir, 'setup_data.h')
+    synthetic_header(header)
+    yield case('config.parse_header', lambda: mstd.Config(header), repeat, os.path.getsize(header))
+    cfg = mstd.Config(header)
+    schema = json.loads(json.dumps(cfg.to_schema()))
+    yield case('config.from_schema', lambda: mstd.Config.from_schema(schema), repeat)
+    cdata = mstd.ConfigData(cfg)
+    image = cdata.get_full_binary()
+    yield case('config.get_full_binary', cdata.get_full_binary, repeat, len(image), {'fields': len(cfg.cfg_struct)})
+    yield case('config.set_full_binary', lambda: cdata.set_full_binary(image), repeat, len(image))
+    yield case('config.patch_binary_image', cdata.patch_binary_image, repeat, len(image))
+
+    enums = list(cfg.enums.values())
+    values = [(e, v) for e in enums for v in range(256)]
+    texts = [(e, e.int2str(v)) for e, v in values]
+    yield case('enum.int2str', lambda: [e.int2str(v) for e, v in values], repeat, per_call=len(values))
+    yield case('enum.str2int', lambda: [e.str2int(t) for e, t in texts], repeat, per_call=len(texts))
+
+def bench_bitpk(repeat: int) -> Iterator[Case]:
+    for size in (1 << 16, 1 << 20):
+        data = synthetic_bitstream(size)
+        for version in (1, 2):
+            packed = bitpk.pack(data, version=version)
+            extra = {'ratio': round(len(packed) / len(data), 4)}
+            yield case(f'bitpk.pack.v{version}.{size}', lambda data=data, version=version: bitpk.pack(data, version=version), repeat, size, extra)
+            yield case(f'bitpk.unpack.v{version}.{size}', lambda packed=packed: bitpk.unpack(packed), repeat, size)
+
+LINKS = {
+    'clean': Impairment(),
+    'loss2': Impairment(loss=0.02, seed=1),
+    'wifi': Impairment(loss=0.01, duplicate=0.01, reorder=0.01, latency=0.002, jitter=0.003, seed=2),
+}
+
+def tftp_send(name: str, impairment: Impairment, data: bytes, repeat: int) -> Result:
+    best = float('inf')
+    extra = {}
+    for _ in range(repeat):
+        impairment.rnd.seed(impairment.seed)
+        with DeviceEmulator(port=0, impairment=impairment, recv_timeout=5) as emu:
+            client = mstd.TFTPClient('127.0.0.1', port=emu.port, blk_size=1468, window_size=8)
+            start = time.perf_counter()
+            client.send('fw.bin', data, False)
+            elapsed = time.perf_counter() - start
+            assert emu.firmware == data, f'TFTP benchmark "{name}": firmware corrupted'
+        if elapsed < best:
+            best = elapsed
+            extra = {'dup_blocks': emu.transfers[0].duplicates, 'dropped': emu.link_in.dropped + emu.link_out.dropped}
+    return Result(f'tftp.send.{name}', best, len(data), extra)
+
+def bench_tftp(repeat: int, size: int = 1 << 18) -> Iterator[Case]:
+    data = b'\xE9' + random.Random(2).randbytes(size - 1)
+    for name, impairment in LINKS.items():
+        yield f'tftp.send.{name}', lambda name=name, impairment=impairment: tftp_send(name, impairment, data, repeat)
+
+GROUPS = ('crc', 'config', 'bitpk', 'tftp')
+
+def run(groups: list[str], repeat: int, name_filter: Optional[str], verbose: bool) -> list[Result]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gens = {
+            'crc': lambda: bench_crc(repeat),
+            'config': lambda: bench_config(repeat, tmp_dir),
+            'bitpk': lambda: bench_bitpk(repeat),
+            'tftp': lambda: bench_tftp(min(repeat, 3)),
+        }
+        for group in groups:
+            for name, measure_case in gens[group]():
+                if name_filter and not re.search(name_filter, name):
+                    continue
+                result = measure_case()
+                results.append(result)
+                if verbose:
+                    print(result)
+    return results
+
+#################################################################################################
+## Report and baseline
+
+def to_json(results: list[Result]) -> dict:
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'crc_backend': 'zlib' if crc32._fast_crc32 else 'table',
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {r.name: {'seconds': r.seconds, 'size': r.size, 'mb_s': r.mb_s, **r.extra} for r in results}
+    }
+
+def compare(results: list[Result], baseline: dict, tolerance: float) -> list[str]:
+    """
+        Print comparison with baseline, return names of regressions (slower than baseline by more than 'tolerance')
+    """
+    regressions = []
+    base = baseline['results']
+    print(f'{"benchmark":<32} {"baseline us":>12} {"current us":>12} {"change":>8}')
+    for r in results:
+        if r.name not in base:
+            print(f'{r.name:<32} {"-":>12} {r.seconds*1e6:12.1f}      new')
+            continue
+        ratio = r.seconds / base[r.name]['seconds']
+        mark = ''
+        if ratio > 1 + tolerance:
+            regressions.append(r.name)
+            mark = ' REGRESSION'
+        print(f'{r.name:<32} {base[r.name]["seconds"]*1e6:12.1f} {r.seconds*1e6:12.1f} {ratio-1:+8.1%}{mark}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='Benchmarks of cfg_compiler and bitpk')
+    parser.add_argument('groups', nargs='*', help=f'Benchmark groups to run (default - all): {", ".join(GROUPS)}')
+    parser.add_argument('-o', '--output', help='Write results to JSON file')
+    parser.add_argument('-b', '--baseline', help='Compare with baseline JSON (exit code 1 on regression), reference one is benchmark_baseline.json')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='Allowed slowdown against baseline (0.25 - 25%%)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Best of this number of runs')
+    parser.add_argument('-k', '--filter', help='Run only benchmarks with names matching this regex')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not print results')
+    args = parser.parse_args()
+    for group in args.groups:
+        assert group in GROUPS, f'Unknown benchmark group "{group}" (groups are {", ".join(GROUPS)})'
+
+    results = run(args.groups or GROUPS, args.repeat, args.filter, not args.quiet and not args.baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(to_json(results), f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        assert not regressions, f'Slower than baseline: {", ".join(regressions)}'
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as exp:
+        print(f'ERROR: {exp}', file=sys.stderr)
+        sys.exit(1)
@@ -3,12 +3,30 @@ import argparse
 import sys
 import re
 import os
+import time
 import tomllib
+import asyncio
+import mmap
+import json
+import hashlib
+import pprint
+import csv
+import tarfile
+import contextlib
+import threading
+import socketserver
+import collections
+import http.server
+import signal
+import importlib.util
 
 from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import *
-from struct import unpack
-from socket import socket, setdefaulttimeout, AF_INET, SOCK_DGRAM
+from struct import Struct, unpack, pack_into
+from socket import socket, AF_INET, SOCK_DGRAM
+
+from crc32 import eval_crc, crc32_patch
 
 @dataclass
 class EnumField:
@@ -27,6 +45,19 @@ class EnumDef:
     toc: dict[str, int] = field(init=False)
     masks: dict[str, int] = field(init=False)
     short_toc: dict[str, str] = field(init=False)
+    names: Optional[list[str]] = field(init=False, default=None, repr=False)    # int2str for each value of uint8_t enum (built on first use)
+    tokens: dict[str, int] = field(init=False, default_factory=dict, repr=False) # str2int of single item (short, full and Prefix.Short names)
+    decoded: dict[int, str] = field(init=False, default_factory=dict, repr=False) # int2str cache of wider enums (oldest evicted)
+
+    ENUM_SPLIT: ClassVar[re.Pattern] = re.compile(r'[\s,|]+')
+    DECODE_CACHE_SIZE: ClassVar[int] = 4096
+
+    def __getstate__(self):
+        # Decode tables are rebuilt on demand
+        return {k: v for k, v in self.__dict__.items() if k not in ('names', 'decoded')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, names=None, decoded={})
 
     def __str__(self):
         return f'enum class {self.name} : {self.base_type} {{\n' + ''.join(f'  {x}\n' for x in self.body) + '};\n'
@@ -46,8 +77,37 @@ class EnumDef:
                         self.short_toc[rest] = None
                     else:
                         self.short_toc[rest] = item.name
+        self.compile_tables()
+
+    def compile_tables(self):
+        """
+            Precompute decode/encode tables (after 'toc', 'masks' and 'short_toc' are set)
+        """
+        self.tokens = dict(self.toc)
+        for name, value in self.toc.items():
+            pref, dlm, short = name.partition('_')
+            if dlm:
+                self.tokens[f'{pref}.{short}'] = self.tokens[f'{pref}::{short}'] = value
+        for short, name in self.short_toc.items():
+            if name:
+                self.tokens[short] = self.toc[name]
+            else:
+                self.tokens.pop(short, None) # Ambiguous
+        self.names = None
+        self.decoded = {}
 
     def int2str(self, val: int) -> str:
+        if self.base_type == 'uint8_t' and 0 <= val < 256:
+            if self.names is None:
+                self.names = [self.decode(v) for v in range(256)]
+            return self.names[val]
+        if (result := self.decoded.get(val)) is None:
+            if len(self.decoded) >= self.DECODE_CACHE_SIZE:
+                del self.decoded[next(iter(self.decoded))]
+            result = self.decoded[val] = self.decode(val)
+        return result
+
+    def decode(self, val: int) -> str:
         result = []
         processed = 0
         for name, value in self.toc.items():
@@ -67,18 +127,17 @@ class EnumDef:
         return '|'.join(result)
 
     def str2int(self, val: str) -> int:
+        if (result := self.tokens.get(val)) is not None:
+            return result
+        return self.encode(val)
+
+    def encode(self, val: str) -> int:
         result = 0
-        for item in re.split(r'[\s,|]+', val):
-            if re.match(r'_|::|\.', item):
-                item = re.sub(r'_|::|\.', '_', item)
-                assert item in self.toc, f'Enum item  "{item}" not valid for Enum "{self.name}" (valid values are {list(self.toc.keys())})'
-                result |= self.toc[item]
+        for item in self.ENUM_SPLIT.split(val):
+            if (bits := self.tokens.get(item)) is not None:
+                result |= bits
             elif item in self.short_toc:
-                v = self.short_toc[item]
-                assert v, f'Enum item  "{item}" is ambigous in Enum "{self.name}" (enum items are {list(self.toc.keys())})'
-                result |= self.toc[v]
-            elif item in self.toc:
-                result |= self.toc[item]
+                assert False, f'Enum item  "{item}" is ambigous in Enum "{self.name}" (enum items are {list(self.toc.keys())})'
             elif item:
                 assert False, f'Short Enum item "{item}" is unknown for Enum "{self.name}" (valid values are {list(self.toc.keys())})'
         return result            
@@ -123,8 +182,18 @@ BASE_SIZES = {
     'int64_t': 8, 'uint64_t': 8
 }
 
+STRUCT_CODES = {
+    'int8_t' : 'b', 'uint8_t':  'B',
+    'int16_t': 'h', 'uint16_t': 'H',
+    'int32_t': 'i', 'uint32_t': 'I',
+    'int64_t': 'q', 'uint64_t': 'Q'
+}
+
 class Config:
-    def __init__(self, fname: str):
+    def __init__(self, fname: Optional[str] = None):
+        """
+            Parse C++ header 'fname'. Without 'fname' Config is empty (see 'from_schema')
+        """
         self.version = 0
         self.lc_version = 0
         self.max_cfg_size = 4096
@@ -136,6 +205,8 @@ class Config:
 
         in_struct = False
 
+        if fname is None:
+            return
         with open(fname, "rt") as f:
             for line in f:
                 self.lnum += 1
@@ -167,6 +238,60 @@ class Config:
             assert self.version, 'ConfigVersion not specified (or zero) in config'
             assert self.lc_version <= self.version, f'LC_ConfigVersion ({self.lc_version}) is greater than ConfigVersion ({self.version})'
             assert self.size % 4 == 0, f'Config size (self.size) is not aligned to 4'
+        self.compile_codec()
+
+    def compile_codec(self):
+        """
+            Build struct.Struct for whole Config: fillers are pad bytes, strings are 'Ns'.
+            'codec_fields' are fields in order of values in packed/unpacked tuple
+        """
+        fmt = ['<']
+        self.codec_fields : list[CfgField] = []
+        for fld in self.cfg_struct:
+            if fld.is_filler:
+                fmt.append(f'{fld.size}x')
+                continue
+            fmt.append(f'{fld.size}s' if fld.val_type == 'char' else STRUCT_CODES[fld.tp])
+            self.codec_fields.append(fld)
+        self.codec = Struct(''.join(fmt))
+        assert self.codec.size == self.size, f'Packed Config size {self.codec.size} is not equal to Config size {self.size}'
+
+    def to_schema(self) -> dict:
+        """
+            Compiled Config as plain data (for cache and generated modules)
+        """
+        return {
+            'version': self.version,
+            'lc_version': self.lc_version,
+            'max_cfg_size': self.max_cfg_size,
+            'enums': {e.name: {
+                'base_type': e.base_type,
+                'body': [[x.name, x.value, x.comment] for x in e.body],
+                'toc': e.toc,
+                'masks': e.masks,
+                'short_toc': e.short_toc
+            } for e in self.enums.values()},
+            'fields': [[f.name, f.size, f.shift, f.val_default, f.val_type, f.enum_ref.name if f.enum_ref else None, f.comment] for f in self.cfg_struct]
+        }
+
+    @classmethod
+    def from_schema(cls, schema: dict) -> 'Config':
+        result = cls()
+        result.version = schema['version']
+        result.lc_version = schema['lc_version']
+        result.max_cfg_size = schema['max_cfg_size']
+        for name, e in schema['enums'].items():
+            enum = EnumDef(name, e['base_type'], [EnumField(*x) for x in e['body']])
+            enum.toc = e['toc']
+            enum.masks = e['masks']
+            enum.short_toc = e['short_toc']
+            enum.compile_tables()
+            result.enums[name] = enum
+        for name, size, shift, val_default, val_type, enum_name, comment in schema['fields']:
+            result.cfg_struct.append(CfgField(name, size, shift, val_default, val_type, result.enums[enum_name] if enum_name else None, comment))
+            result.size += size
+        result.compile_codec()
+        return result
 
     def __str__(self):
         lines = [
@@ -237,6 +362,7 @@ class ConfigData:
         self.data = {}
         for fld in cfg.cfg_struct:
             self.data[fld.name] = DataSlot(fld.val_default, fld)
+        self.codec_slots = [self.data[fld.name] for fld in cfg.codec_fields]
 
     def has_field(self, name: str) -> bool:
         return name in self.data
@@ -264,29 +390,29 @@ class ConfigData:
         assert len(result) <= fld.size
         return result.ljust(fld.size, b'\0')
 
+    def binary_values(self) -> list[bytes|int]:
+        """
+            Values in order of Config.codec
+        """
+        return [slot.value or (b'' if slot.fld.val_type == 'char' else 0) for slot in self.codec_slots]
+
     def get_full_binary(self) -> bytes:
-        result = []
-        for fld in self.cfg.cfg_struct:
-            if fld.is_filler:
-                result.append(fld.size * b'\0')
-            else:
-                result.append(self.get_binary_value(fld.name))
-        return b''.join(result)
+        return self.cfg.codec.pack(*self.binary_values())
 
-    def patch_binary_image(self, set_crc: bool = True):
+    def patch_binary_image(self, set_crc: bool = True) -> bytes:
+        """
+            Set 'version', 'size' and 'crc' fields. Return binary image
+        """
         self.set_toml_value('version', self.cfg.version)
-        bin_img = self.get_full_binary()
-        assert len(bin_img) % 4 == 0
-        size = len(bin_img)//4-1
-        self.set_toml_value('size', size)
-        bin_img = self.get_full_binary()
-        if set_crc:
-            crc = eval_crc(bin_img[4:])
-        else:
-            if self.get_toml_value('crc'):
-                return
-            crc = 0xFFFFFFFF
+        self.set_toml_value('size', self.cfg.codec.size//4-1)
+        if not set_crc and self.get_toml_value('crc'):
+            return self.get_full_binary()
+        bin_img = bytearray(self.cfg.codec.size)
+        self.cfg.codec.pack_into(bin_img, 0, *self.binary_values())
+        crc = eval_crc(memoryview(bin_img)[4:]) if set_crc else 0xFFFFFFFF
         self.set_toml_value('crc', crc)
+        pack_into('<I', bin_img, 0, crc) # 'crc' is first field of Config
+        return bytes(bin_img)
 
     def get_full_toml(self, with_hidden_fields: bool = False) -> str:
         result = []
@@ -335,12 +461,11 @@ class ConfigData:
                 self.set_toml_value(key, val)
 
     def set_full_binary(self, val: bytes):
-        for fld in self.cfg.cfg_struct:
-            if fld.is_filler:
-                zval = val[:fld.size]
-            else:
-                self.set_binary_value(fld.name, val[:fld.size])
-            val = val[fld.size:]
+        codec = self.cfg.codec
+        if len(val) < codec.size: # Truncated image (forced load) - missed tail is zero
+            val = bytes(val).ljust(codec.size, b'\0')
+        for slot, value in zip(self.codec_slots, codec.unpack_from(val)):
+            slot.value = value
 
     def is_binary_accepted(self, val: bytes) -> str:
         warn = []
@@ -351,7 +476,7 @@ class ConfigData:
         if bh.crc == 0xFFFFFFFF:
             warn.append("Autofilled CRC field detected in Binary config image. This is not safe\n")
         else:
-            crc = eval_crc(val[4:])
+            crc = eval_crc(memoryview(val)[4:])
             assert bh.crc == crc, f'Wrong CRC of config: {crc:04X}, expected {bh.crc:04X}'
         vers = self.get_toml_value('version')
         assert (self.cfg.lc_version <= bh.version <= self.cfg.version), f'Binary config version {bh.version} not in expected range {self.cfg.lc_version} - {self.cfg.version}'
@@ -379,13 +504,64 @@ class ConfigData:
 
     ## Save
     def save_bin_config(self, unsafe_crc: bool) -> bytes:
-        self.patch_binary_image(not unsafe_crc)
-        return self.get_full_binary()
+        return self.patch_binary_image(not unsafe_crc)
 
     def save_text_config(self, unsafe_crg: bool, hidden_fields: bool) -> str:
         self.patch_binary_image(not unsafe_crg)
         return self.get_full_toml(hidden_fields)
 
+SCHEMA_FORMAT = 1   # Increment on any change of Config.to_schema - invalidates schema cache
+
+def schema_cache_dir() -> str:
+    if path := os.environ.get('MSTD_CACHE_DIR'):
+        return path
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'mstd')
+
+def load_schema_module(fname: str) -> dict:
+    spec = importlib.util.spec_from_file_location('mstd_schema', fname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert hasattr(module, 'SCHEMA'), f'No SCHEMA in {fname}'
+    return module.SCHEMA
+
+def load_config(fname: str, use_cache: bool = True) -> Config:
+    """
+        Load Config from C++ header or from generated schema module (*.py).
+        Compiled header is cached in user cache directory, keyed by content hash of header
+    """
+    if fname.endswith('.py'):
+        return Config.from_schema(load_schema_module(fname))
+    if not use_cache:
+        return Config(fname)
+    with open(fname, 'rb') as f:
+        key = hashlib.sha256(f'{SCHEMA_FORMAT}:'.encode() + f.read()).hexdigest()[:32]
+    cache_name = os.path.join(schema_cache_dir(), f'schema-{key}.json')
+    try:
+        with open(cache_name, 'rt') as f:
+            return Config.from_schema(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    cfg = Config(fname)
+    try:
+        os.makedirs(os.path.dirname(cache_name), exist_ok=True)
+        tmp_name = f'{cache_name}.{os.getpid()}.tmp'
+        with open(tmp_name, 'wt') as f:
+            json.dump(cfg.to_schema(), f)
+        os.replace(tmp_name, cache_name)
+    except OSError:
+        pass    # Cache is optional
+    return cfg
+
+def emit_schema_module(cfg: Config, src_name: str, fname: str):
+    with open(fname, 'wt') as f:
+        f.write(f'# Compiled Config_V{cfg.version} schema, generated by mstd.cfg.py from {os.path.basename(src_name)}. Do not edit.\n')
+        f.write(f'# Use it as -c {os.path.basename(fname)} instead of C++ header\n\n')
+        f.write(f'SCHEMA = {pprint.pformat(cfg.to_schema(), width=120, sort_dicts=False)}\n')
+
 def toml_repr(data: int|str) -> str:
     if isinstance(data, int):
         return str(data)
@@ -404,47 +580,6 @@ def toml_repr(data: int|str) -> str:
     }
     return '"' + re.sub('\b|\t|\n|\f|\r|"\\', lambda x: ENC[x.group(0)], data) + '"'
 
-CRC32_LE_TABLE = [
-    0x00000000, 0x77073096, 0xee0e612c, 0x990951ba, 0x076dc419, 0x706af48f, 0xe963a535, 0x9e6495a3,
-    0x0edb8832, 0x79dcb8a4, 0xe0d5e91e, 0x97d2d988, 0x09b64c2b, 0x7eb17cbd, 0xe7b82d07, 0x90bf1d91,
-    0x1db71064, 0x6ab020f2, 0xf3b97148, 0x84be41de, 0x1adad47d, 0x6ddde4eb, 0xf4d4b551, 0x83d385c7,
-    0x136c9856, 0x646ba8c0, 0xfd62f97a, 0x8a65c9ec, 0x14015c4f, 0x63066cd9, 0xfa0f3d63, 0x8d080df5,
-    0x3b6e20c8, 0x4c69105e, 0xd56041e4, 0xa2677172, 0x3c03e4d1, 0x4b04d447, 0xd20d85fd, 0xa50ab56b,
-    0x35b5a8fa, 0x42b2986c, 0xdbbbc9d6, 0xacbcf940, 0x32d86ce3, 0x45df5c75, 0xdcd60dcf, 0xabd13d59,
-    0x26d930ac, 0x51de003a, 0xc8d75180, 0xbfd06116, 0x21b4f4b5, 0x56b3c423, 0xcfba9599, 0xb8bda50f,
-    0x2802b89e, 0x5f058808, 0xc60cd9b2, 0xb10be924, 0x2f6f7c87, 0x58684c11, 0xc1611dab, 0xb6662d3d,
-    0x76dc4190, 0x01db7106, 0x98d220bc, 0xefd5102a, 0x71b18589, 0x06b6b51f, 0x9fbfe4a5, 0xe8b8d433,
-    0x7807c9a2, 0x0f00f934, 0x9609a88e, 0xe10e9818, 0x7f6a0dbb, 0x086d3d2d, 0x91646c97, 0xe6635c01,
-    0x6b6b51f4, 0x1c6c6162, 0x856530d8, 0xf262004e, 0x6c0695ed, 0x1b01a57b, 0x8208f4c1, 0xf50fc457,
-    0x65b0d9c6, 0x12b7e950, 0x8bbeb8ea, 0xfcb9887c, 0x62dd1ddf, 0x15da2d49, 0x8cd37cf3, 0xfbd44c65,
-    0x4db26158, 0x3ab551ce, 0xa3bc0074, 0xd4bb30e2, 0x4adfa541, 0x3dd895d7, 0xa4d1c46d, 0xd3d6f4fb,
-    0x4369e96a, 0x346ed9fc, 0xad678846, 0xda60b8d0, 0x44042d73, 0x33031de5, 0xaa0a4c5f, 0xdd0d7cc9,
-    0x5005713c, 0x270241aa, 0xbe0b1010, 0xc90c2086, 0x5768b525, 0x206f85b3, 0xb966d409, 0xce61e49f,
-    0x5edef90e, 0x29d9c998, 0xb0d09822, 0xc7d7a8b4, 0x59b33d17, 0x2eb40d81, 0xb7bd5c3b, 0xc0ba6cad,
-    0xedb88320, 0x9abfb3b6, 0x03b6e20c, 0x74b1d29a, 0xead54739, 0x9dd277af, 0x04db2615, 0x73dc1683,
-    0xe3630b12, 0x94643b84, 0x0d6d6a3e, 0x7a6a5aa8, 0xe40ecf0b, 0x9309ff9d, 0x0a00ae27, 0x7d079eb1,
-    0xf00f9344, 0x8708a3d2, 0x1e01f268, 0x6906c2fe, 0xf762575d, 0x806567cb, 0x196c3671, 0x6e6b06e7,
-    0xfed41b76, 0x89d32be0, 0x10da7a5a, 0x67dd4acc, 0xf9b9df6f, 0x8ebeeff9, 0x17b7be43, 0x60b08ed5,
-    0xd6d6a3e8, 0xa1d1937e, 0x38d8c2c4, 0x4fdff252, 0xd1bb67f1, 0xa6bc5767, 0x3fb506dd, 0x48b2364b,
-    0xd80d2bda, 0xaf0a1b4c, 0x36034af6, 0x41047a60, 0xdf60efc3, 0xa867df55, 0x316e8eef, 0x4669be79,
-    0xcb61b38c, 0xbc66831a, 0x256fd2a0, 0x5268e236, 0xcc0c7795, 0xbb0b4703, 0x220216b9, 0x5505262f,
-    0xc5ba3bbe, 0xb2bd0b28, 0x2bb45a92, 0x5cb36a04, 0xc2d7ffa7, 0xb5d0cf31, 0x2cd99e8b, 0x5bdeae1d,
-    0x9b64c2b0, 0xec63f226, 0x756aa39c, 0x026d930a, 0x9c0906a9, 0xeb0e363f, 0x72076785, 0x05005713,
-    0x95bf4a82, 0xe2b87a14, 0x7bb12bae, 0x0cb61b38, 0x92d28e9b, 0xe5d5be0d, 0x7cdcefb7, 0x0bdbdf21,
-    0x86d3d2d4, 0xf1d4e242, 0x68ddb3f8, 0x1fda836e, 0x81be16cd, 0xf6b9265b, 0x6fb077e1, 0x18b74777,
-    0x88085ae6, 0xff0f6a70, 0x66063bca, 0x11010b5c, 0x8f659eff, 0xf862ae69, 0x616bffd3, 0x166ccf45,
-    0xa00ae278, 0xd70dd2ee, 0x4e048354, 0x3903b3c2, 0xa7672661, 0xd06016f7, 0x4969474d, 0x3e6e77db,
-    0xaed16a4a, 0xd9d65adc, 0x40df0b66, 0x37d83bf0, 0xa9bcae53, 0xdebb9ec5, 0x47b2cf7f, 0x30b5ffe9,
-    0xbdbdf21c, 0xcabac28a, 0x53b39330, 0x24b4a3a6, 0xbad03605, 0xcdd70693, 0x54de5729, 0x23d967bf,
-    0xb3667a2e, 0xc4614ab8, 0x5d681b02, 0x2a6f2b94, 0xb40bbe37, 0xc30c8ea1, 0x5a05df1b, 0x2d02ef8d,
-]
-
-def eval_crc(data: bytes) -> int:
-    crc = 0xFFFFFFFF
-    for b in data:
-        crc = CRC32_LE_TABLE[(crc ^ b) & 0xff] ^ (crc >> 8)
-    return crc ^ 0xFFFFFFFF
-
 @dataclass
 class BinHeader:
     crc: int        # 4 bytes
@@ -457,6 +592,165 @@ def decode_header(val: bytes) -> BinHeader:
     return BinHeader(crc, size, version)
 
 
+@dataclass
+class RttEstimator:
+    """
+        Retransmission timer for one transfer (RFC 6298 style).
+        RTT is sampled only for packets which were not retransmitted (Karn's algorithm),
+        on timeout RTO is doubled up to 'max_rto'
+    """
+    rto: float = 1.0                # Current retransmission timeout (seconds)
+    min_rto: float = 0.05
+    max_rto: float = 5.0
+    srtt: Optional[float] = None    # Smoothed RTT
+    rttvar: float = 0.0             # RTT variation
+    started: Optional[float] = None # Time of first transmission of packet we wait answer for
+
+    def start(self, valid: bool = True):
+        """
+            Packet was sent. 'valid' is False for retransmissions - answer for them can't be sampled
+        """
+        self.started = time.monotonic() if valid else None
+
+    def stop(self) -> Optional[float]:
+        """
+            Answer was received. Return RTT sample (None if answer can't be sampled)
+        """
+        if self.started is None:
+            return None
+        rtt = time.monotonic() - self.started
+        self.sample(rtt)
+        self.started = None
+        return rtt
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+    def backoff(self):
+        self.started = None
+        self.rto = min(self.rto * 2, self.max_rto)
+
+    def reset(self):
+        """
+            New transfer on same path - keep RTT estimation, drop backoff
+        """
+        self.started = None
+        if self.srtt is not None:
+            self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+@dataclass
+class TransferStats:
+    """
+        Telemetry of one TFTP transfer.
+        Slow device (flash write) shows as long gaps between ACKs with good RTT of other packets and few timeouts,
+        lossy link - as timeouts and retransmits
+    """
+    host: str
+    file_name: str
+    direction: str                  # 'send' or 'read'
+    size: int = 0                   # Bytes transferred
+    blocks: int = 0                 # Blocks delivered (each counted once)
+    retransmits: int = 0            # Blocks and requests sent again
+    duplicates: int = 0             # Send: duplicate or stray ACK, read: out of order or duplicate DATA
+    timeouts: int = 0
+    unconfirmed: bool = False       # Send: ACK of last block never came (assumed lost - MSTD ignores repeated last block)
+    block_size: int = 0             # Negotiated options
+    window_size: int = 0
+    rtt: list[float] = field(default_factory=list)      # RTT samples (not retransmitted packets only)
+    gaps: list[float] = field(default_factory=list)     # Time between progress: accepted ACKs (send) or in order DATA (read)
+    started: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+    last_progress: Optional[float] = None
+
+    GAP_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def progress(self):
+        now = time.monotonic()
+        self.gaps.append(now - (self.last_progress or self.started))
+        self.last_progress = now
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+    @classmethod
+    def histogram(cls, values: list[float]) -> dict[str, int]:
+        """
+            Count of values by upper bounds ('<=10ms', ..., '>5s')
+        """
+        result = {}
+        for bound in cls.GAP_BOUNDS:
+            result[f'<={bound*1000:g}ms'] = 0
+        result[f'>{cls.GAP_BOUNDS[-1]:g}s'] = 0
+        keys = list(result)
+        for val in values:
+            pos = next((n for n, bound in enumerate(cls.GAP_BOUNDS) if val <= bound), len(cls.GAP_BOUNDS))
+            result[keys[pos]] += 1
+        return result
+
+    @staticmethod
+    def percentiles(values: list[float]) -> dict[str, float]:
+        if not values:
+            return {}
+        values = sorted(values)
+        pick = lambda q: values[min(int(q * len(values)), len(values) - 1)]
+        return {'min': values[0], 'avg': sum(values) / len(values), 'p50': pick(0.5), 'p95': pick(0.95), 'max': values[-1]}
+
+    def to_json(self) -> dict:
+        return {
+            'host': self.host, 'file_name': self.file_name, 'direction': self.direction,
+            'size': self.size, 'elapsed': self.elapsed, 'bytes_per_s': self.throughput,
+            'blocks': self.blocks, 'retransmits': self.retransmits, 'duplicates': self.duplicates, 'timeouts': self.timeouts,
+            'unconfirmed': self.unconfirmed,
+            'block_size': self.block_size, 'window_size': self.window_size,
+            'rtt': self.percentiles(self.rtt), 'gap': self.percentiles(self.gaps), 'gap_histogram': self.histogram(self.gaps)
+        }
+
+    def __str__(self):
+        ms = lambda vals: ' '.join(f'{k}={v*1000:.1f}' for k, v in self.percentiles(vals).items()) or '-'
+        lines = [
+            f'{self.direction} {self.file_name} {self.host}: {self.size} bytes in {self.elapsed:.2f}s ({self.throughput/1024:.1f} KB/s), blksize {self.block_size}, windowsize {self.window_size}',
+            f'  blocks {self.blocks}, retransmits {self.retransmits}, duplicates {self.duplicates}, timeouts {self.timeouts}' + (', last block unconfirmed' if self.unconfirmed else ''),
+            f'  RTT ms: {ms(self.rtt)}',
+            f'  gap ms: {ms(self.gaps)}',
+            '  gaps: ' + ' '.join(f'{k}:{v}' for k, v in self.histogram(self.gaps).items() if v)
+        ]
+        return '\n'.join(lines)
+
+def make_stats_hook(print_stats: bool, json_file: Optional[str]) -> Callable[[TransferStats], None]:
+    """
+        Hook for TFTPClient: print stats of each transfer to stderr and/or append it to JSON Lines file (one transfer per line).
+        File is truncated here, each line is written as soon as transfer is finished (file is complete if tool is killed)
+    """
+    if json_file:
+        open(json_file, 'w').close()
+    def hook(stats: TransferStats):
+        if print_stats:
+            print(stats, file=sys.stderr)
+        if json_file:
+            with open(json_file, 'a') as f:
+                f.write(json.dumps(stats.to_json()) + '\n')
+    return hook
+
+
+class TFTPServerError(AssertionError):
+    """
+        ERROR packet received from TFTP server
+    """
+    def __init__(self, code: int, message: str):
+        super().__init__(f"TFTP error: {message}")
+        self.code = code
+
 class TFTPClient:
     # TFTP packet types
     RRQ = 1
@@ -464,32 +758,177 @@ class TFTPClient:
     ACK = 4
     DATA = 3
     ERROR = 5
+    OACK = 6
+
+    # TFTP error codes
+    ERR_FILE_NOT_FOUND = 1     # MSTD: no config stored (read of cfg.cfg)
+    ERR_OPTIONS = 8            # Option negotiation refused (RFC 2347)
 
     # TFTP protocol constatnts
     DATA_SIZE = 512            # Block data size
     BLK_SIZE = DATA_SIZE + 4   # Block size with header
+    MIN_DATA_SIZE = 8          # blksize limits (RFC 2348)
+    MAX_DATA_SIZE = 65464
+    MAX_WINDOW_SIZE = 65535    # windowsize limit (RFC 7440)
 
     # Setup
-    MAX_RETRY_COUNT = 10       # Maximum number of retries in timeout cases
-    SOCK_TOUT = 5              # Timeout of socket communication (in seconds)
+    PORT = 69                  # Default server port
+    MAX_RETRY_COUNT = 10       # Maximum number of consecutive retries in timeout cases
+    SOCK_TOUT = 5              # Maximum timeout of socket communication (in seconds)
+    INIT_TOUT = 1              # Initial retransmission timeout (before first RTT sample)
+    MIN_TOUT = 0.05            # Minimal retransmission timeout
+    DALLY_COUNT = 2            # Timeouts after last block sent before its lost ACK is assumed (MSTD ignores repeated last block)
+
+    def __init__(self, host: str, blk_size: int = DATA_SIZE, window_size: int = 1,
+                 max_retry: int = MAX_RETRY_COUNT, deadline: Optional[float] = None, port: Optional[int] = None,
+                 stats_hook: Optional[Callable[[TransferStats], None]] = None):
+        """
+            'host' can be '<host>:<port>' ('port' argument overrides it).
+            'stats_hook' is called with TransferStats after each successful transfer ('stats' holds stats of last transfer)
+        """
+        assert self.MIN_DATA_SIZE <= blk_size <= self.MAX_DATA_SIZE, f'Block size {blk_size} out of range {self.MIN_DATA_SIZE} - {self.MAX_DATA_SIZE}'
+        assert 1 <= window_size <= self.MAX_WINDOW_SIZE, f'Window size {window_size} out of range 1 - {self.MAX_WINDOW_SIZE}'
+        host, _, host_port = host.partition(':')
+        self.addr = (host, port or int(host_port or self.PORT))
+        self.req_data_size = blk_size   # Block size we ask for
+        self.data_size = self.DATA_SIZE # Block size in effect for current transfer
+        self.req_window_size = window_size
+        self.window_size = 1            # Window size in effect for current transfer (1 - lock-step)
+        self.options = {}               # Options sent in last RRQ/WRQ
+        self.tsize = None               # Transfer size reported by server (RRQ only)
+        self.max_retry = max_retry
+        self.deadline = deadline        # Time limit for whole transfer (in seconds)
+        self.deadline_at = None
+        self.retry_count = 0
+        self.request_pending = False    # RRQ/WRQ is not answered yet
+        self.rtt = RttEstimator()
+        self.stats = None
+        self.stats_hook = stats_hook
+        self.data_hdr = bytearray([0, self.DATA, 0, 0]) # Header of DATA packet, reused for each block
+        self.socket = self.make_socket()
+
+    def make_socket(self):
+        return socket(AF_INET, SOCK_DGRAM)
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+    def flush(self):
+        """
+            Drop late packets of previous transfer (MSTD answers from same port for all transfers)
+        """
+        self.socket.setblocking(False)
+        try:
+            while True:
+                self.socket.recvfrom(0x10000)
+        except OSError:
+            pass
+        finally:
+            self.socket.setblocking(True)
+
+    def request_options(self, tsize: int) -> dict[str, int]:
+        """
+            Options for RRQ/WRQ (RFC 2347/2348/2349/7440)
+            'blksize' should go first - MSTD server (parse_wrq) looks only at first option
+            and answers by OACK with 'blksize=512', all other options are ignored by it
+        """
+        result = {}
+        if self.req_data_size != self.DATA_SIZE:
+            result['blksize'] = self.req_data_size
+        if self.req_window_size != 1:
+            result['windowsize'] = self.req_window_size
+        result['tsize'] = tsize
+        result['timeout'] = self.SOCK_TOUT
+        return result
 
-    def __init__(self, host: str):
-        self.addr = (host, 69)
-        setdefaulttimeout(self.SOCK_TOUT)
-        self.socket = socket(AF_INET, SOCK_DGRAM)
+    def start_transfer(self, mode: int, file_name: str, tsize: int):
+        self.data_size = self.DATA_SIZE
+        self.window_size = 1
+        self.tsize = None
+        self.retry_count = 0
+        self.request_pending = True
+        self.deadline_at = None if self.deadline is None else time.monotonic() + self.deadline
+        if self.rtt.srtt is None:
+            self.rtt = RttEstimator(self.INIT_TOUT, self.MIN_TOUT, self.SOCK_TOUT)
+        else:   # Socket was used by previous transfer - its RTT is still good
+            self.rtt.reset()
+        self.flush()
+        self.stats = TransferStats(f'{self.addr[0]}:{self.addr[1]}', file_name, 'send' if mode == self.WRQ else 'read')
+        self.options = self.request_options(tsize)
+        self.send_xrq_packet(mode, file_name, self.options)
+        self.rtt.start()
+
+    def finish_transfer(self, size: int):
+        self.stats.size = size
+        self.stats.finished = time.monotonic()
+        self.stats.block_size = self.data_size
+        self.stats.window_size = self.window_size
+        if self.stats_hook:
+            self.stats_hook(self.stats)
+
+    def answer_received(self):
+        """
+            Answer to packet we wait for - stop retransmission timer
+        """
+        self.request_pending = False
+        rtt = self.rtt.stop()
+        if rtt is not None:
+            self.stats.rtt.append(rtt)
 
-    def send_xrq_packet(self, mode: int, file_name: str):
+    def on_timeout(self, what: str):
+        """
+            Nothing received in time - check limits and back off retransmission timer
         """
-                   2 bytes    string   1 byte     string   1 byte
-                   -----------------------------------------------
-            RRQ/  | 01/02 |  Filename  |   0  |    Mode    |   0  |
-            WRQ    -----------------------------------------------
+        self.stats.timeouts += 1
+        self.retry_count += 1
+        assert self.retry_count < self.max_retry, f'Too many attempts to {what}, giving up!'
+        assert self.deadline_at is None or time.monotonic() < self.deadline_at, f'Transfer deadline ({self.deadline} s) exceeded, giving up!'
+        self.rtt.backoff()
+
+    def apply_options(self, oack: dict[str, str]):
+        """
+            Accept options from OACK. Server can only lower blksize and can't add options we don't ask
+        """
+        for name, val in oack.items():
+            assert name in self.options, f'TFTP Error: Server answered with unrequested option "{name}"'
+            assert val.isdigit(), f'TFTP Error: Wrong value of option "{name}": "{val}"'
+            val = int(val)
+            match name:
+                case 'blksize':
+                    assert self.MIN_DATA_SIZE <= val <= self.options[name], f'TFTP Error: Server answered with wrong blksize {val} (requested {self.options[name]})'
+                    self.data_size = val
+                case 'windowsize':
+                    assert 1 <= val <= self.options[name], f'TFTP Error: Server answered with wrong windowsize {val} (requested {self.options[name]})'
+                    self.window_size = val
+                case 'tsize':
+                    self.tsize = val
+                case 'timeout':
+                    assert val == self.options[name], f'TFTP Error: Server changed timeout to {val}'
+
+    def refuse_options(self):
+        """
+            Server refused options (ERROR 8) - fallback to plain RFC 1350 transfer
+        """
+        self.options = {}
+        self.data_size = self.DATA_SIZE
+        self.window_size = 1
+
+    def send_xrq_packet(self, mode: int, file_name: str, options: Optional[dict[str, int]] = None):
+        """
+                   2 bytes    string   1 byte     string   1 byte   string   1 byte   string   1 byte
+                   -----------------------------------------------------------------------------------
+            RRQ/  | 01/02 |  Filename  |   0  |    Mode    |   0  |  opt1  |   0  |  value1 |   0  | ...
+            WRQ    -----------------------------------------------------------------------------------
 
         """
         result = bytearray([0, mode])
         result += file_name.encode('utf-8')
         result.append(0)
         result += b'octet\0'
+        for name, val in (options or {}).items():
+            result += f'{name}\0{val}\0'.encode('ascii')
         self.socket.sendto(result, self.addr)
 
     def send_data_packet(self, pkt_n: int, data: bytes):
@@ -499,10 +938,11 @@ class TFTPClient:
             DATA  | 03    |   Block #  |    Data    |
                    ---------------------------------
         """
-        result = bytearray([0, self.DATA])
-        result += pkt_n.to_bytes(2, byteorder='big')
-        result += data
-        self.socket.sendto(result, self.remote_addr)
+        pack_into('>H', self.data_hdr, 2, pkt_n)
+        if hasattr(self.socket, 'sendmsg'): # Scatter/gather - header and data block are not joined
+            self.socket.sendmsg((self.data_hdr, data), (), 0, self.remote_addr)
+        else:
+            self.socket.sendto(self.data_hdr + data, self.remote_addr)
 
     def send_ack_packet(self, pkt_n: int):
         """
@@ -524,6 +964,19 @@ class TFTPClient:
         tp = int.from_bytes(data[:2], byteorder='big')
         val = int.from_bytes(data[2:4], byteorder='big')
         match tp:
+            case self.OACK:
+                """
+                         2 bytes   string   1 byte   string   1 byte
+                         -------------------------------------------
+                  OACK  | 06    |  opt1  |   0  |  value1 |   0  | ...
+                         -------------------------------------------
+                """
+                items = data[2:].rstrip(b'\0').split(b'\0')
+                if len(items) % 2:
+                    return None
+                items = [x.decode('ascii', errors='replace') for x in items]
+                return (tp, {name.lower(): val for name, val in zip(items[::2], items[1::2])}) # <OACK, {option: value}>
+
             case self.ACK:
                 return (tp, val)   # <ACK, PktN>
             case self.DATA:
@@ -539,88 +992,386 @@ class TFTPClient:
             case _:
                 return None
 
+    def get_timeout(self) -> float:
+        tout = self.rtt.rto
+        if self.request_pending:    # MSTD can be slow to answer request (WRQ of fw.bin erases OTA partition first)
+            tout = max(tout, self.SOCK_TOUT)
+        if self.deadline_at is not None:
+            tout = max(min(tout, self.deadline_at - time.monotonic()), 0.001)
+        return tout
+
     def get_answer(self) -> tuple:
-        rcv_buffer, addr = self.socket.recvfrom(self.BLK_SIZE)        
+        self.socket.settimeout(self.get_timeout())
+        rcv_buffer, addr = self.socket.recvfrom(max(self.data_size, self.req_data_size) + 4)
+        return self.accept_answer(rcv_buffer, addr)
+
+    def accept_answer(self, rcv_buffer: bytes, addr: tuple) -> tuple:
         assert addr[0] and addr[1], f"Host and port are invalid: {addr[0]}:{addr[1]}"
         self.remote_addr = addr
         rcvd_pkt = self.decode_packet(rcv_buffer)        
         assert rcvd_pkt, f'TFTP Error: Unknown packet {rcv_buffer.hex()}'
-        assert rcvd_pkt[0] != self.ERROR, f"TFTP error: {rcvd_pkt[2]}"
+        if rcvd_pkt[0] == self.ERROR and rcvd_pkt[1] == self.ERR_OPTIONS and self.options:
+            return rcvd_pkt # Caller will retry request without options
+        if rcvd_pkt[0] == self.ERROR:
+            raise TFTPServerError(rcvd_pkt[1], rcvd_pkt[2])
         return rcvd_pkt
-        
-    def send(self, fname: str, data: bytes, verbose: bool):
-        pkt_n = 0
-        start = 0
-        retry_count = 0
-        buffer = None
-        self.send_xrq_packet(self.WRQ, fname)
+
+    def run(self, engine: Generator) -> Any:
+        """
+            Drive transfer engine on blocking socket.
+            Engine yields when it waits for answer and gets either packet or TimeoutError thrown in
+        """
+        try:
+            next(engine)
+            while True:
+                try:
+                    rcvd_pkt = self.get_answer()
+                except TimeoutError:
+                    engine.throw(TimeoutError())
+                else:
+                    engine.send(rcvd_pkt)
+        except StopIteration as stop:
+            return stop.value
+
+    def send(self, fname: str, data: bytes|memoryview, verbose: bool):
+        self.run(self.send_engine(fname, data, verbose))
+
+    def read(self, fname: str) -> bytearray:
+        return self.run(self.read_engine(fname))
+
+    def send_engine(self, fname: str, data: bytes|memoryview, verbose: bool) -> Generator:
+        """
+            Sliding window sender (RFC 7440). Up to 'window_size' blocks are in flight,
+            ACK is cumulative. ACK of block inside of window means that server lost something -
+            restart window from next block after acknowledged one.
+            With window_size == 1 this is plain lock-step transfer
+        """
+        with memoryview(data) as view:  # Released even if transfer fails - ImageSource mmap can be closed after it
+            yield from self.send_blocks(fname, view, verbose)
+
+    def send_blocks(self, fname: str, data: memoryview, verbose: bool) -> Generator:
+        """
+            Body of 'send_engine'. Blocks are sliced from 'data' without copy
+        """
+        acked = 0           # Last block acknowledged by server
+        sent = 0            # Last block sent
+        max_sent = 0        # Last block ever sent (blocks up to it are retransmissions)
+        last = None         # Number of last block (known after options negotiation)
+        dally = 0           # Timeouts after whole file was sent
+        self.start_transfer(self.WRQ, fname, len(data))
         if verbose:
             print(f'Sending {fname}:', end='\r', file=sys.stderr)
             total = len(data)
         while True:
             try:
-                rcvd_pkt = self.get_answer()
-                if rcvd_pkt[0] == self.ACK and rcvd_pkt[1] == (pkt_n & 0xFFFF):
-                    buffer = data[start:(self.DATA_SIZE + start)]
-                    pkt_n += 1
-                    start += self.DATA_SIZE
-                    retry_count = 0
-                    if verbose:
-                        print(f'Sending {fname}: {start*100//total}%', end='\r', file=sys.stderr)
-                    self.send_data_packet(pkt_n, buffer)
-                    if len(buffer) < self.DATA_SIZE: # If our DATA block is less than 512 bytes, then that was the last packet
+                rcvd_pkt = yield
+                if last is None:
+                    if rcvd_pkt[0] == self.ERROR:
+                        self.refuse_options()
+                        self.send_xrq_packet(self.WRQ, fname)
+                        self.stats.retransmits += 1
+                        self.rtt.start(False)
+                        continue
+                    if rcvd_pkt[0] == self.OACK: # OACK acts as ACK of block 0
+                        self.apply_options(rcvd_pkt[1])
+                        rcvd_pkt = (self.ACK, 0)
+                    if rcvd_pkt != (self.ACK, 0):
+                        continue
+                    last = len(data) // self.data_size + 1 # Last block is always shorter than block size (can be empty)
+                elif rcvd_pkt[0] != self.ACK:
+                    continue
+                else:
+                    delta = (rcvd_pkt[1] - acked) & 0xFFFF
+                    if not delta or delta > sent - acked: # Duplicate or stray ACK - ignore it (avoid Sorcerer's Apprentice Syndrome)
+                        self.stats.duplicates += 1
+                        continue
+                    acked += delta
+                    self.stats.blocks += delta
+                    self.stats.progress()
+                    if acked == last:
+                        self.answer_received()
                         break
+                self.answer_received()
+                self.retry_count = 0
+                dally = 0
+                if verbose:
+                    print(f'Sending {fname}: {min(acked * self.data_size, total)*100//max(total, 1)}%', end='\r', file=sys.stderr)
+                self.rtt.start(acked >= max_sent)
+                sent = self.send_window(data, acked, last) # Restart window from first unacknowledged block
+                self.stats.retransmits += max(min(sent, max_sent) - acked, 0)
+                max_sent = max(max_sent, sent)
             except TimeoutError:
-                retry_count += 1
-                assert retry_count < self.MAX_RETRY_COUNT, 'Too many attempts to retransmit, giving up!'
-                if buffer:
-                    self.send_data_packet(pkt_n, buffer)
+                if last is not None and acked == last - 1:
+                    # MSTD closes transfer on last block and drops DATA after it - repeated last block is never ACKed again.
+                    # Silence after all other blocks were ACKed is likely lost ACK of last block (lost last block is ACKed
+                    # on retransmission), but it can't be told from loss of all copies of last block - transfer is marked unconfirmed
+                    dally += 1
+                    if dally > self.DALLY_COUNT:
+                        self.stats.unconfirmed = True
+                        print(f'WARNING: {fname}: last block was not acknowledged (ACK lost?), transfer is unconfirmed', file=sys.stderr)
+                        break
+                self.on_timeout('retransmit')
+                if last is None:
+                    self.send_xrq_packet(self.WRQ, fname, self.options)
+                    self.stats.retransmits += 1
                 else:
-                    self.send_xrq_packet(self.WRQ, fname)
+                    sent = self.send_window(data, acked, last)
+                    self.stats.retransmits += sent - acked
+        self.finish_transfer(len(data))
         if verbose:
-            print(f'Sending {fname}: 100%', file=sys.stderr)
+            print(f'Sending {fname}: 100%' + (' (unconfirmed)' if self.stats.unconfirmed else ''), file=sys.stderr)
 
-    def read(self, fname: str) -> bytearray:
+    def send_window(self, data: memoryview, acked: int, last: int) -> int:
+        """
+            Send window of blocks after 'acked' one. Return number of last block sent
+        """
+        sent = min(acked + self.window_size, last)
+        for pkt_n in range(acked + 1, sent + 1):
+            start = (pkt_n - 1) * self.data_size
+            with data[start:(start + self.data_size)] as block:
+                self.send_data_packet(pkt_n & 0xFFFF, block)
+        return sent
+
+    def read_engine(self, fname: str) -> Generator:
+        """
+            Receiver side of RFC 7440: ACK every 'window_size' block (or last one).
+            On out of order block ACK last block received in sequence (once per gap)
+        """
         result = bytearray()
-        pkt_n = 1
-        retry_count = 0
-        self.send_xrq_packet(self.RRQ, fname)
+        pkt_n = 1           # Next expected block
+        in_window = 0       # Blocks received since last ACK
+        gap_acked = False   # Out of order block detected and already reported
+        oack_rcvd = False
+        self.start_transfer(self.RRQ, fname, 0)
         while True:
             try:
-                rcvd_pkt = self.get_answer()
-                if rcvd_pkt[0] == self.DATA:
+                rcvd_pkt = yield
+                if pkt_n == 1 and rcvd_pkt[0] == self.ERROR:
+                    self.refuse_options()
+                    self.send_xrq_packet(self.RRQ, fname)
+                    self.stats.retransmits += 1
+                    self.rtt.start(False)
+                elif pkt_n == 1 and rcvd_pkt[0] == self.OACK:
+                    self.answer_received()
+                    self.apply_options(rcvd_pkt[1])
+                    self.send_ack_packet(0)
+                    self.rtt.start(not oack_rcvd)
+                    oack_rcvd = True
+                elif rcvd_pkt[0] == self.DATA:
                     _, in_pkt_n, data = rcvd_pkt
                     if in_pkt_n == (pkt_n & 0xFFFF):
+                        self.answer_received()
+                        self.stats.blocks += 1
+                        self.stats.progress()
                         result += data
-                        self.send_ack_packet(pkt_n)
-                        if len(data) < self.DATA_SIZE: # Last packet was recieved
+                        in_window += 1
+                        self.retry_count = 0
+                        gap_acked = False
+                        if len(data) < self.data_size: # Last packet was recieved
+                            self.send_ack_packet(pkt_n & 0xFFFF)
                             break                                                                   
+                        if in_window >= self.window_size:
+                            self.send_ack_packet(pkt_n & 0xFFFF)
+                            self.rtt.start()
+                            in_window = 0
                         pkt_n += 1
-                        retry_count = 0
                     else:
-                        self.send_ack_packet(pkt_n)
+                        self.stats.duplicates += 1
+                        if not gap_acked:
+                            self.send_ack_packet((pkt_n - 1) & 0xFFFF)
+                            in_window = 0
+                            gap_acked = self.window_size > 1
             except TimeoutError:
-                retry_count += 1
-                assert retry_count < self.MAX_RETRY_COUNT, 'Too many attempts to read, giving up!'
-                if pkt_n == 1:
-                    self.send_xrq_packet(self.RRQ, fname)
+                self.on_timeout('read')
+                self.stats.retransmits += 1
+                if pkt_n == 1 and not oack_rcvd:
+                    self.send_xrq_packet(self.RRQ, fname, self.options)
                 else:
-                    self.send_ack_packet(pkt_n)
+                    self.send_ack_packet((pkt_n - 1) & 0xFFFF)
+                    in_window = 0
+        self.finish_transfer(len(result))
         return result
 
+
+class TFTPProtocol(asyncio.DatagramProtocol):
+    """
+        Datagram endpoint of AsyncTFTPClient - just queue everything received
+    """
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.error = None
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        self.queue.put_nowait((data, addr))
+
+    def error_received(self, exc: Exception):
+        self.error = exc
+
+
+class AsyncTFTPClient(TFTPClient):
+    """
+        TFTPClient on asyncio datagram endpoint. Transfer engines are the same,
+        but many transfers can run concurrently in one event loop.
+        Use 'await open()' before transfers and 'close()' after
+    """
+    def make_socket(self):
+        return None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.socket, self.protocol = await loop.create_datagram_endpoint(TFTPProtocol, local_addr=('0.0.0.0', 0))
+
+    def flush(self):
+        while not self.protocol.queue.empty():
+            self.protocol.queue.get_nowait()
+
+    async def get_answer(self) -> tuple:
+        if self.protocol.error:
+            raise self.protocol.error
+        rcv_buffer, addr = await asyncio.wait_for(self.protocol.queue.get(), self.get_timeout())
+        return self.accept_answer(rcv_buffer, addr)
+
+    async def run(self, engine: Generator) -> Any:
+        try:
+            next(engine)
+            while True:
+                try:
+                    rcvd_pkt = await self.get_answer()
+                except TimeoutError:
+                    engine.throw(TimeoutError())
+                else:
+                    engine.send(rcvd_pkt)
+        except StopIteration as stop:
+            return stop.value
+
+    async def send(self, fname: str, data: bytes|memoryview, verbose: bool):
+        await self.run(self.send_engine(fname, data, verbose))
+
+    async def read(self, fname: str) -> bytearray:
+        return await self.run(self.read_engine(fname))
+
+@dataclass
+class TransferOp:
+    file_name: str
+    data: Optional[bytes|memoryview] = None     # Data to send (None - read)
+    verbose: bool = False
+    result: Optional[bytearray] = None          # Data read
+
+class TFTPSession:
+    """
+        All transfers to one MSTD on one TFTPClient (one socket, RTT estimation is kept between transfers).
+        Transfers can be queued by 'add' and run back to back by 'run', or done at once by 'read'/'send'.
+        'get' returns shared session for host - all ConfigImage of a run use it
+    """
+    sessions: dict[str, 'TFTPSession'] = {}
+
+    def __init__(self, host: str, tftp_args: Optional[dict] = None):
+        self.host = host
+        self.client = TFTPClient(host, **(tftp_args or {}))
+        self.queue: list[TransferOp] = []
+
+    @classmethod
+    def get(cls, host: str, tftp_args: Optional[dict] = None) -> 'TFTPSession':
+        if host not in cls.sessions:
+            cls.sessions[host] = cls(host, tftp_args)
+        return cls.sessions[host]
+
+    @classmethod
+    def close_all(cls):
+        for session in cls.sessions.values():
+            session.close()
+        cls.sessions.clear()
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self) -> 'TFTPSession':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, file_name: str, data: Optional[bytes|memoryview] = None, verbose: bool = False) -> TransferOp:
+        """
+            Queue transfer: send 'data' as 'file_name' or read 'file_name' (if 'data' is None)
+        """
+        op = TransferOp(file_name, data, verbose)
+        self.queue.append(op)
+        return op
+
+    def run(self) -> list[TransferOp]:
+        """
+            Run queued transfers in order. Queue is cleared even if some transfer failed
+        """
+        queue, self.queue = self.queue, []
+        for op in queue:
+            if op.data is None:
+                op.result = self.client.read(op.file_name)
+            else:
+                self.client.send(op.file_name, op.data, op.verbose)
+        return queue
+
+    def read(self, file_name: str) -> bytearray:
+        return self.client.read(file_name)
+
+    def send(self, file_name: str, data: bytes|memoryview, verbose: bool):
+        self.client.send(file_name, data, verbose)
+
+class ImageSource:
+    """
+        Read-only binary image for streaming. File is memory mapped (read if it can't be mapped),
+        'view' is a memoryview of image - its slices are not copied.
+        Use as context manager, slices of 'view' should not outlive it
+    """
+    def __init__(self, fname: Optional[str] = None, data: Optional[bytes] = None):
+        self.mmap = None
+        if fname is not None:
+            with open(fname, 'rb') as f:
+                try:
+                    self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    data = self.mmap
+                except (ValueError, OSError): # Empty file or not a regular file
+                    data = f.read()
+        self.view = memoryview(data)
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def __enter__(self) -> memoryview:
+        return self.view
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+            Release image. If slices of 'view' are still alive (referenced from traceback of failed transfer)
+            mmap is left to garbage collector - BufferError should not replace exception being propagated
+        """
+        try:
+            self.view.release()
+            if self.mmap is not None:
+                self.mmap.close()
+        except BufferError:
+            pass
+        self.mmap = None
+
 class ConfigImage:
-    def __init__(self, file_name: str, mode: str = '', quiet: bool = False):
+    def __init__(self, file_name: str, mode: str = '', quiet: bool = False, tftp_args: Optional[dict] = None):
         """
             Open file/TFTP for read/write
             file_name is a file name, or '-' (for stdout/stdin)
-            of MSTD[:[:][//]<IP or host-name>]
+            of MSTD[:[:][//]<IP or host-name>[:<port>]]
 
             mode is optional (for TFTP only): 
                 full - use 'full.cfg' for file name
                 FW - use 'fw.bin' for file name
                 else - use 'cfg.cfg' for file name 
+
+            tftp_args - extra arguments for TFTPClient (blk_size, ...)
         """
         self.quiet = quiet
+        self.tftp_args = tftp_args or {}
         if file_name == 'MSTD' or file_name.startswith('MSTD:'):
             self.kind = 'T' # TFTP
             self.file_name = {'full': 'full.cfg', 'FW': 'fw.bin'}.get(mode or '', 'cfg.cfg')
@@ -649,7 +1400,7 @@ class ConfigImage:
     def value(self) -> str|bytes:
         match self.kind:
             case 'T':
-                return TFTPClient(self.ip).read(self.file_name)
+                return TFTPSession.get(self.ip, self.tftp_args).read(self.file_name)
             case '-':
                 return sys.stdin.readall()
             case _:
@@ -657,16 +1408,25 @@ class ConfigImage:
                     return f.read()
 
     @value.setter
-    def value(self, value: bytes|str):
+    def value(self, value: bytes|str|memoryview):
         match self.kind:
             case 'T':
-                TFTPClient(self.ip).send(self.file_name, value, not self.quiet)
+                TFTPSession.get(self.ip, self.tftp_args).send(self.file_name, value, not self.quiet)
             case '-':
                 sys.stdout.write(value)
             case _:
                 with open(self.file_name, 'w' + self.kind) as f:
                     f.write(value)
 
+    @property
+    def source(self) -> ImageSource:
+        """
+            Binary image for streaming (files are memory mapped)
+        """
+        if self.kind == 'b':
+            return ImageSource(self.file_name)
+        return ImageSource(data=self.value)
+
 def is_full_config_name(fname: str) -> bool:
     return fname.endswith('full.cfg')
 
@@ -674,14 +1434,1118 @@ def is_fw_file(fname: str) -> bool:
     if not fname.endswith('.bin'):
         return False
     return  os.path.getsize(fname) > 102400
+
+def load_config_data(cfg: Config, src_files: list[str], arg_override: list[tuple[str, str]], force: int, tftp_args: Optional[dict] = None,
+                     registry: Optional['SchemaRegistry'] = None) -> ConfigData:
+    """
+        Join all source configs and apply command line values override.
+        Binary configs of older versions are migrated by 'registry' (if any)
+    """
+    cdata = ConfigData(cfg)
+    for f in src_files:
+        src = ConfigImage(f, tftp_args=tftp_args)
+        if src.is_binary and registry:
+            migrated, notes = registry.decode(src.value, force)
+            for note in notes:
+                print(f'WARNING: {f}: {note}', file=sys.stderr)
+            cdata.set_full_binary(migrated.get_full_binary())
+        elif src.is_binary:
+            cdata.load_bin_config(src.value, force)
+        else:
+            cdata.load_text_config(src.value, force)
+    for name, val in arg_override:
+        cdata.set_cl_value(name, val)
+    return cdata
+
+#################################################################################################
+## Schema registry
+
+class SchemaRegistry:
+    """
+        Config layouts of all known versions (current one and historical Config_Vn from older headers or schema modules).
+        Binary config is decoded by layout of its 'version' byte and migrated field by field (by name) to current layout
+    """
+    HEADER_FIELDS = ('crc', 'size', 'version')
+
+    def __init__(self, current: Config, paths: Iterable[str] = (), use_cache: bool = True):
+        self.current = current
+        self.layouts: dict[int, Config] = {current.version: current}
+        self.plans: dict[int, list[tuple[CfgField, CfgField]]] = {}
+        for path in paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if name.endswith(('.h', '.py')):
+                        self.add(load_config(os.path.join(path, name), use_cache), os.path.join(path, name))
+            else:
+                self.add(load_config(path, use_cache), path)
+
+    def add(self, cfg: Config, src: str = ''):
+        if known := self.layouts.get(cfg.version):
+            assert known.to_schema()['fields'] == cfg.to_schema()['fields'], f'{src}: Config_V{cfg.version} differs from already loaded one'
+            return
+        assert cfg.version < self.current.version, f'{src}: Config_V{cfg.version} is newer than current Config_V{self.current.version}'
+        self.layouts[cfg.version] = cfg
+
+    @property
+    def versions(self) -> list[int]:
+        return sorted(self.layouts)
+
+    def plan(self, version: int) -> list[tuple[CfgField, CfgField]]:
+        """
+            (old field, new field) pairs of fields existing in both layouts (compiled once per version)
+        """
+        if version not in self.plans:
+            old = {fld.name: fld for fld in self.layouts[version].cfg_struct if not fld.is_filler}
+            self.plans[version] = [(old[fld.name], fld) for fld in self.current.cfg_struct
+                                   if fld.name in old and not fld.is_filler and fld.name not in self.HEADER_FIELDS]
+        return self.plans[version]
+
+    def decode(self, image: bytes, force: int = 0) -> tuple[ConfigData, list[str]]:
+        """
+            Decode binary config of any known version. Return config in current layout and notes about lost values
+        """
+        assert len(image) >= 8, f'Binary config too short: {len(image)} bytes'
+        version = decode_header(image).version
+        layout = self.layouts.get(version)
+        if layout is None and self.current.lc_version <= version <= self.current.version:
+            layout = self.current   # Compatible version without own layout - as ConfigData.load_bin_config
+        assert layout, f'Unknown config version {version} (known versions are {self.versions}, {self.current.lc_version}..{self.current.version} are compatible)'
+        old = ConfigData(layout)
+        old.load_bin_config(image, force)
+        if layout is self.current:
+            return old, []
+        return self.migrate(old)
+
+    def migrate(self, old: ConfigData) -> tuple[ConfigData, list[str]]:
+        version = old.cfg.version
+        result = ConfigData(self.current)
+        notes = []
+        for old_fld, new_fld in self.plan(version):
+            val = old.get_toml_value(old_fld.name)
+            if new_fld.val_type == 'char' and isinstance(val, str) and len(val.encode()) >= new_fld.size:
+                notes.append(f'Field "{new_fld.name}" truncated to {new_fld.size - 1} bytes')
+                val = val.encode()[:new_fld.size - 1].decode(errors='ignore')
+            try:
+                result.set_toml_value(new_fld.name, val)
+            except (AssertionError, OverflowError, AttributeError) as exp:
+                notes.append(f'Field "{new_fld.name}" = {val!r} can not be migrated ({exp}), default value is used')
+        moved = {old_fld.name for old_fld, _ in self.plan(version)}
+        for fld in old.cfg.cfg_struct:
+            if not fld.is_filler and fld.name not in moved and fld.name not in self.HEADER_FIELDS:
+                notes.append(f'Field "{fld.name}" is not in Config_V{self.current.version}, dropped')
+        return result, notes
+
+def upgrade_dumps(registry: SchemaRegistry, path: str, out_dir: str, unsafe_crc: bool, quiet: bool) -> tuple[int, int]:
+    """
+        Convert all config dumps of directory or tar (*.cfg, *.bin) to current version, in one pass.
+        full.cfg dumps get fresh partition image with one (migrated active) record.
+        Failed images are reported and skipped. Return (number of images, number of failed)
+    """
+    total = failed = 0
+    for name, image in iter_dump_images(path):
+        total += 1
+        try:
+            is_full = is_full_config_name(name)
+            if is_full:
+                image = active_config_record(image)
+                assert image is not None, 'No valid config record in partition'
+            cdata, notes = registry.decode(image)
+            result = cdata.save_bin_config(unsafe_crc)
+            if is_full:
+                result = result.ljust(registry.current.max_cfg_size, b'\xFF')
+            fname = os.path.join(out_dir, name)
+            os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+            with open(fname, 'wb') as f:
+                f.write(result)
+            if not quiet:
+                print(f'{name}: V{decode_header(image).version} -> V{registry.current.version}', file=sys.stderr)
+            for note in notes:
+                print(f'WARNING: {name}: {note}', file=sys.stderr)
+        except Exception as exp:
+            failed += 1
+            print(f'ERROR: {name}: {exp}', file=sys.stderr)
+    return total, failed
+
+#################################################################################################
+## Batch generation
+
+@dataclass
+class BatchRow:
+    line: int                       # Line (CSV, JSON lines) or device number (TOML) in manifest
+    output: Optional[str]           # Output file (.bin or .toml)
+    values: dict[str, int|str]      # Values override (strings for non-string fields are parsed as numbers)
+
+def load_batch_manifest(fname: str, default_ext: str = '.bin') -> list[BatchRow]:
+    """
+        CSV with header (column 'output' and field names, empty cell keeps base value),
+        JSON lines ({"output": ..., field: value, ...}) or TOML in fleet manifest form ('output' and 'values' in [[device]]).
+        Output without extension gets 'default_ext'
+    """
+    ext = os.path.splitext(fname)[1].lower()
+    rows = []
+    if ext == '.csv':
+        with open(fname, newline='', encoding='utf-8') as f:
+            for line, rec in enumerate(csv.DictReader(f), 2):
+                output = rec.pop('output', None)
+                rows.append(BatchRow(line, output, {k.strip(): v for k, v in rec.items() if k and v not in (None, '')}))
+    elif ext in ('.jsonl', '.ndjson'):
+        with open(fname, encoding='utf-8') as f:
+            for line, text in enumerate(f, 1):
+                if text.strip():
+                    try:
+                        rec = json.loads(text)
+                    except ValueError as exp:
+                        assert False, f'{fname} line {line}: {exp}'
+                    assert isinstance(rec, dict), f'{fname} line {line}: JSON object expected'
+                    rows.append(BatchRow(line, rec.pop('output', None), rec))
+    elif ext == '.toml':
+        with open(fname, 'rb') as f:
+            manifest = tomllib.load(f)
+        defaults = manifest.get('defaults', {}).get('values', {})
+        for line, dev in enumerate(manifest.get('device', []), 1):
+            rows.append(BatchRow(line, dev.get('output'), defaults | dev.get('values', {})))
+    else:
+        assert False, f'Unknown batch manifest format {fname} (expected .csv, .jsonl or .toml)'
+    assert rows, f'No rows in batch manifest {fname}'
+    for row in rows:
+        if row.output and not os.path.splitext(row.output)[1]:
+            row.output += default_ext
+    return rows
+
+def set_batch_value(cdata: ConfigData, name: str, val: int|str):
+    assert cdata.has_field(name), f'Unknown field "{name}"'
+    fld = cdata.data[name].fld
+    if isinstance(val, str) and not fld.is_string:
+        val = int(val, 0)
+    if fld.val_type == 'char':
+        assert isinstance(val, str) and len(val.encode()) < fld.size, f'Field "{name}" value {val!r} does not fit {fld.size - 1} bytes'
+    cdata.set_toml_value(name, val)
+
+def apply_batch_row(cfg: Config, base_image: bytes, values: dict[str, int|str]) -> ConfigData:
+    cdata = ConfigData(cfg)
+    cdata.set_full_binary(base_image)
+    for name, val in values.items():
+        set_batch_value(cdata, name, val)
+    return cdata
+
+def validate_batch(cfg: Config, base_image: bytes, rows: list[BatchRow]) -> list[str]:
+    """
+        Check all rows, return all errors
+    """
+    errors = []
+    outputs = {}
+    for row in rows:
+        where = f'line {row.line}' + (f' ({row.output})' if row.output else '')
+        if not row.output:
+            errors.append(f'{where}: no "output"')
+        elif not row.output.endswith(('.bin', '.toml')):
+            errors.append(f'{where}: output should be .bin or .toml')
+        elif row.output in outputs:
+            errors.append(f'{where}: same output as line {outputs[row.output]}')
+        else:
+            outputs[row.output] = row.line
+        cdata = ConfigData(cfg)
+        cdata.set_full_binary(base_image)
+        for name, val in row.values.items():
+            try:
+                set_batch_value(cdata, name, val)
+            except (AssertionError, ValueError, OverflowError, TypeError, AttributeError) as exp:
+                errors.append(f'{where}: {name}: {exp}')
+    return errors
+
+pool_cfg: Optional[Config] = None  # Config of worker process (batch and inspect modes)
+
+def init_pool_worker(schema: dict):
+    global pool_cfg
+    pool_cfg = Config.from_schema(schema)
+
+def batch_worker(base_image: bytes, rows: list[BatchRow], out_dir: str, unsafe_crc: bool, hidden_fields: bool) -> int:
+    for row in rows:
+        cdata = apply_batch_row(pool_cfg, base_image, row.values)
+        fname = os.path.join(out_dir, row.output)
+        os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+        if row.output.endswith('.bin'):
+            with open(fname, 'wb') as f:
+                f.write(cdata.save_bin_config(unsafe_crc))
+        else:
+            with open(fname, 'wt') as f:
+                f.write(cdata.save_text_config(unsafe_crc, hidden_fields))
+    return len(rows)
+
+def run_batch(cfg: Config, base: ConfigData, rows: list[BatchRow], out_dir: str, jobs: int, unsafe_crc: bool, hidden_fields: bool, chunk: int = 64):
+    """
+        Validate all rows first (nothing is written if any row is wrong), then generate files by process pool
+    """
+    base_image = base.get_full_binary()
+    errors = validate_batch(cfg, base_image, rows)
+    assert not errors, f'{len(errors)} errors in {len(rows)} batch rows:\n' + '\n'.join(f'  {e}' for e in errors)
+    os.makedirs(out_dir, exist_ok=True)
+    with ProcessPoolExecutor(jobs, initializer=init_pool_worker, initargs=(cfg.to_schema(),)) as executor:
+        futures = [executor.submit(batch_worker, base_image, rows[pos:pos+chunk], out_dir, unsafe_crc, hidden_fields)
+                   for pos in range(0, len(rows), chunk)]
+        done = sum(future.result() for future in futures)
+    print(f'{done} configs written to {out_dir}', file=sys.stderr)
+
+#################################################################################################
+## Inspect binary dumps
+
+def find_config_record(image: bytes) -> Optional[tuple[int, int]]:
+    """
+        Config partition is a log of records, active one is the last with correct CRC (as in MSTD loader).
+        Return (offset, size) of active record
+    """
+    result = None
+    ptr = 0
+    while ptr + 8 <= len(image):
+        crc, size = unpack('<IH', image[ptr:ptr+6])
+        if crc == 0xFFFFFFFF:
+            break
+        if size >> 8 == 0xFF:   # Aborted write of size field - slot is reused
+            ptr += 8
+            continue
+        rec_size = (size & 0x3FF) * 4 + 4
+        if ptr + rec_size > len(image):
+            break
+        if crc == eval_crc(memoryview(image)[ptr+4:ptr+rec_size]):
+            result = (ptr, rec_size)
+        ptr += rec_size
+    return result
+
+def active_config_record(image: bytes) -> Optional[bytes]:
+    if record := find_config_record(image):
+        ptr, size = record
+        return bytes(image[ptr:ptr+size])
+    return None
+
+def iter_dump_images(path: str) -> Iterator[tuple[str, bytes]]:
+    """
+        Config images (*.cfg and *.bin, except firmware) of directory (recursive) or tar (read as a stream)
+    """
+    def wanted(name: str, size: int) -> bool:
+        return name.endswith(('.cfg', '.bin')) and not (name.endswith('.bin') and size > 102400)
+
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                fname = os.path.join(root, name)
+                if wanted(name, os.path.getsize(fname)):
+                    with open(fname, 'rb') as f:
+                        yield os.path.relpath(fname, path), f.read()
+    else:
+        with tarfile.open(path, 'r|*') as tar:
+            for member in tar:
+                if member.isfile() and wanted(member.name, member.size):
+                    yield member.name, tar.extractfile(member).read()
+
+def inspect_image(name: str, image: bytes) -> dict:
+    """
+        Decode one image to row: image, status ('ok', 'warning' or 'error'), message and values of all fields
+    """
+    row = {'image': name, 'status': 'ok', 'message': ''}
+    try:
+        if is_full_config_name(name):
+            assert len(image) <= pool_cfg.max_cfg_size, f'Config partition too big: {len(image)} bytes'
+            record = active_config_record(image)
+            assert record is not None, 'No valid config record in partition'
+            image = record
+        assert len(image) >= 8, f'Binary config too short: {len(image)} bytes'
+        cdata = ConfigData(pool_cfg)
+        if warn := cdata.is_binary_accepted(image):
+            row.update(status='warning', message=warn.strip())
+        cdata.set_full_binary(image)
+        for fld in pool_cfg.cfg_struct:
+            if not fld.is_filler:
+                row[fld.name] = cdata.get_toml_value(fld.name)
+    except Exception as exp:
+        row.update(status='error', message=str(exp) or type(exp).__name__)
+    return row
+
+def inspect_columns(cfg: Config) -> list[str]:
+    return ['image', 'status', 'message'] + [fld.name for fld in cfg.cfg_struct if not fld.is_filler]
+
+def run_inspect(cfg: Config, path: str, out: TextIO, fmt: str, jobs: int) -> tuple[int, int]:
+    """
+        Decode all images of directory or tar to JSON lines or CSV. Images are read and decoded by stream
+        (at most 4*jobs images in flight), rows go in source order. Return (number of images, number of failed images)
+    """
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, inspect_columns(cfg))
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda row: out.write(json.dumps(row) + '\n')
+    total = failed = 0
+    pending = []
+
+    def flush(limit: int):
+        nonlocal total, failed
+        while len(pending) > limit:
+            row = pending.pop(0).result()
+            total += 1
+            failed += row['status'] == 'error'
+            write(row)
+
+    with ProcessPoolExecutor(jobs, initializer=init_pool_worker, initargs=(cfg.to_schema(),)) as executor:
+        for name, image in iter_dump_images(path):
+            pending.append(executor.submit(inspect_image, name, image))
+            flush(4 * jobs)
+        flush(0)
+    return total, failed
+
+#################################################################################################
+## Config partition editor
+
+class PartitionEditor:
+    """
+        Patch fields of active config record inside of config partition image (full.cfg) in place.
+        Only patched bytes are touched: CRC is updated from difference of field value (crc32_patch), not by rescan of record
+    """
+    HEADER_FIELDS = ('crc', 'size', 'version')
+
+    def __init__(self, cfg: Config, image: bytearray|mmap.mmap):
+        self.cfg = cfg
+        self.image = image
+        assert len(image) <= cfg.max_cfg_size, f'Config partition too big: {len(image)} bytes, expected {cfg.max_cfg_size}'
+        record = find_config_record(image)
+        assert record, 'No valid config record in partition'
+        self.offset, self.size = record
+        bh = decode_header(image[self.offset:self.offset+8])
+        # Offsets are taken from current layout - record of other version can't be patched in place (write whole config instead)
+        assert bh.version == cfg.version, f'Config record version {bh.version} differs from config layout version {cfg.version}, can not patch it'
+        self.crc = bh.crc
+        self.fields = {fld.name: fld for fld in cfg.cfg_struct if not fld.is_filler}
+        self.scratch = ConfigData(cfg)   # Encoder of values (checks enums and ranges)
+        self.changed = 0
+
+    def field(self, name: str) -> CfgField:
+        assert name in self.fields, f'Unknown field "{name}"'
+        fld = self.fields[name]
+        assert fld.shift + fld.size <= self.size, f'Field "{name}" is out of config record ({self.size} bytes)'
+        return fld
+
+    def get_value(self, name: str) -> int|str:
+        fld = self.field(name)
+        start = self.offset + fld.shift
+        self.scratch.set_binary_value(name, bytes(self.image[start:start+fld.size]))
+        return self.scratch.get_toml_value(name)
+
+    def encode(self, name: str, val: int|str) -> tuple[CfgField, bytes]:
+        fld = self.field(name)
+        assert name not in self.HEADER_FIELDS, f'Field "{name}" can not be changed'
+        if isinstance(val, str) and not fld.is_string:
+            val = int(val, 0)
+        self.scratch.set_toml_value(name, val)
+        return fld, self.scratch.get_binary_value(name)
+
+    def set_value(self, name: str, val: int|str):
+        self.patch(*self.encode(name, val))
+
+    def patch(self, fld: CfgField, new: bytes):
+        start = self.offset + fld.shift
+        old = bytes(self.image[start:start+fld.size])
+        if old == new:
+            return
+        self.crc = crc32_patch(self.crc, old, new, self.offset + self.size - start - fld.size)
+        self.image[start:start+fld.size] = new
+        pack_into('<I', self.image, self.offset, self.crc)
+        self.changed += 1
+
+    def config_data(self) -> ConfigData:
+        result = ConfigData(self.cfg)
+        result.set_full_binary(self.image[self.offset:self.offset+self.size])
+        return result
+
+def edit_partition_file(cfg: Config, fname: str, values: list[tuple[str, str]], quiet: bool) -> int:
+    """
+        Patch partition image file in place (memory mapped). Return number of changed fields
+    """
+    with open(fname, 'r+b') as f:
+        with mmap.mmap(f.fileno(), 0) as image:
+            editor = PartitionEditor(cfg, image)
+            for fld, new in [editor.encode(name, val) for name, val in values]: # All values are checked before any change
+                editor.patch(fld, new)
+            if editor.changed:
+                image.flush()
+    if not quiet:
+        print(f'{fname}: record at 0x{editor.offset:03X} ({editor.size} bytes), {editor.changed} fields changed, CRC {editor.crc:08X}', file=sys.stderr)
+    return editor.changed
+
+#################################################################################################
+## Skip unchanged config
+
+class DeviceStateCache:
+    """
+        Last known config image of each MSTD (by host), updated on each compare-before-write.
+        Entry is used only if CRC stored with it matches image.
+        MSTD loads config partition once at boot - till reboot 'cfg.cfg' read returns boot time config, not written one.
+        So with pushed image cache keeps id of config MSTD served before the push ('served'): while MSTD serves it,
+        flash holds pushed image
+    """
+    def __init__(self, fname: Optional[str] = None):
+        self.fname = fname or os.path.join(schema_cache_dir(), 'devices.json')
+        try:
+            with open(self.fname, 'rt') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, host: str) -> Optional[bytes]:
+        entry = self.entries.get(host)
+        try:
+            image = bytes.fromhex(entry['image'])
+        except (TypeError, KeyError, ValueError):
+            return None
+        return image if len(image) > 4 and eval_crc(image[4:]) == entry.get('crc') else None
+
+    @staticmethod
+    def served_id(image: Optional[bytes]) -> int:
+        return -1 if image is None else eval_crc(image)
+
+    def current(self, host: str, served: Optional[bytes]) -> Optional[bytes]:
+        """
+            Config in flash of MSTD which served 'served' (None - no config): last pushed image if MSTD
+            was not rebooted after the push, else 'served'
+        """
+        entry = self.entries.get(host) or {}
+        if 'served' in entry and entry['served'] == self.served_id(served) and (pushed := self.get(host)) is not None:
+            return pushed
+        return served
+
+    def put(self, host: str, image: bytes, served: Optional[bytes] = None, pushed: bool = False):
+        """
+            'pushed' - 'image' was just written to MSTD, which served 'served' config (read just before the write).
+            Otherwise known 'served' is kept - MSTD serves it till reboot
+        """
+        image = bytearray(image)
+        crc = eval_crc(memoryview(image)[4:])
+        pack_into('<I', image, 0, crc)  # Autofilled CRC is written by MSTD
+        with self.lock:
+            entry = {'crc': crc, 'image': image.hex(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            prev = self.entries.get(host) or {}
+            if pushed:
+                entry['served'] = self.served_id(served)
+            elif 'served' in prev:
+                entry['served'] = prev['served']
+            self.entries[host] = entry
+            try:
+                os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+                tmp_name = f'{self.fname}.{os.getpid()}.tmp'
+                with open(tmp_name, 'wt') as f:
+                    json.dump(self.entries, f, indent=1)
+                os.replace(tmp_name, self.fname)
+            except OSError:
+                pass    # Cache is optional
+
+def config_changes(cfg: Config, old_image: Optional[bytes], new_image: bytes) -> list[str]:
+    """
+        Changed fields ('name: old -> new'), empty if configs are the same.
+        CRC field is not compared (it can be autofilled), unknown or broken 'old_image' differs in all fields
+    """
+    if old_image is not None and old_image[4:] == new_image[4:]:
+        return []
+    new = ConfigData(cfg)
+    new.set_full_binary(new_image)
+    old = None
+    if old_image is not None:
+        old = ConfigData(cfg)
+        try:
+            old.load_bin_config(old_image, 1)
+        except AssertionError:
+            old = None
+    result = []
+    for name, slot in new.data.items():
+        if slot.fld.is_filler or name == 'crc':
+            continue
+        new_val = new.get_toml_value(name)
+        old_val = old.get_toml_value(name) if old else '?'
+        if old_val != new_val:
+            result.append(f'{name}: {old_val!r} -> {new_val!r}')
+    return result or ['(reserved fields)']
+
+def report_changes(host: str, changes: list[str]):
+    if changes:
+        print(f'{host}: config changed: ' + ', '.join(changes), file=sys.stderr)
+    else:
+        print(f'{host}: config unchanged, not written', file=sys.stderr)
+
+def push_config_if_changed(session: TFTPSession, cfg: Config, image: bytes, skip_mode: str, cache: DeviceStateCache, verbose: bool) -> bool:
+    """
+        Send 'image' as 'cfg.cfg' unless MSTD already has the same config. Current config is read from MSTD
+        (corrected by cache for pushes after last reboot), or taken from device state cache (skip_mode == 'cache').
+        Return True if config was sent
+    """
+    old_image = cache.get(session.host) if skip_mode == 'cache' else None
+    served = None
+    read_back = old_image is None
+    if read_back:
+        try:
+            served = bytes(session.read('cfg.cfg'))
+        except TFTPServerError as exp:
+            if exp.code != TFTPClient.ERR_FILE_NOT_FOUND:
+                raise
+        old_image = cache.current(session.host, served)
+    changes = config_changes(cfg, old_image, image)
+    report_changes(session.host, changes)
+    if changes:
+        session.send('cfg.cfg', image, verbose)
+        cache.put(session.host, image, served, pushed=read_back)
+    else:
+        cache.put(session.host, old_image)
+    return bool(changes)
+
+#################################################################################################
+## Watch mode
+
+class WatchedSource:
+    """
+        Source config file of watch mode. Parsed content is kept and reloaded only when file stamp (mtime, size) changed
+    """
+    def __init__(self, fname: str):
+        self.fname = fname
+        self.stamp: Optional[tuple[int, int]] = None
+        self.content: Optional[dict|bytes] = None  # TOML or binary image
+        self.failed: Optional[tuple[int, int]] = None   # Stamp of file version which failed to parse
+
+    def poll(self) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(self.fname)
+        except OSError: # Editor can replace file on save
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def reload(self, stamp: Optional[tuple[int, int]]):
+        """
+            Parse file. On error previous content and stamp are kept, failed stamp is remembered to not reparse it on each poll
+        """
+        self.failed = stamp
+        src = ConfigImage(self.fname)
+        content = src.value if src.is_binary else tomllib.loads(src.value)
+        self.stamp = stamp
+        self.content = content
+        self.failed = None
+
+    def changed(self) -> bool:
+        return self.poll() not in (self.stamp, self.failed)
+
+    def apply(self, cdata: ConfigData, force: int, registry: Optional[SchemaRegistry]):
+        assert self.content is not None, f'{self.fname}: not loaded (fix errors in it)'
+        if isinstance(self.content, dict):
+            cdata.set_full_toml(self.content, force != 0)   # As ConfigData.load_text_config
+        elif registry:
+            cdata.set_full_binary(registry.decode(self.content, force)[0].get_full_binary())
+        else:
+            cdata.load_bin_config(self.content, force)
+
+def watch_config(cfg: Config, src_files: list[str], arg_override: list[tuple[str, str]], dst: ConfigImage, args: argparse.Namespace,
+                 tftp_args: dict, registry: Optional[SchemaRegistry] = None, poll: float = 0.1):
+    """
+        Push config to 'dst' on each change of source files (till Ctrl-C).
+        Burst of saves is joined (files should be unchanged for 'args.debounce' seconds), only changed files are reparsed,
+        config is pushed only if its binary image differs from last pushed one
+    """
+    sources = [WatchedSource(fname) for fname in src_files]
+    session = TFTPSession.get(dst.ip, tftp_args) if dst.kind == 'T' else None
+    dst_name = dst.ip if session else dst.file_name
+    last_image = None
+    print(f'Watching {", ".join(src_files)} -> {dst_name} (Ctrl-C to stop)', file=sys.stderr)
+    try:
+        while True:
+            changed = [src for src in sources if src.changed()]
+            if not changed:
+                time.sleep(poll)
+                continue
+            stamps = [src.poll() for src in changed]
+            while True:     # Debounce
+                time.sleep(args.debounce)
+                new_stamps = [src.poll() for src in changed]
+                if new_stamps == stamps:
+                    break
+                stamps = new_stamps
+            started = time.monotonic()
+            try:
+                for src, stamp in zip(changed, stamps):
+                    src.reload(stamp)
+                cdata = ConfigData(cfg)
+                for src in sources:
+                    src.apply(cdata, args.force, registry)
+                for name, val in arg_override:
+                    cdata.set_cl_value(name, val)
+                image = cdata.save_bin_config(args.unsafe_crc)
+            except (AssertionError, ValueError, OverflowError, OSError) as exp:  # Wait for fix in next save
+                print(f'ERROR: {", ".join(src.fname for src in changed)}: {exp}', file=sys.stderr)
+                continue
+            if image == last_image:
+                print(f'{dst_name}: binary config unchanged, not pushed', file=sys.stderr)
+                continue
+            try:
+                if session and last_image is None and args.skip_unchanged:
+                    push_config_if_changed(session, cfg, image, args.skip_unchanged, DeviceStateCache(), False)
+                else:
+                    if last_image is not None:
+                        report_changes(dst_name, config_changes(cfg, last_image, image))
+                    if session:
+                        session.send('cfg.cfg', image, False)
+                    elif dst.is_binary:
+                        dst.value = image
+                    else:
+                        dst.value = cdata.get_full_toml(args.hidden_fields)
+            except (AssertionError, OSError) as exp:    # Pushed again on next change
+                print(f'ERROR: {dst_name}: {exp}', file=sys.stderr)
+                continue
+            last_image = image
+            print(f'{dst_name}: config pushed in {time.monotonic() - started:.2f}s', file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+#################################################################################################
+## Fleet provisioning
+
+@dataclass
+class DeviceJob:
+    """
+        Provisioning of one MSTD in fleet mode: config sources are joined and pushed as 'cfg.cfg', then firmware as 'fw.bin'
+    """
+    host: str
+    fw: Optional[str] = None                                        # Firmware file
+    config: list[str] = field(default_factory=list)                 # Config sources (joined in order)
+    values: dict[str, int|str] = field(default_factory=dict)        # Values override (TOML typed)
+    overrides: list[tuple[str, str]] = field(default_factory=list)  # Values override (command line form)
+    image: Optional[bytes] = field(default=None, repr=False)        # Binary config to push
+    changes: Optional[list[str]] = None                             # Changed fields (compare-before-write mode)
+    status: str = 'pending'
+    error: str = ''
+    elapsed: float = 0.0
+
+    def build_image(self, cfg: Config, force: int, unsafe_crc: bool):
+        if not (self.config or self.values or self.overrides):
+            return
+        cdata = load_config_data(cfg, self.config, self.overrides, force)
+        cdata.set_full_toml(self.values, force != 0)
+        self.image = cdata.save_bin_config(unsafe_crc)
+
+def load_manifest(fname: str) -> list[DeviceJob]:
+    """
+        TOML manifest:
+            [defaults]                  # Optional, used for every device which doesn't set its own
+            fw = 'fw.bin'
+            config = ['base.toml']
+            values = {oled_contrast = 100}
+
+            [[device]]
+            host = '192.168.1.10'
+            config = ['unit10.toml']    # Optional
+            values = {ssid = 'Lab'}     # Optional, merged with defaults
+    """
+    with open(fname, 'rb') as f:
+        manifest = tomllib.load(f)
+    defaults = manifest.get('defaults', {})
+    result = []
+    for dev in manifest.get('device', []):
+        assert 'host' in dev, f'Device without "host" in manifest {fname}: {dev}'
+        config = dev.get('config', defaults.get('config', []))
+        result.append(DeviceJob(dev['host'], dev.get('fw', defaults.get('fw')),
+            [config] if isinstance(config, str) else list(config),
+            defaults.get('values', {}) | dev.get('values', {})))
+    assert result, f'No devices in manifest {fname}'
+    return result
+
+async def provision_device(job: DeviceJob, fw_images: dict[str, memoryview], tftp_args: dict, limit: asyncio.Semaphore, quiet: bool,
+                           cfg: Config, skip_mode: Optional[str], cache: Optional[DeviceStateCache]):
+    async with limit:
+        started = time.monotonic()
+        client = AsyncTFTPClient(job.host, **tftp_args)
+        try:
+            await client.open()
+            served = None
+            read_back = False
+            if job.image is not None and skip_mode:
+                job.status = 'compare'
+                old_image = cache.get(job.host) if skip_mode == 'cache' else None
+                read_back = old_image is None
+                if read_back:
+                    try:
+                        served = bytes(await client.read('cfg.cfg'))
+                    except TFTPServerError as exp:
+                        if exp.code != TFTPClient.ERR_FILE_NOT_FOUND:
+                            raise
+                    old_image = cache.current(job.host, served)
+                job.changes = config_changes(cfg, old_image, job.image)
+                if not quiet:
+                    report_changes(job.host, job.changes)
+                if not job.changes:
+                    cache.put(job.host, old_image)
+            if job.image is not None and job.changes != []:
+                job.status = 'config'
+                await client.send('cfg.cfg', job.image, False)
+                if cache:
+                    cache.put(job.host, job.image, served, pushed=read_back)
+            if job.fw:  # Firmware goes last - MSTD reboots after it
+                job.status = 'firmware'
+                await client.send('fw.bin', fw_images[job.fw], False)
+            job.status = 'ok'
+        except (AssertionError, OSError, TimeoutError) as exp:
+            job.error = f'{job.status}: {exp}'
+            job.status = 'failed'
+        finally:
+            client.close()
+            job.elapsed = time.monotonic() - started
+        if not quiet:
+            print(f'{job.host}: {job.status} {job.error}', file=sys.stderr)
+
+async def provision_fleet(jobs: list[DeviceJob], tftp_args: dict, concurrency: int, quiet: bool,
+                          cfg: Config, skip_mode: Optional[str] = None):
+    sources = {job.fw: ImageSource(job.fw) for job in jobs if job.fw}
+    cache = DeviceStateCache() if skip_mode else None
+    try:
+        fw_images = {name: src.view for name, src in sources.items()}
+        limit = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(provision_device(job, fw_images, tftp_args, limit, quiet, cfg, skip_mode, cache) for job in jobs))
+    finally:
+        for src in sources.values():
+            src.close()
+
+def run_fleet(jobs: list[DeviceJob], cfg: Config, args: argparse.Namespace, tftp_args: dict):
+    # Build all configs first - any error here should stop us before we touch devices
+    for job in jobs:
+        try:
+            job.build_image(cfg, args.force, args.unsafe_crc)
+        except (AssertionError, ValueError, OSError) as exp:
+            job.status = 'failed'
+            job.error = f'config: {exp}'
+    failed = [job for job in jobs if job.status == 'failed']
+    assert not failed, 'Config errors:\n' + '\n'.join(f'  {job.host}: {job.error}' for job in failed)
+    asyncio.run(provision_fleet(jobs, tftp_args, args.jobs, args.quiet, cfg, args.skip_unchanged))
+    for job in jobs:
+        changes = '' if job.changes is None else f'{len(job.changes)} fields changed ' if job.changes else 'config unchanged '
+        print(f'{job.host:<24} {job.status:<8} {job.elapsed:7.1f}s {changes}{job.error}')
+    failed = [job for job in jobs if job.status != 'ok']
+    assert not failed, f'{len(failed)} of {len(jobs)} devices failed'
+
+#################################################################################################
+## Provisioning daemon
+
+@dataclass
+class DaemonJob:
+    """
+        Job of provisioning daemon:
+            push  - send config (joined 'config' sources and 'values') as 'cfg.cfg' ('skip_unchanged': 'read' or 'cache')
+            pull  - read 'cfg.cfg', return its values (and write it to 'out': *.bin - binary, else TOML)
+            flash - send firmware 'fw' as 'fw.bin' (config first, if any)
+    """
+    id: int
+    op: str
+    device: DeviceJob
+    out: Optional[str] = None
+    skip_unchanged: Optional[str] = None
+    status: str = 'queued'          # 'queued', 'running', 'done' or 'failed'
+    step: str = ''                  # Current step of running job ('compare', 'config', 'firmware', 'read')
+    error: str = ''
+    result: dict = field(default_factory=dict)
+    transfers: list[dict] = field(default_factory=list)     # TransferStats of finished transfers
+    session: Optional[TFTPSession] = field(default=None, repr=False)   # Session of running job (source of progress)
+    total: int = 0                  # Size of current transfer (0 - unknown)
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    OPS: ClassVar[tuple[str, ...]] = ('push', 'pull', 'flash')
+
+    def progress(self) -> Optional[dict]:
+        session = self.session
+        if session is None or session.client.stats is None:
+            return None
+        stats = session.client.stats
+        size = stats.blocks * session.client.data_size
+        return {'file': stats.file_name, 'direction': stats.direction, 'bytes': min(size, self.total) if self.total else size, 'total': self.total}
+
+    def to_json(self) -> dict:
+        result = {
+            'id': self.id, 'op': self.op, 'host': self.device.host, 'status': self.status, 'step': self.step, 'error': self.error,
+            'created': self.created, 'started': self.started, 'finished': self.finished,
+            'elapsed': (self.finished or time.time()) - self.started if self.started else 0.0,
+            'result': self.result, 'transfers': self.transfers
+        }
+        if self.device.changes is not None:
+            result['changes'] = self.device.changes
+        if progress := self.progress():
+            result['progress'] = progress
+        return result
+
+class ProvisioningDaemon:
+    """
+        Keeps compiled Config, TFTP sessions (one per MSTD), firmware images and device state cache warm between jobs.
+        Jobs run on bounded thread pool, jobs of one MSTD are serialized (its session is locked)
+    """
+    MAX_FINISHED = 1000     # Finished jobs kept for status queries
+    FW_CACHE_SIZE = 4       # Firmware images kept in memory
+
+    def __init__(self, cfg: Config, tftp_args: dict, workers: int, force: int = 0, unsafe_crc: bool = False,
+                 registry: Optional[SchemaRegistry] = None, quiet: bool = False):
+        self.cfg = cfg
+        self.tftp_args = tftp_args
+        self.workers = workers
+        self.force = force
+        self.unsafe_crc = unsafe_crc
+        self.registry = registry
+        self.quiet = quiet
+        self.pool = ThreadPoolExecutor(workers)
+        self.lock = threading.Lock()
+        self.jobs: dict[int, DaemonJob] = {}
+        self.next_id = 1
+        self.sessions: dict[str, tuple[TFTPSession, threading.Lock]] = {}
+        self.firmware: collections.OrderedDict[tuple, bytes] = collections.OrderedDict()
+        self.cache = DeviceStateCache()
+
+    def submit(self, request: dict) -> DaemonJob:
+        """
+            Check request and build config image (errors are reported at once), then queue job
+        """
+        op = request.get('op')
+        assert op in DaemonJob.OPS, f'Unknown job op {op!r} (expected {", ".join(DaemonJob.OPS)})'
+        host = request.get('host')
+        assert isinstance(host, str) and host, 'Job "host" expected'
+        config = request.get('config', [])
+        device = DeviceJob(host, request.get('fw'), [config] if isinstance(config, str) else list(config), request.get('values', {}))
+        skip = request.get('skip_unchanged')
+        assert skip in (None, 'read', 'cache'), f'Wrong skip_unchanged {skip!r} (expected "read" or "cache")'
+        match op:
+            case 'push':
+                assert device.config or device.values, 'Push job needs "config" and/or "values"'
+            case 'flash':
+                assert device.fw and os.path.isfile(device.fw), f'Flash job needs existing "fw" file, got {device.fw!r}'
+            case 'pull':
+                assert not (device.config or device.values or device.fw), 'Pull job takes no "config", "values" or "fw"'
+        device.build_image(self.cfg, self.force, self.unsafe_crc)
+        with self.lock:
+            job = DaemonJob(self.next_id, op, device, request.get('out'), skip)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            finished = [j.id for j in self.jobs.values() if j.finished]
+            for job_id in finished[:max(0, len(finished) - self.MAX_FINISHED)]:
+                del self.jobs[job_id]
+        self.pool.submit(self.run_job, job)
+        return job
+
+    def session(self, host: str) -> tuple[TFTPSession, threading.Lock]:
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = (TFTPSession(host, self.tftp_args), threading.Lock())
+            return self.sessions[host]
+
+    def firmware_image(self, fname: str) -> bytes:
+        st = os.stat(fname)
+        key = (os.path.abspath(fname), st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if key in self.firmware:
+                self.firmware.move_to_end(key)
+                return self.firmware[key]
+        with open(fname, 'rb') as f:
+            data = f.read()
+        with self.lock:
+            self.firmware[key] = data
+            while len(self.firmware) > self.FW_CACHE_SIZE:
+                self.firmware.popitem(last=False)
+        return data
+
+    def transfer(self, job: DaemonJob, step: str, file_name: str, data: Optional[bytes] = None) -> Optional[bytes]:
+        job.step = step
+        job.total = len(data) if data is not None else 0
+        try:
+            if data is None:
+                return bytes(job.session.read(file_name))
+            job.session.send(file_name, data, False)
+        finally:
+            if job.session.client.stats is not None and job.session.client.stats.finished:
+                job.transfers.append(job.session.client.stats.to_json())
+
+    def push_config(self, job: DaemonJob):
+        device = job.device
+        served = None
+        read_back = False
+        if job.skip_unchanged:
+            job.step = 'compare'
+            old_image = self.cache.get(device.host) if job.skip_unchanged == 'cache' else None
+            read_back = old_image is None
+            if read_back:
+                try:
+                    served = self.transfer(job, 'compare', 'cfg.cfg')
+                except TFTPServerError as exp:
+                    if exp.code != TFTPClient.ERR_FILE_NOT_FOUND:
+                        raise
+                old_image = self.cache.current(device.host, served)
+            device.changes = config_changes(self.cfg, old_image, device.image)
+            if not device.changes:
+                self.cache.put(device.host, old_image)
+                return
+        self.transfer(job, 'config', 'cfg.cfg', device.image)
+        self.cache.put(device.host, device.image, served, pushed=read_back)
+
+    def pull_config(self, job: DaemonJob):
+        image = self.transfer(job, 'read', 'cfg.cfg')
+        if self.registry:
+            cdata, notes = self.registry.decode(image, self.force)
+            job.result['notes'] = notes
+        else:
+            cdata = ConfigData(self.cfg)
+            cdata.load_bin_config(image, self.force)
+        job.result['config'] = {fld.name: cdata.get_toml_value(fld.name) for fld in cdata.cfg.cfg_struct if not fld.is_filler}
+        if job.out:
+            if job.out.endswith('.bin'):
+                with open(job.out, 'wb') as f:
+                    f.write(image)
+            else:
+                with open(job.out, 'wt') as f:
+                    f.write(cdata.get_full_toml())
+        self.cache.put(job.device.host, image)
+
+    def run_job(self, job: DaemonJob):
+        session, lock = self.session(job.device.host)
+        with lock:
+            job.status = 'running'
+            job.started = time.time()
+            job.session = session
+            try:
+                if job.device.image is not None:
+                    self.push_config(job)
+                if job.op == 'pull':
+                    self.pull_config(job)
+                elif job.op == 'flash':    # Firmware goes last - MSTD reboots after it
+                    self.transfer(job, 'firmware', 'fw.bin', self.firmware_image(job.device.fw))
+                job.status = 'done'
+            except (AssertionError, OSError, TimeoutError, ValueError) as exp:
+                job.error = f'{job.step}: {exp}'
+                job.status = 'failed'
+            except Exception as exp:
+                job.error = f'{job.step}: {type(exp).__name__}: {exp}'
+                job.status = 'failed'
+            finally:
+                job.session = None
+                job.finished = time.time()
+                job.done.set()
+        if not self.quiet:
+            print(f'job {job.id} {job.op} {job.device.host}: {job.status} {job.error}', file=sys.stderr)
+
+    def status(self) -> dict:
+        with self.lock:
+            jobs = list(self.jobs.values())
+            return {
+                'config_version': self.cfg.version,
+                'schema_versions': self.registry.versions if self.registry else [self.cfg.version],
+                'workers': self.workers,
+                'queued': sum(job.status == 'queued' for job in jobs),
+                'running': sum(job.status == 'running' for job in jobs),
+                'sessions': sorted(self.sessions),
+                'firmware': [key[0] for key in self.firmware]
+            }
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        for session, _ in self.sessions.values():
+            session.close()
+
+class DaemonRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+        POST /jobs                  - submit job (JSON body), answer is job status
+        GET  /jobs                  - status of all jobs
+        GET  /jobs/<id>[?wait=<s>]  - job status (wait up to <s> seconds for job end)
+        GET  /status                - daemon status
+    """
+    server_version = 'MSTD-daemon'
+
+    @property
+    def daemon(self) -> ProvisioningDaemon:
+        return self.server.daemon
+
+    def reply(self, code: int, data: dict|list):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        params = dict(p.partition('=')[::2] for p in query.split('&') if p)
+        parts = path.strip('/').split('/')
+        match parts:
+            case ['status']:
+                self.reply(200, self.daemon.status())
+            case ['jobs']:
+                with self.daemon.lock:
+                    jobs = list(self.daemon.jobs.values())
+                self.reply(200, [job.to_json() for job in jobs])
+            case ['jobs', job_id] if job_id.isdigit() and int(job_id) in self.daemon.jobs:
+                job = self.daemon.jobs[int(job_id)]
+                if 'wait' in params:
+                    job.done.wait(float(params['wait'] or 60))
+                self.reply(200, job.to_json())
+            case _:
+                self.reply(404, {'error': f'Not found: {self.path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.reply(404, {'error': f'Not found: {self.path}'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            assert isinstance(request, dict), 'JSON object expected'
+            job = self.daemon.submit(request)
+        except (AssertionError, ValueError, OverflowError, OSError) as exp:
+            self.reply(400, {'error': str(exp)})
+            return
+        self.reply(202, job.to_json())
+
+    def log_message(self, format: str, *args):
+        if not self.daemon.quiet:
+            print(f'{self.command} {self.path}: ' + format % args, file=sys.stderr)
+
+class DaemonHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class DaemonUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def run_daemon(daemon: ProvisioningDaemon, address: str):
+    """
+        Serve daemon API on localhost '<host>:<port>' or Unix socket (address with '/' or ending with '.sock')
+    """
+    if '/' in address or address.endswith('.sock'):
+        if os.path.exists(address):
+            os.unlink(address)  # Stale socket of previous run
+        server = DaemonUnixServer(address, DaemonRequestHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = DaemonHTTPServer((host or '127.0.0.1', int(port)), DaemonRequestHandler)
+    server.daemon = daemon
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'MSTD provisioning daemon on {address} ({daemon.workers} workers)', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if isinstance(server, DaemonUnixServer):
+            os.unlink(address)
 #################################################################################################
 
 def main():
     parser = argparse.ArgumentParser(prog='MSTD config/fw uploader', description='Upload and download configs and firmware to MSTD')
-    parser.add_argument('src_config', help='Source configuration (you can specify multiple source files, all of them will be joined) or firmware file. Use MSTD or MSTD://<ip or host name> to connect to MSTD') 
-    parser.add_argument('dst_config', default=None, nargs='?', help='Destination configuration. Use "-" to dump to stdout, use MSTD or MSTD://<ip or host name> to connect to MSTD')
+    parser.add_argument('src_config', nargs='?', help='Source configuration (you can specify multiple source files, all of them will be joined) and/or firmware file (config is pushed first, then firmware, in one TFTP session). Use MSTD or MSTD://<ip or host name>[:<port>] to connect to MSTD') 
+    parser.add_argument('dst_config', default=None, nargs='?', help='Destination configuration. Use "-" to dump to stdout, use MSTD or MSTD://<ip or host name>[:<port>] to connect to MSTD')
     parser.add_argument('argument_override', nargs='*', help='Config values override in form <key>=<value>. String <value> should NOT be enclosed in any quotes')
-    parser.add_argument('-c', '--config', default='setup_data.h', help='C++ config file with binary Config structure')
+    parser.add_argument('-c', '--config', default='setup_data.h', help='C++ config file with binary Config structure (or Python schema module generated by --emit-schema)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not use compiled schema cache for C++ config file')
+    parser.add_argument('--emit-schema', metavar='FILE.py', help='Write compiled C++ config as Python schema module, usable as -c FILE.py')
     parser.add_argument('-b', '--bypass', action='store_true', help='Force direct copy of one binary config to another (by default binary config passed through type check)')
     parser.add_argument('-n', '--new', action='store_true', help='Creates new Config file. There is no Source Config')
     parser.add_argument('-u', '--update', action='store_true', help='Update Config file in-place. First Source Config will be used as Destination Config too')
@@ -689,10 +2553,34 @@ def main():
     parser.add_argument('--unsafe-crc', action='store_true', help='Do not write CRC field in config image. MSTD loader will writes CRC themselves. This is inherently unsafe, do not use.')
     parser.add_argument('--hidden-fields', action='store_true', help='Include hidden fields in Text dump of config')
     parser.add_argument('-q', '--quiet', action='store_true', help='Quiet operation - do not print progress on FW download')
+    parser.add_argument('--blksize', type=int, default=1468, help='TFTP block size to request from MSTD (RFC 2348). Falls back to 512 if MSTD rejects it')
+    parser.add_argument('--windowsize', type=int, default=8, help='Number of TFTP blocks in flight (RFC 7440). Falls back to lock-step transfer if MSTD rejects it')
+    parser.add_argument('--retries', type=int, default=TFTPClient.MAX_RETRY_COUNT, help='Maximum number of consecutive TFTP retransmissions before giving up')
+    parser.add_argument('--deadline', type=float, default=None, help='Time limit (in seconds) for each TFTP transfer')
+    parser.add_argument('--hosts', action='append', help='Fleet mode: push all Source configs (joined) and/or firmware to each of these MSTD (comma separated list, can be repeated)')
+    parser.add_argument('--manifest', help='Fleet mode: TOML manifest with per-device firmware, configs and values')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='Number of MSTD provisioned concurrently in fleet mode (number of processes in batch and inspect modes)')
+    parser.add_argument('--batch', metavar='MANIFEST', help='Batch mode: generate config per row of CSV, JSON lines or TOML manifest. Source configs (joined) and Values override are base for all rows')
+    parser.add_argument('--out-dir', default='.', help='Output directory of batch mode')
+    parser.add_argument('--batch-format', choices=('bin', 'toml'), default='bin', help='Format of batch outputs without extension')
+    parser.add_argument('--inspect', metavar='DIR|TAR', help='Decode all binary configs (*.cfg, *.bin) of directory or tar to JSON lines or CSV (to Destination or stdout). Broken images are reported in "status" column')
+    parser.add_argument('--inspect-format', choices=('jsonl', 'csv'), help='Output format of --inspect (default - by Destination extension, JSON lines for stdout)')
+    parser.add_argument('--edit-partition', action='store_true', help='Patch Values override in place in all Source configs, which are images of config partition (full.cfg). Active config record is changed, CRC is updated')
+    parser.add_argument('--schemas', action='append', help='Config layouts of older versions (C++ header, schema module or directory of them, can be repeated). Older binary configs are migrated to current version')
+    parser.add_argument('--upgrade', metavar='DIR|TAR', help='Convert all binary configs (*.cfg, *.bin) of directory or tar to current version (to --out-dir, same names). Needs --schemas')
+    parser.add_argument('--daemon', metavar='HOST:PORT|SOCKET', nargs='?', const='127.0.0.1:6980', help='Run provisioning daemon with HTTP JSON API on localhost (default 127.0.0.1:6980) or Unix socket. Jobs: POST /jobs {"op": "push"|"pull"|"flash", "host": ..., "config": [...], "values": {...}, "fw": ..., "out": ...}, status: GET /jobs/<id>')
+    parser.add_argument('--watch', action='store_true', help='Watch Source configs and push config to Destination on each change (only if binary image changed), till Ctrl-C')
+    parser.add_argument('--debounce', type=float, default=0.2, help='Watch mode: Source configs should be unchanged for this time (in seconds) before push')
+    parser.add_argument('--skip-unchanged', action='store_const', const='read', help='Do not write config to MSTD if it is the same (changed fields are reported). Current config is read from MSTD. MSTD serves config loaded at boot - config written since (not by --skip-unchanged) is seen only after MSTD reboot')
+    parser.add_argument('--skip-unchanged-mode', dest='skip_unchanged', choices=('read', 'cache'), help='As --skip-unchanged, current config is read from MSTD ("read") or taken from local device state cache ("cache")')
+    parser.add_argument('--stats', action='store_true', help='Print telemetry of each TFTP transfer (throughput, RTT, gaps between ACKs, retransmits) to stderr')
+    parser.add_argument('--stats-json', metavar='FILE', help='Write telemetry of all TFTP transfers to JSON Lines file (one transfer per line)')
 
     args = parser.parse_args()
+    if args.upgrade and not args.schemas:
+        parser.error('--upgrade needs --schemas (layouts of older config versions)')
 
-    files = [args.src_config]
+    files = [args.src_config] if args.src_config else []
     if args.dst_config:
         files.append(args.dst_config)
     files.extend(args.argument_override)
@@ -705,6 +2593,73 @@ def main():
             arg_override.append((key.strip(), val))
         else:
             src_files.append(f)
+
+    tftp_args = dict(blk_size=args.blksize, window_size=args.windowsize, max_retry=args.retries, deadline=args.deadline)
+    if args.stats or args.stats_json:
+        tftp_args['stats_hook'] = make_stats_hook(args.stats, args.stats_json)
+
+    if args.emit_schema:
+        emit_schema_module(load_config(args.config, not args.no_cache), args.config, args.emit_schema)
+        if not src_files:
+            return
+
+    registry = None
+    if args.schemas:
+        registry = SchemaRegistry(load_config(args.config, not args.no_cache), args.schemas or [], not args.no_cache)
+
+    if args.daemon:
+        assert not src_files and not arg_override, 'Daemon mode takes jobs by API only'
+        cfg = registry.current if registry else load_config(args.config, not args.no_cache)
+        run_daemon(ProvisioningDaemon(cfg, tftp_args, args.jobs, args.force, args.unsafe_crc, registry, args.quiet), args.daemon)
+        return
+
+    if args.upgrade:
+        assert os.path.exists(args.upgrade), f'{args.upgrade} not found'
+        assert os.path.abspath(args.out_dir) != os.path.abspath(args.upgrade), 'Upgrade in place is not supported, use other --out-dir'
+        total, failed = upgrade_dumps(registry, args.upgrade, args.out_dir, args.unsafe_crc, args.quiet)
+        print(f'{total - failed} of {total} images upgraded to V{registry.current.version} (known versions are {registry.versions})', file=sys.stderr)
+        return
+
+    if args.batch:
+        cfg = load_config(args.config, not args.no_cache)
+        rows = load_batch_manifest(args.batch, f'.{args.batch_format}')
+        base = load_config_data(cfg, src_files, arg_override, args.force, tftp_args, registry)
+        run_batch(cfg, base, rows, args.out_dir, args.jobs, args.unsafe_crc, args.hidden_fields)
+        return
+
+    if args.inspect:
+        assert len(src_files) <= 1 and not arg_override, 'Inspect mode assumed only Destination'
+        assert os.path.exists(args.inspect), f'{args.inspect} not found'
+        cfg = load_config(args.config, not args.no_cache)
+        dst = src_files[0] if src_files and src_files[0] != '-' else None
+        fmt = args.inspect_format or ('csv' if dst and dst.endswith('.csv') else 'jsonl')
+        with open(dst, 'w', newline='') if dst else contextlib.nullcontext(sys.stdout) as out:
+            total, failed = run_inspect(cfg, args.inspect, out, fmt, args.jobs)
+        print(f'{total} images inspected, {failed} failed', file=sys.stderr)
+        return
+
+    if args.edit_partition:
+        assert src_files and arg_override, 'Partition images and Values override expected'
+        cfg = load_config(args.config, not args.no_cache)
+        for fname in src_files:
+            edit_partition_file(cfg, fname, arg_override, args.quiet)
+        return
+
+    if args.hosts or args.manifest:
+        cfg = load_config(args.config, not args.no_cache)
+        if args.manifest:
+            assert not args.hosts and not src_files and not arg_override, 'Manifest mode assumed no --hosts, Source configs or Values override'
+            jobs = load_manifest(args.manifest)
+        else:
+            fw = [f for f in src_files if is_fw_file(f)]
+            assert len(fw) <= 1, f'Only one firmware file expected, but found {fw}'
+            config = [f for f in src_files if f not in fw]
+            assert fw or config or arg_override, "Firmware or Configuration file expected"
+            jobs = [DeviceJob(host.strip(), fw[0] if fw else None, config, {}, arg_override)
+                    for hosts in args.hosts for host in hosts.split(',') if host.strip()]
+        run_fleet(jobs, cfg, args, tftp_args)
+        return
+
     assert src_files, "At least one Configuration file expected"
 
     if args.new:
@@ -716,13 +2671,28 @@ def main():
         assert len(src_files) > 1, f'Source and Destination Configs expected'
         dst_file = src_files.pop()
 
-    cfg = Config(args.config)  # TODO: Make search for config on some predefiend pathes
-
-    if len(src_files) == 1 and is_fw_file(src_files[0]) and dst_file.startswith('MSTD'):
-        assert not arg_override, f'Firmware update assumed no Values override'
-        src = ConfigImage(src_files[0])
-        dst = ConfigImage(dst_file, 'FW', quiet=args.quiet)
-        dst.value = src.value        
+    cfg = load_config(args.config, not args.no_cache)  # TODO: Make search for config on some predefiend pathes
+
+    fw = [f for f in src_files if is_fw_file(f)]
+    if fw and dst_file.startswith('MSTD'):
+        # Config and firmware go back to back in one TFTP session. Config goes first - MSTD reboots after firmware
+        assert len(fw) == 1, f'Only one firmware file expected, but found {fw}'
+        configs = [f for f in src_files if f not in fw]
+        dst = ConfigImage(dst_file, 'FW', quiet=args.quiet, tftp_args=tftp_args)
+        session = TFTPSession.get(dst.ip, tftp_args)
+        if configs or arg_override:
+            image = load_config_data(cfg, configs, arg_override, args.force, tftp_args, registry).save_bin_config(args.unsafe_crc)
+            if args.skip_unchanged:
+                push_config_if_changed(session, cfg, image, args.skip_unchanged, DeviceStateCache(), not args.quiet)
+            else:
+                session.add('cfg.cfg', image)
+        with ConfigImage(fw[0]).source as data:
+            session.add(dst.file_name, data, not args.quiet)
+            session.run()
+    elif args.watch:
+        assert not args.bypass and not fw, 'Watch mode works with configs only'
+        assert not any(f.startswith('MSTD') for f in src_files) and dst_file not in src_files, 'Watch mode works with local Source configs only (and Destination other than Source)'
+        watch_config(cfg, src_files, arg_override, ConfigImage(dst_file, tftp_args=tftp_args), args, tftp_args, registry)
     elif args.bypass:
         # Do not create ConfigData - just directly load and save binary images
         assert len(src_files) == 1 and dst_file and not arg_override, f'Direct copy assumed exactly one source and destination config and no Values override'
@@ -731,22 +2701,17 @@ def main():
             extra = 'full'
         else:
             extra = ''
-        src = ConfigImage(src_files[0], extra)
-        dst = ConfigImage(dst_file, extra)
+        src = ConfigImage(src_files[0], extra, tftp_args=tftp_args)
+        dst = ConfigImage(dst_file, extra, tftp_args=tftp_args)
         assert src.is_binary and dst.is_binary, f'Both SRC and DST in bypass mode should be of binary type'
         dst.value = src.value
     else:
-        cdata = ConfigData(cfg)
-        for f in src_files:
-            src = ConfigImage(f)
-            if src.is_binary:
-                cdata.load_bin_config(src.value, args.force)
-            else:
-                cdata.load_text_config(src.value, args.force)
-        for name, val in arg_override:
-            cdata.set_cl_value(name, val)
-        dst = ConfigImage(dst_file)
-        if dst.is_binary:
+        cdata = load_config_data(cfg, src_files, arg_override, args.force, tftp_args, registry)
+        dst = ConfigImage(dst_file, tftp_args=tftp_args)
+        if dst.kind == 'T' and args.skip_unchanged:
+            push_config_if_changed(TFTPSession.get(dst.ip, tftp_args), cfg, cdata.save_bin_config(args.unsafe_crc),
+                                   args.skip_unchanged, DeviceStateCache(), not args.quiet)
+        elif dst.is_binary:
             dst.value = cdata.save_bin_config(args.unsafe_crc)
         else:
             dst.value = cdata.save_text_config(args.unsafe_crc, args.hidden_fields)
@@ -758,3 +2723,5 @@ if __name__ == "__main__":
         print(f'ERROR: {exp}', file=sys.stderr)
     except FileNotFoundError as exp:
         print(f'ERROR: File error - {exp}', file=sys.stderr)
+    finally:
+        TFTPSession.close_all()
@@ -0,0 +1,54 @@
+﻿"""
+    Tests of cfg_compiler against tftp_emu (no device needed). Run: python -m pytest soft/cfg_compiler/tests
+"""
+import sys
+import os
+import importlib.util
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CFG_DIR = os.path.dirname(HERE)
+sys.path.insert(0, CFG_DIR)
+
+def load_mstd():
+    spec = importlib.util.spec_from_file_location('mstd_cfg', os.path.join(CFG_DIR, 'mstd.cfg.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module     # Objects of module can be pickled
+    spec.loader.exec_module(module)
+    return module
+
+mstd = load_mstd()
+
+@pytest.fixture
+def cfg():
+    return mstd.Config(os.path.join(CFG_DIR, 'setup_data.h'))
+
+def make_header(path, version: int, lc_version: int, fields: dict[str, str] = {}) -> str:
+    """
+        Copy of setup_data.h with other config version, 'fields' replaces field declarations (old -> new text)
+    """
+    with open(os.path.join(CFG_DIR, 'setup_data.h'), 'rt') as f:
+        text = f.read()
+    text = text.replace('ConfigVersion = 1;', f'ConfigVersion = {version};', 1)
+    text = text.replace('LC_ConfigVersion = 1;', f'LC_ConfigVersion = {lc_version};')
+    text = text.replace('Config_V1', f'Config_V{version}')
+    for old, new in fields.items():
+        text = text.replace(old, new)
+    fname = os.path.join(path, f'v{version}.h')
+    with open(fname, 'wt') as f:
+        f.write(text)
+    return fname
+
+@pytest.fixture
+def image(cfg) -> bytes:
+    cdata = mstd.ConfigData(cfg)
+    cdata.set_toml_value('ssid', 'lab')
+    cdata.set_toml_value('oled_contrast', 42)
+    return cdata.save_bin_config(False)
+
+@pytest.fixture
+def old_image(cfg) -> bytes:
+    cdata = mstd.ConfigData(cfg)
+    cdata.set_toml_value('ssid', 'old')
+    return cdata.save_bin_config(False)
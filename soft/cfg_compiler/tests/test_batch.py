@@ -0,0 +1,63 @@
+﻿"""
+    Bulk offline config generation (--batch)
+"""
+import os
+
+import pytest
+
+from conftest import mstd
+
+def test_csv(tmp_path):
+    fname = tmp_path / 'units.csv'
+    fname.write_text('output,ssid,oled_contrast\nunit1,lab1,10\nunit2.toml,,0x20\n')
+    first, second = mstd.load_batch_manifest(str(fname))
+    assert (first.line, first.output, first.values) == (2, 'unit1.bin', {'ssid': 'lab1', 'oled_contrast': '10'})
+    assert (second.output, second.values) == ('unit2.toml', {'oled_contrast': '0x20'})    # Empty cell keeps base value
+
+def test_jsonl(tmp_path):
+    fname = tmp_path / 'units.jsonl'
+    fname.write_text('{"output": "a", "ssid": "x"}\n\n{"output": "b.toml", "oled_contrast": 5}\n')
+    rows = mstd.load_batch_manifest(str(fname), '.toml')
+    assert [(r.line, r.output, r.values) for r in rows] == [(1, 'a.toml', {'ssid': 'x'}), (3, 'b.toml', {'oled_contrast': 5})]
+
+def test_toml(tmp_path):
+    fname = tmp_path / 'units.toml'
+    fname.write_text("[defaults]\nvalues = {oled_contrast = 7}\n\n[[device]]\noutput = 'a'\nvalues = {ssid = 'x'}\n")
+    row, = mstd.load_batch_manifest(str(fname))
+    assert (row.output, row.values) == ('a.bin', {'oled_contrast': 7, 'ssid': 'x'})
+
+@pytest.mark.parametrize('name, text, match', [('units.txt', '', 'Unknown batch manifest'), ('units.csv', 'output,ssid\n', 'No rows'),
+                                               ('units.jsonl', '[1]\n', 'JSON object'), ('units.jsonl', '{\n', 'line 1')])
+def test_bad_manifest(tmp_path, name, text, match):
+    fname = tmp_path / name
+    fname.write_text(text)
+    with pytest.raises(AssertionError, match=match):
+        mstd.load_batch_manifest(str(fname))
+
+def test_validate(cfg):
+    base = mstd.ConfigData(cfg).get_full_binary()
+    rows = [mstd.BatchRow(1, 'a.bin', {'ssid': 'x' * 33}), mstd.BatchRow(2, 'a.bin', {'bogus': 1}), mstd.BatchRow(3, None, {}),
+            mstd.BatchRow(4, 'b.txt', {'oled_contrast': '0x100'}), mstd.BatchRow(5, 'c.toml', {'options1': 'Both'})]
+    errors = mstd.validate_batch(cfg, base, rows)
+    assert len(errors) == 6 and not any(e.startswith('line 5') for e in errors)
+    assert 'does not fit' in errors[0] and 'same output as line 1' in errors[1] and 'Unknown field' in errors[2]
+
+def test_run_batch(cfg, tmp_path, capsys):
+    base = mstd.ConfigData(cfg)
+    base.set_toml_value('passwd', 'secret')
+    rows = [mstd.BatchRow(n, f'sub/unit{n}.bin', {'ssid': f'unit{n}', 'oled_contrast': str(n)}) for n in range(10)]
+    rows.append(mstd.BatchRow(10, 'unit10.toml', {'ssid': 'unit10'}))
+    mstd.run_batch(cfg, base, rows, str(tmp_path), 2, False, False, chunk=3)
+    for row in rows[:-1]:
+        expected = mstd.apply_batch_row(cfg, base.get_full_binary(), row.values).save_bin_config(False)
+        assert (tmp_path / row.output).read_bytes() == expected
+    loaded = mstd.ConfigData(cfg)
+    loaded.load_text_config((tmp_path / 'unit10.toml').read_text())
+    assert loaded.get_toml_value('ssid') == 'unit10' and loaded.get_toml_value('passwd') == 'secret'
+    assert '11 configs written' in capsys.readouterr().err
+
+def test_run_batch_error_writes_nothing(cfg, tmp_path):
+    rows = [mstd.BatchRow(1, 'a.bin', {'ssid': 'ok'}), mstd.BatchRow(2, 'b.bin', {'bogus': 1})]
+    with pytest.raises(AssertionError, match='1 errors in 2 batch rows'):
+        mstd.run_batch(cfg, mstd.ConfigData(cfg), rows, str(tmp_path / 'out'), 2, False, False)
+    assert not os.path.exists(tmp_path / 'out')
@@ -0,0 +1,26 @@
+﻿"""
+    benchmark.py: filtering, baseline comparison
+"""
+import os
+import json
+
+import benchmark
+
+def test_filter_before_measure(monkeypatch):
+    # Filtered out benchmarks are not measured
+    calls = []
+    monkeypatch.setattr(benchmark, 'measure', lambda func, repeat: calls.append(func) or 1.0)
+    results = benchmark.run(['crc', 'bitpk', 'tftp'], 1, r'^crc\.table', False)
+    assert [r.name for r in results] == ['crc.table.4096'] and len(calls) == 1
+
+def test_compare(capsys):
+    results = [benchmark.Result('a', 1.0), benchmark.Result('b', 1.3), benchmark.Result('c', 1.0)]
+    baseline = {'results': {'a': {'seconds': 1.0}, 'b': {'seconds': 1.0}}}
+    assert benchmark.compare(results, baseline, 0.25) == ['b']
+    assert 'new' in capsys.readouterr().out
+
+def test_reference_baseline():
+    with open(os.path.join(benchmark.HERE, 'benchmark_baseline.json')) as f:
+        baseline = json.load(f)
+    assert set(baseline) == {'meta', 'results'}
+    assert baseline['results'] and all(r['seconds'] > 0 for r in baseline['results'].values())
@@ -0,0 +1,52 @@
+﻿"""
+    Precompiled struct codec of ConfigData against field by field encoding
+"""
+import pytest
+
+from conftest import mstd, make_header
+from crc32 import eval_crc
+
+def field_by_field(cdata: 'mstd.ConfigData') -> bytes:
+    return b''.join(bytes(fld.size) if fld.is_filler else cdata.get_binary_value(fld.name) for fld in cdata.cfg.cfg_struct)
+
+@pytest.fixture
+def signed_cfg(tmp_path):
+    return mstd.Config(make_header(tmp_path, 1, 1, {'uint16_t reserved = 0;': 'int16_t offset = 0;'}))
+
+def test_layout(cfg):
+    assert cfg.codec.size == cfg.size
+    assert [fld.name for fld in cfg.codec_fields] == [fld.name for fld in cfg.cfg_struct if not fld.is_filler]
+
+def test_encode(cfg, image):
+    cdata = mstd.ConfigData(cfg)
+    cdata.load_bin_config(image)
+    assert cdata.get_full_binary() == field_by_field(cdata) == image
+
+def test_crc(image):
+    assert int.from_bytes(image[:4], 'little') == eval_crc(image[4:])
+
+def test_round_trip(cfg, image):
+    cdata = mstd.ConfigData(cfg)
+    cdata.load_bin_config(image)
+    assert cdata.get_toml_value('ssid') == 'lab' and cdata.get_toml_value('oled_contrast') == 42
+    assert cdata.save_bin_config(False) == image
+
+def test_signed(signed_cfg):
+    cdata = mstd.ConfigData(signed_cfg)
+    cdata.set_toml_value('offset', -5)
+    image = cdata.save_bin_config(False)
+    assert image == field_by_field(cdata)
+    loaded = mstd.ConfigData(signed_cfg)
+    loaded.load_bin_config(image)
+    assert loaded.get_toml_value('offset') == -5
+
+def test_truncated(cfg, image):
+    # Forced load of short image - missed tail is zero
+    cdata = mstd.ConfigData(cfg)
+    cdata.load_bin_config(image[:-8], force=2)
+    assert cdata.get_toml_value('ssid') == 'lab' and cdata.get_full_binary()[-8:] == bytes(8)
+
+def test_string_overflow(cfg):
+    cdata = mstd.ConfigData(cfg)
+    cdata.set_toml_value('ssid', 'x' * 40)
+    assert cdata.get_full_binary() == field_by_field(cdata)
@@ -0,0 +1,36 @@
+﻿"""
+    CRC32 engine and CRC algebra
+"""
+import random
+
+import pytest
+
+from crc32 import eval_crc, crc32_table, crc32_combine, crc32_patch, Crc32, self_test
+
+DATA = random.Random(7).randbytes(3000)
+
+def test_check_value():
+    assert eval_crc(b'123456789') == crc32_table(b'123456789') == 0xCBF43926
+    assert eval_crc(b'') == 0
+
+def test_incremental():
+    crc = Crc32(DATA[:10])
+    copy = crc.copy().update(b'x')
+    assert crc.update(DATA[10:1000]).update(DATA[1000:]).value == eval_crc(DATA)
+    assert copy.value == eval_crc(DATA[:10] + b'x')
+
+@pytest.mark.parametrize('split', [0, 1, 511, 3000])
+def test_combine(split):
+    assert crc32_combine(eval_crc(DATA[:split]), eval_crc(DATA[split:]), len(DATA) - split) == eval_crc(DATA)
+
+@pytest.mark.parametrize('pos, size', [(0, 4), (100, 33), (2999, 1), (1000, 2000)])
+def test_patch(pos, size):
+    new = bytes(b ^ 0x5A for b in DATA[pos:pos+size])
+    patched = DATA[:pos] + new + DATA[pos+size:]
+    assert crc32_patch(eval_crc(DATA), DATA[pos:pos+size], new, len(DATA) - pos - size) == eval_crc(patched)
+
+def test_patch_same():
+    assert crc32_patch(0x12345678, b'abc', b'abc', 10) == 0x12345678
+
+def test_self_test():
+    assert self_test(rounds=20)
@@ -0,0 +1,117 @@
+﻿"""
+    Provisioning daemon: jobs against MSTD emulator and local HTTP API
+"""
+import json
+import random
+import threading
+import urllib.request
+import urllib.error
+
+import pytest
+
+from conftest import mstd
+from tftp_emu import DeviceEmulator, FW_MAGIC
+
+@pytest.fixture
+def emu():
+    with DeviceEmulator(port=0) as emu:
+        yield emu
+
+@pytest.fixture
+def host(emu) -> str:
+    return f'127.0.0.1:{emu.port}'
+
+@pytest.fixture
+def daemon(cfg, tmp_path, monkeypatch):
+    monkeypatch.setenv('MSTD_CACHE_DIR', str(tmp_path / 'cache'))
+    daemon = mstd.ProvisioningDaemon(cfg, {}, 2, quiet=True)
+    yield daemon
+    daemon.close()
+
+def run(daemon: 'mstd.ProvisioningDaemon', request: dict) -> 'mstd.DaemonJob':
+    job = daemon.submit(request)
+    assert job.done.wait(10)
+    return job
+
+@pytest.mark.parametrize('request_, match', [({'op': 'erase', 'host': 'h'}, 'Unknown job op'), ({'op': 'push'}, 'host'),
+                                             ({'op': 'push', 'host': 'h'}, 'needs "config"'), ({'op': 'flash', 'host': 'h', 'fw': 'none.bin'}, 'existing "fw"'),
+                                             ({'op': 'pull', 'host': 'h', 'values': {'ssid': 'x'}}, 'takes no'),
+                                             ({'op': 'push', 'host': 'h', 'values': {'ssid': 'x'}, 'skip_unchanged': 'yes'}, 'skip_unchanged'),
+                                             ({'op': 'push', 'host': 'h', 'values': {'bogus': 1}}, 'Unknown field')])
+def test_bad_request(daemon, request_, match):
+    with pytest.raises(AssertionError, match=match):
+        daemon.submit(request_)
+    assert not daemon.jobs
+
+def test_push_pull(daemon, emu, host, tmp_path):
+    job = run(daemon, {'op': 'push', 'host': host, 'values': {'ssid': 'lab', 'oled_contrast': 42}})
+    assert job.status == 'done' and emu.partition.config == job.device.image
+    assert [t['file_name'] for t in job.transfers] == ['cfg.cfg']
+    emu.reboot()
+    out = tmp_path / 'pulled.toml'
+    job = run(daemon, {'op': 'pull', 'host': host, 'out': str(out)})
+    assert job.status == 'done' and job.result['config']['ssid'] == 'lab' and "ssid = 'lab'" in out.read_text()
+    assert daemon.status()['sessions'] == [host]    # Both jobs used one session
+
+def test_flash(daemon, emu, host, tmp_path):
+    fw = bytes([FW_MAGIC]) + random.Random(1).randbytes(3000)
+    fname = tmp_path / 'fw.bin'
+    fname.write_bytes(fw)
+    job = run(daemon, {'op': 'flash', 'host': host, 'fw': str(fname), 'values': {'ssid': 'flashed'}})
+    assert job.status == 'done' and [t['file_name'] for t in job.transfers] == ['cfg.cfg', 'fw.bin']
+    assert emu.firmware == fw and emu.partition.config == job.device.image
+    run(daemon, {'op': 'flash', 'host': host, 'fw': str(fname)})
+    assert len(daemon.firmware) == 1    # Firmware image is kept in memory
+
+def test_skip_unchanged(daemon, emu, host):
+    request = {'op': 'push', 'host': host, 'values': {'ssid': 'lab'}, 'skip_unchanged': 'read'}
+    assert run(daemon, request).device.changes
+    job = run(daemon, request)      # Read-back returns boot time config, cache knows it was written since
+    assert job.status == 'done' and job.device.changes == []
+    assert [t.op for t in emu.transfers] == ['read', 'write', 'read']
+
+def test_failed_job(daemon):
+    daemon.tftp_args = {'deadline': 0.3}
+    job = run(daemon, {'op': 'pull', 'host': '127.0.0.1:9'})
+    assert job.status == 'failed' and job.error.startswith('read:')
+
+def test_serialized(daemon, emu, host):
+    jobs = [daemon.submit({'op': 'push', 'host': host, 'values': {'oled_contrast': n}}) for n in range(5)]
+    for job in jobs:
+        assert job.done.wait(10) and job.status == 'done'
+    assert emu.partition.config == jobs[-1].device.image
+    assert all(a.finished <= b.started for a, b in zip(jobs, jobs[1:]))
+
+@pytest.fixture
+def api(daemon):
+    server = mstd.DaemonHTTPServer(('127.0.0.1', 0), mstd.DaemonRequestHandler)
+    server.daemon = daemon
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+def call(url: str, body: dict = None) -> tuple[int, dict|list]:
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data), timeout=10) as answer:
+            return answer.status, json.load(answer)
+    except urllib.error.HTTPError as exp:
+        return exp.code, json.load(exp)
+
+def test_api(api, emu, host):
+    code, job = call(f'{api}/jobs', {'op': 'push', 'host': host, 'values': {'ssid': 'api'}})
+    assert code == 202 and job['op'] == 'push'
+    code, job = call(f'{api}/jobs/{job["id"]}?wait=10')
+    assert code == 200 and job['status'] == 'done' and job['transfers']
+    code, jobs = call(f'{api}/jobs')
+    assert [j['id'] for j in jobs] == [job['id']]
+    code, status = call(f'{api}/status')
+    assert status['sessions'] == [host] and status['running'] == 0
+
+def test_api_errors(api):
+    assert call(f'{api}/jobs', {'op': 'erase', 'host': 'h'})[0] == 400
+    assert call(f'{api}/jobs', [1])[0] == 400
+    assert call(f'{api}/jobs/99')[0] == 404
+    assert call(f'{api}/other', {})[0] == 404
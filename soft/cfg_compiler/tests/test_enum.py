@@ -0,0 +1,60 @@
+﻿"""
+    Enum encode/decode tables
+"""
+import pickle
+
+import pytest
+
+from conftest import mstd
+
+@pytest.fixture
+def options(cfg) -> 'mstd.EnumDef':
+    return cfg.enums['Options1']
+
+def test_str2int(options):
+    assert options.str2int('AP') == 1
+    assert options.str2int('WFOP_Both') == options.str2int('WFOP.Both') == options.str2int('WFOP::Both') == 3
+    assert options.str2int('Sta | Options') == options.str2int('Sta,Options') == 0x0A
+
+def test_str2int_errors(options):
+    with pytest.raises(AssertionError, match='unknown'):
+        options.str2int('Bogus')
+    with pytest.raises(AssertionError, match='unknown'):
+        options.str2int('#0x10')    # Unnamed bits are shown by int2str, but not accepted
+
+def test_int2str(options):
+    assert options.int2str(0x04) == 'Auto'
+    assert options.int2str(0x0B) == 'Both|Options'
+    assert options.int2str(0x14) == 'Auto|#0x10'
+    for val in range(256):
+        if '#' not in (name := options.int2str(val)):
+            assert options.str2int(name) == val
+
+def test_pickle(options):
+    enum = pickle.loads(pickle.dumps(options))
+    assert enum.int2str(3) == 'Both' and enum.str2int('Sta') == 2
+
+@pytest.fixture
+def wide() -> 'mstd.EnumDef':
+    enum = mstd.EnumDef('Wide', 'uint16_t', [mstd.EnumField('WD_Low', 0x01), mstd.EnumField('WD_High', 0x100)])
+    enum.post_init()
+    return enum
+
+def test_names_lazy(cfg):
+    enum = mstd.Config.from_schema(cfg.to_schema()).enums['Options1']
+    assert enum.names is None
+    assert enum.int2str(3) == 'Both' and len(enum.names) == 256
+
+def test_wide_cache(wide, monkeypatch):
+    monkeypatch.setattr(mstd.EnumDef, 'DECODE_CACHE_SIZE', 4)
+    assert wide.int2str(0x101) == 'Low|High'
+    for val in range(2, 10):
+        wide.int2str(val << 9)
+    assert len(wide.decoded) == 4 and 0x101 not in wide.decoded
+    assert wide.int2str(0x101) == 'Low|High'
+
+def test_pickle_wide(wide):
+    wide.int2str(0x100)
+    enum = pickle.loads(pickle.dumps(wide))
+    assert not enum.decoded and enum.names is None
+    assert enum.int2str(0x101) == 'Low|High' and enum.str2int('High') == 0x100
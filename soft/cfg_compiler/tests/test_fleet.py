@@ -0,0 +1,80 @@
+﻿"""
+    Fleet provisioning (--hosts/--manifest) against several MSTD emulators
+"""
+import asyncio
+import argparse
+import random
+import contextlib
+
+import pytest
+
+from conftest import mstd
+from tftp_emu import DeviceEmulator, Impairment, FW_MAGIC
+
+def host_of(emu: DeviceEmulator) -> str:
+    return f'127.0.0.1:{emu.port}'
+
+def test_load_manifest(tmp_path):
+    fname = tmp_path / 'fleet.toml'
+    fname.write_text("""
+[defaults]
+fw = 'fw.bin'
+config = 'base.toml'
+values = {oled_contrast = 100, ssid = 'Lab'}
+
+[[device]]
+host = '10.0.0.1'
+
+[[device]]
+host = '10.0.0.2'
+fw = 'other.bin'
+config = ['a.toml', 'b.toml']
+values = {ssid = 'Unit2'}
+""")
+    first, second = mstd.load_manifest(str(fname))
+    assert (first.host, first.fw, first.config, first.values) == ('10.0.0.1', 'fw.bin', ['base.toml'], {'oled_contrast': 100, 'ssid': 'Lab'})
+    assert (second.fw, second.config, second.values) == ('other.bin', ['a.toml', 'b.toml'], {'oled_contrast': 100, 'ssid': 'Unit2'})
+
+def test_empty_manifest(tmp_path):
+    fname = tmp_path / 'fleet.toml'
+    fname.write_text('[defaults]\nfw = "fw.bin"\n')
+    with pytest.raises(AssertionError, match='No devices'):
+        mstd.load_manifest(str(fname))
+
+def test_provision_fleet(cfg, tmp_path):
+    fw = bytes([FW_MAGIC]) + random.Random(1).randbytes(3000)
+    fw_file = tmp_path / 'fw.bin'
+    fw_file.write_bytes(fw)
+    with contextlib.ExitStack() as stack:
+        emus = [stack.enter_context(DeviceEmulator(port=0)) for _ in range(3)]
+        dead = stack.enter_context(DeviceEmulator(port=0, impairment=Impairment(drop=lambda direction, pkt: True)))
+        jobs = [mstd.DeviceJob(host_of(emu), str(fw_file), values={'ssid': f'unit{n}'}) for n, emu in enumerate(emus)]
+        jobs.append(mstd.DeviceJob(host_of(dead), str(fw_file), values={'ssid': 'dead'}))
+        for job in jobs:
+            job.build_image(cfg, 0, False)
+        asyncio.run(mstd.provision_fleet(jobs, {'deadline': 1.0}, 2, True, cfg))
+    assert len({job.image for job in jobs}) == len(jobs)
+    for job, emu in zip(jobs, emus):
+        assert job.status == 'ok' and not job.error
+        assert emu.firmware == fw and emu.partition.config == job.image
+    assert jobs[-1].status == 'failed' and jobs[-1].error.startswith('config:')
+
+def test_config_error_stops_fleet(cfg, tmp_path):
+    args = argparse.Namespace(force=0, unsafe_crc=False, jobs=2, quiet=True, skip_unchanged=None)
+    with DeviceEmulator(port=0) as emu:
+        jobs = [mstd.DeviceJob(host_of(emu), values={'ssid': 'ok'}), mstd.DeviceJob('10.0.0.2', values={'bogus_field': 1})]
+        with pytest.raises(AssertionError, match='Config errors'):
+            mstd.run_fleet(jobs, cfg, args, {})
+    assert not emu.transfers and jobs[1].status == 'failed'
+
+def test_fleet_skip_unchanged(cfg, image, old_image, tmp_path, monkeypatch):
+    # Same config pushed twice in one boot is written once, stale boot-time read-back is corrected by cache
+    monkeypatch.setenv('MSTD_CACHE_DIR', str(tmp_path))
+    with DeviceEmulator(port=0) as emu:
+        emu.partition.save_image(old_image)
+        emu.reboot()
+        for pushed, written in ((image, True), (image, False), (old_image, True)):
+            job = mstd.DeviceJob(host_of(emu), image=pushed)
+            asyncio.run(mstd.provision_fleet([job], {}, 1, True, cfg, 'read'))
+            assert job.status == 'ok' and bool(job.changes) == written
+            assert emu.partition.config == pushed
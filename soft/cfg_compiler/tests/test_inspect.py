@@ -0,0 +1,64 @@
+﻿"""
+    Bulk decoder of binary config dumps (--inspect)
+"""
+import io
+import csv
+import json
+import tarfile
+
+import pytest
+
+from conftest import mstd
+from tftp_emu import ConfigPartition
+
+@pytest.fixture
+def dumps(image, old_image, tmp_path):
+    """
+        Directory of dumps: config records, partition with 2 records, broken and unsafe images, firmware
+    """
+    path = tmp_path / 'dumps'
+    (path / 'b').mkdir(parents=True)
+    (path / 'a.cfg').write_bytes(image)
+    partition = ConfigPartition()
+    partition.save_image(old_image)
+    partition.save_image(image)
+    (path / 'b' / 'full.cfg').write_bytes(partition.image)
+    (path / 'b' / 'bad.bin').write_bytes(image[:4] + b'\0' + image[5:])
+    (path / 'b' / 'unsafe.cfg').write_bytes(b'\xFF' * 4 + image[4:])
+    (path / 'b' / 'fw.bin').write_bytes(b'\xE9' * 200000)   # Firmware is skipped
+    (path / 'notes.txt').write_text('not a dump')
+    return path
+
+def test_find_config_record(image, old_image):
+    partition = ConfigPartition()
+    assert mstd.find_config_record(partition.image) is None
+    partition.save_image(old_image)
+    partition.save_image(image)
+    assert mstd.active_config_record(partition.image) == image
+    assert mstd.find_config_record(partition.image) == (len(old_image), len(image))
+
+def test_iter_dump_images(dumps):
+    assert [name for name, _ in mstd.iter_dump_images(str(dumps))] == ['a.cfg', 'b/bad.bin', 'b/full.cfg', 'b/unsafe.cfg']
+
+def test_iter_tar(dumps, tmp_path):
+    fname = tmp_path / 'dumps.tar.gz'
+    with tarfile.open(fname, 'w:gz') as tar:
+        tar.add(dumps, 'dumps')
+    assert sorted(name for name, _ in mstd.iter_dump_images(str(fname))) == ['dumps/a.cfg', 'dumps/b/bad.bin', 'dumps/b/full.cfg', 'dumps/b/unsafe.cfg']
+
+def test_inspect_jsonl(cfg, dumps):
+    out = io.StringIO()
+    assert mstd.run_inspect(cfg, str(dumps), out, 'jsonl', 2) == (4, 1)
+    rows = {row['image']: row for row in map(json.loads, out.getvalue().splitlines())}
+    assert list(rows) == ['a.cfg', 'b/bad.bin', 'b/full.cfg', 'b/unsafe.cfg']    # Source order
+    assert rows['a.cfg']['status'] == 'ok' and rows['a.cfg']['ssid'] == 'lab' and rows['a.cfg']['oled_contrast'] == 42
+    assert rows['b/full.cfg']['ssid'] == 'lab'  # Active (last) record
+    assert rows['b/bad.bin']['status'] == 'error' and 'CRC' in rows['b/bad.bin']['message']
+    assert rows['b/unsafe.cfg']['status'] == 'warning' and rows['b/unsafe.cfg']['ssid'] == 'lab'
+
+def test_inspect_csv(cfg, dumps):
+    out = io.StringIO()
+    mstd.run_inspect(cfg, str(dumps), out, 'csv', 1)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert list(rows[0]) == mstd.inspect_columns(cfg)
+    assert [row['status'] for row in rows] == ['ok', 'error', 'ok', 'warning']
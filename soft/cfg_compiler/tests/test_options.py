@@ -0,0 +1,75 @@
+﻿"""
+    TFTP option negotiation (RFC 2347/2348/2349)
+"""
+import socket
+import threading
+
+import pytest
+
+from conftest import mstd
+from tftp_emu import DeviceEmulator, Impairment, FW_MAGIC, WRQ, DATA, ACK, ERROR
+
+def options_of(pkt: bytes) -> dict[str, str]:
+    fields = pkt[2:].split(b'\0')[2:-1]
+    return {fields[n].decode(): fields[n + 1].decode() for n in range(0, len(fields), 2)}
+
+def test_request_options():
+    tftp = mstd.TFTPClient('127.0.0.1', blk_size=1468, window_size=4)
+    assert list(tftp.request_options(100)) == ['blksize', 'windowsize', 'tsize', 'timeout']    # MSTD looks only at first option
+    assert 'blksize' not in mstd.TFTPClient('127.0.0.1').request_options(100)
+    tftp.close()
+
+@pytest.mark.parametrize('blk_size', [7, 65465])
+def test_blk_size_range(blk_size):
+    with pytest.raises(AssertionError, match='Block size'):
+        mstd.TFTPClient('127.0.0.1', blk_size=blk_size)
+
+def test_blksize_oack():
+    # MSTD answers any blksize by OACK blksize=512
+    fw = bytes([FW_MAGIC]) + bytes(range(256)) * 12
+    requests = []
+    with DeviceEmulator(port=0, impairment=Impairment(drop=lambda direction, pkt: pkt[1] == WRQ and requests.append(pkt))) as emu:
+        tftp = mstd.TFTPClient('127.0.0.1', port=emu.port, blk_size=1468)
+        tftp.send('fw.bin', fw, False)
+        tftp.close()
+    assert emu.firmware == fw
+    assert options_of(requests[0])['blksize'] == '1468' and tftp.stats.block_size == 512
+
+@pytest.mark.parametrize('oack, match', [({'bogus': '1'}, 'unrequested'), ({'blksize': '2048'}, 'blksize'), ({'timeout': '1'}, 'timeout'), ({'tsize': 'x'}, 'Wrong value')])
+def test_bad_oack(oack, match):
+    tftp = mstd.TFTPClient('127.0.0.1', blk_size=1024)
+    tftp.options = tftp.request_options(10)
+    with pytest.raises(AssertionError, match=match):
+        tftp.apply_options(oack)
+    tftp.close()
+
+def test_options_refused():
+    # Server without option support answers ERROR 8 - request is repeated without options
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    requests = []
+    received = bytearray()
+    def serve():
+        while True:
+            pkt, addr = server.recvfrom(2048)
+            if pkt[1] == WRQ:
+                requests.append(pkt)
+                answer = bytes([0, ERROR, 0, 8]) + b'no options\0' if options_of(pkt) else bytes([0, ACK, 0, 0])
+            else:
+                assert pkt[1] == DATA
+                received.extend(pkt[4:])
+                answer = bytes([0, ACK]) + pkt[2:4]
+            server.sendto(answer, addr)
+            if pkt[1] == DATA and len(pkt) < 516:
+                return
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    data = bytes(range(256)) * 5
+    tftp = mstd.TFTPClient('127.0.0.1', port=server.getsockname()[1], blk_size=1024)
+    tftp.send('cfg.cfg', data, False)
+    tftp.close()
+    thread.join(5)
+    server.close()
+    assert len(requests) == 2 and options_of(requests[0]) and not options_of(requests[1])
+    assert received == data and tftp.stats.block_size == 512
@@ -0,0 +1,40 @@
+﻿"""
+    In place editor of config partition image
+"""
+import pytest
+
+from conftest import mstd, make_header
+
+def partition(cfg, *records: bytes) -> bytearray:
+    return bytearray(b''.join(records).ljust(cfg.max_cfg_size, b'\xFF'))
+
+def test_edit(cfg, image, tmp_path):
+    old = mstd.ConfigData(cfg)
+    old.set_toml_value('ssid', 'old')
+    fname = tmp_path / 'full.cfg'
+    fname.write_bytes(partition(cfg, old.save_bin_config(False), image))   # Last record is active one
+    assert mstd.edit_partition_file(cfg, str(fname), [('oled_contrast', '0x10'), ('ssid', 'lab'), ('options1', 'AP')], True) == 2
+
+    result = fname.read_bytes()
+    assert mstd.find_config_record(result) == (len(image), len(image))
+    cdata = mstd.ConfigData(cfg)
+    cdata.load_bin_config(result[len(image):2*len(image)], 0)  # CRC is checked
+    assert cdata.get_toml_value('oled_contrast') == 16 and cdata.get_toml_value('options1') == 'AP'
+
+def test_bad_value_changes_nothing(cfg, image, tmp_path):
+    fname = tmp_path / 'full.cfg'
+    fname.write_bytes(partition(cfg, image))
+    with pytest.raises(AssertionError):
+        mstd.edit_partition_file(cfg, str(fname), [('oled_contrast', '7'), ('options1', 'Nope')], True)
+    assert fname.read_bytes() == partition(cfg, image)
+
+def test_header_fields(cfg, image):
+    editor = mstd.PartitionEditor(cfg, partition(cfg, image))
+    with pytest.raises(AssertionError, match='can not be changed'):
+        editor.set_value('version', 2)
+
+def test_other_version(image, tmp_path):
+    # V1 record is compatible with V2 layout, but field offsets can differ - it is not patched
+    current = mstd.Config(make_header(tmp_path, 2, 1))
+    with pytest.raises(AssertionError, match='version 1 differs'):
+        mstd.PartitionEditor(current, partition(current, image))
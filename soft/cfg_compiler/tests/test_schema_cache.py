@@ -0,0 +1,79 @@
+﻿"""
+    Compiled schema: user cache of parsed setup_data.h and generated schema module
+"""
+import os
+import json
+
+import pytest
+
+from conftest import mstd, make_header, CFG_DIR
+
+HEADER = os.path.join(CFG_DIR, 'setup_data.h')
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('MSTD_CACHE_DIR', str(path))
+    return path
+
+@pytest.fixture
+def parsed(monkeypatch) -> list[str]:
+    """
+        Names of headers parsed by Config
+    """
+    result = []
+    init = mstd.Config.__init__
+    def counting_init(self, fname=None):
+        if fname:
+            result.append(fname)
+        init(self, fname)
+    monkeypatch.setattr(mstd.Config, '__init__', counting_init)
+    return result
+
+def image_of(cfg: 'mstd.Config') -> bytes:
+    cdata = mstd.ConfigData(cfg)
+    cdata.set_toml_value('ssid', 'lab')
+    cdata.set_toml_value('options1', 'Both|Options')
+    return cdata.save_bin_config(False)
+
+def test_schema_round_trip(cfg):
+    schema = json.loads(json.dumps(cfg.to_schema()))
+    loaded = mstd.Config.from_schema(schema)
+    assert loaded.to_schema() == cfg.to_schema() and image_of(loaded) == image_of(cfg)
+
+def test_cache_hit(cfg, cache_dir, parsed):
+    first = mstd.load_config(HEADER)
+    assert parsed == [HEADER] and len(os.listdir(cache_dir)) == 1
+    second = mstd.load_config(HEADER)
+    assert parsed == [HEADER]   # Not parsed again
+    assert second.to_schema() == cfg.to_schema() == first.to_schema()
+
+def test_cache_miss_on_change(tmp_path, cache_dir, parsed):
+    mstd.load_config(HEADER)
+    other = make_header(tmp_path, 2, 1)
+    assert mstd.load_config(other).version == 2
+    assert parsed == [HEADER, other] and len(os.listdir(cache_dir)) == 2
+
+def test_broken_cache(cfg, cache_dir, parsed):
+    mstd.load_config(HEADER)
+    cache_file, = cache_dir.iterdir()
+    cache_file.write_text('{"version": ')
+    assert mstd.load_config(HEADER).to_schema() == cfg.to_schema()
+    assert len(parsed) == 2 and json.loads(cache_file.read_text()) == json.loads(json.dumps(cfg.to_schema()))
+
+def test_no_cache(cache_dir, parsed):
+    mstd.load_config(HEADER, False)
+    assert parsed == [HEADER] and not cache_dir.exists()
+
+def test_emit_schema_module(cfg, tmp_path, parsed):
+    fname = str(tmp_path / 'schema.py')
+    mstd.emit_schema_module(cfg, HEADER, fname)
+    loaded = mstd.load_config(fname)
+    assert not parsed   # Header is not parsed
+    assert loaded.to_schema() == cfg.to_schema() and image_of(loaded) == image_of(cfg)
+
+def test_schema_module_without_schema(tmp_path):
+    fname = tmp_path / 'bogus.py'
+    fname.write_text('X = 1\n')
+    with pytest.raises(AssertionError, match='No SCHEMA'):
+        mstd.load_config(str(fname))
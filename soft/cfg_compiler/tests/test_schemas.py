@@ -0,0 +1,26 @@
+﻿"""
+    Schema registry: decode and migration of older config versions
+"""
+import pytest
+
+from conftest import mstd, make_header
+
+def test_compatible_version_without_layout(image, tmp_path):
+    # V1 is in LC_ConfigVersion..ConfigVersion of V2 - read by current layout as load_bin_config does
+    current = mstd.Config(make_header(tmp_path, 2, 1))
+    cdata, notes = mstd.SchemaRegistry(current, use_cache=False).decode(image)
+    assert cdata.cfg is current and not notes
+    assert cdata.get_toml_value('ssid') == 'lab' and cdata.get_toml_value('oled_contrast') == 42
+
+def test_unknown_version(image, tmp_path):
+    current = mstd.Config(make_header(tmp_path, 2, 2))
+    with pytest.raises(AssertionError, match='Unknown config version 1'):
+        mstd.SchemaRegistry(current, use_cache=False).decode(image)
+
+def test_migrate(image, tmp_path):
+    old = make_header(tmp_path, 1, 1)
+    current = mstd.Config(make_header(tmp_path, 2, 2, {'char ssid[33] = {0};': 'char ssid[3] = {0};\n    uint16_t port = 80;'}))
+    cdata, notes = mstd.SchemaRegistry(current, [old], use_cache=False).decode(image)
+    assert cdata.cfg.version == 2
+    assert cdata.get_toml_value('ssid') == 'la' and cdata.get_toml_value('port') == 80 and cdata.get_toml_value('oled_contrast') == 42
+    assert notes == ['Field "ssid" truncated to 2 bytes']
@@ -0,0 +1,53 @@
+﻿"""
+    TFTPSession: transfers of one run share one client (socket and RTT estimation)
+"""
+import random
+
+import pytest
+
+from conftest import mstd
+from tftp_emu import DeviceEmulator, FW_MAGIC
+
+@pytest.fixture
+def emu():
+    with DeviceEmulator(port=0) as emu:
+        yield emu
+
+@pytest.fixture
+def session(emu):
+    with mstd.TFTPSession(f'127.0.0.1:{emu.port}') as session:
+        yield session
+
+def test_queue(emu, session, image):
+    fw = bytes([FW_MAGIC]) + random.Random(1).randbytes(2000)
+    sock = session.client.socket
+    ops = [session.add('cfg.cfg', image), session.add('fw.bin', fw), session.add('cfg.cfg')]
+    assert not emu.transfers    # Nothing is sent till 'run'
+    assert session.run() == ops and not session.queue
+    assert session.client.socket is sock
+    assert [(t.op, t.file_name) for t in emu.transfers] == [('write', 'cfg.cfg'), ('write', 'fw.bin'), ('read', 'cfg.cfg')]
+    assert ops[2].result == image and emu.firmware == fw   # Firmware update reboots MSTD - written config is served
+
+def test_rtt_kept(session, image):
+    session.send('cfg.cfg', image, False)
+    assert session.client.rtt.srtt is not None
+    session.client.start_transfer(mstd.TFTPClient.WRQ, 'cfg.cfg', len(image))  # Next transfer starts with learned RTO
+    assert session.client.rtt.rto < mstd.TFTPClient.INIT_TOUT
+
+def test_failed_op_clears_queue(emu, session, image):
+    session.add('fw.bin')       # Firmware can't be read
+    session.add('cfg.cfg', image)
+    with pytest.raises(AssertionError):
+        session.run()
+    assert not session.queue
+    session.send('cfg.cfg', image, False)   # Session is still usable
+    assert emu.partition.config == image
+
+def test_shared_sessions():
+    try:
+        first = mstd.TFTPSession.get('127.0.0.1:6969')
+        assert mstd.TFTPSession.get('127.0.0.1:6969') is first
+        assert mstd.TFTPSession.get('127.0.0.2:6969') is not first
+    finally:
+        mstd.TFTPSession.close_all()
+    assert not mstd.TFTPSession.sessions
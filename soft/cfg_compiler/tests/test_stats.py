@@ -0,0 +1,62 @@
+﻿"""
+    TFTP transfer telemetry: counters and --stats-json output
+"""
+import json
+
+from conftest import mstd
+from tftp_emu import DeviceEmulator, Impairment, DATA, FW_MAGIC
+
+def drop_once(pkt: bytes):
+    """
+        Drop predicate: first copy of incoming 'pkt' is lost
+    """
+    dropped = []
+    def drop(direction, data):
+        if direction == 'in' and data == pkt and not dropped:
+            dropped.append(data)
+            return True
+        return False
+    return drop
+
+FW = bytes([FW_MAGIC]) + bytes(range(256)) * 8    # 5 blocks of 512 bytes
+
+def test_counters():
+    fw = FW
+    collected = []
+    with DeviceEmulator(port=0) as emu:
+        tftp = mstd.TFTPClient('127.0.0.1', port=emu.port, stats_hook=collected.append)
+        tftp.send('fw.bin', fw, False)
+        tftp.close()
+    stats, = collected
+    assert (stats.direction, stats.file_name, stats.size, stats.blocks) == ('send', 'fw.bin', len(fw), 5)
+    assert stats.retransmits == stats.timeouts == stats.duplicates == 0 and not stats.unconfirmed
+    assert len(stats.gaps) == 5 and stats.rtt
+
+def test_counters_lost_block():
+    block2 = bytes([0, DATA, 0, 2]) + FW[512:1024]
+    with DeviceEmulator(port=0, impairment=Impairment(drop=drop_once(block2))) as emu:
+        tftp = mstd.TFTPClient('127.0.0.1', port=emu.port)
+        tftp.send('fw.bin', FW, False)
+        tftp.close()
+    assert emu.firmware == FW
+    assert tftp.stats.timeouts == 1 and tftp.stats.retransmits >= 1 and tftp.stats.blocks == 5
+
+def test_histogram():
+    hist = mstd.TransferStats.histogram([0.0005, 0.001, 0.003, 10])
+    assert hist['<=1ms'] == 2 and hist['<=5ms'] == 1 and hist['>5s'] == 1 and sum(hist.values()) == 4
+    assert mstd.TransferStats.percentiles([3.0, 1.0, 2.0]) == {'min': 1.0, 'avg': 2.0, 'p50': 2.0, 'p95': 3.0, 'max': 3.0}
+
+def test_stats_json(tmp_path, image):
+    fname = tmp_path / 'stats.jsonl'
+    fname.write_text('stale\n')
+    hook = mstd.make_stats_hook(False, str(fname))
+    assert fname.read_text() == ''
+    with DeviceEmulator(port=0) as emu:
+        tftp = mstd.TFTPClient('127.0.0.1', port=emu.port, stats_hook=hook)
+        tftp.send('cfg.cfg', image, False)
+        assert len(fname.read_text().splitlines()) == 1    # Written as soon as transfer is finished
+        emu.reboot()
+        tftp.read('cfg.cfg')
+        tftp.close()
+    records = [json.loads(line) for line in fname.read_text().splitlines()]
+    assert [(r['direction'], r['size']) for r in records] == [('send', len(image)), ('read', len(image))]
@@ -0,0 +1,235 @@
+﻿"""
+    TFTPClient against MSTD emulator
+"""
+import asyncio
+import random
+
+import pytest
+
+from conftest import mstd
+from tftp_emu import DeviceEmulator, Impairment, ACK, DATA, FW_MAGIC
+
+def ack_of(block_num: int):
+    ack = bytes([0, ACK]) + block_num.to_bytes(2, 'big')
+    return lambda direction, pkt: direction == 'out' and pkt == ack
+
+def client(emu: DeviceEmulator, **kwargs) -> 'mstd.TFTPClient':
+    return mstd.TFTPClient('127.0.0.1', port=emu.port, **kwargs)
+
+def booted_with(emu: DeviceEmulator, image: bytes) -> DeviceEmulator:
+    emu.partition.save_image(image)
+    emu.reboot()
+    return emu
+
+IMPAIRMENTS = {
+    'clean': Impairment(),
+    'loss': Impairment(loss=0.1, seed=1),
+    'duplicate': Impairment(duplicate=0.2, seed=2),
+    'reorder': Impairment(reorder=0.2, seed=3),
+    'latency': Impairment(latency=0.005, jitter=0.005, seed=4),
+}
+
+def firmware(size: int) -> bytes:
+    return bytes([FW_MAGIC]) + random.Random(size).randbytes(size - 1)
+
+@pytest.mark.parametrize('impairment', IMPAIRMENTS, ids=str)
+@pytest.mark.parametrize('window_size', [1, 8])
+def test_push_pull(image, impairment, window_size):
+    fw = firmware(20 * 512)    # Last block is empty
+    with DeviceEmulator(port=0, impairment=IMPAIRMENTS[impairment]) as emu:
+        tftp = client(emu, blk_size=1024, window_size=window_size, deadline=60)
+        tftp.send('cfg.cfg', image, False)
+        tftp.send('fw.bin', fw, False)    # Firmware update reboots device - written config is read back
+        pulled = tftp.read('cfg.cfg')
+        tftp.close()
+    assert emu.firmware == fw
+    assert pulled == image == emu.partition.config
+
+def test_read_no_config():
+    with DeviceEmulator(port=0) as emu:
+        tftp = client(emu)
+        with pytest.raises(mstd.TFTPServerError) as exp:
+            tftp.read('cfg.cfg')
+        tftp.close()
+    assert exp.value.code == mstd.TFTPClient.ERR_FILE_NOT_FOUND
+
+def test_reboot(image, old_image):
+    # Config is loaded at boot - new one is read back only after reboot
+    with booted_with(DeviceEmulator(port=0), old_image) as emu:
+        tftp = client(emu)
+        tftp.send('cfg.cfg', image, False)
+        assert tftp.read('cfg.cfg') == old_image
+        emu.reboot()
+        assert tftp.read('cfg.cfg') == image
+        tftp.close()
+
+def test_failed_write_not_stored():
+    fw = firmware(5000)
+    last = bytes([0, 3, 0, len(fw) // 512 + 1])
+    with DeviceEmulator(port=0, recv_timeout=0.3, impairment=Impairment(drop=lambda direction, pkt: direction == 'in' and pkt[:4] == last)) as emu:
+        tftp = client(emu, max_retry=2)
+        with pytest.raises(AssertionError):
+            tftp.send('fw.bin', fw, False)
+        tftp.close()
+    assert emu.firmware is None and emu.transfers[0].error == 'Timeout'
+
+def test_session(image, old_image):
+    # All transfers of session share one socket - late packets of previous transfer are dropped
+    fw = firmware(5000)
+    with booted_with(DeviceEmulator(port=0, impairment=Impairment(duplicate=0.3, seed=5)), old_image) as emu:
+        with mstd.TFTPSession(f'127.0.0.1:{emu.port}', {'window_size': 4}) as session:
+            session.add('fw.bin', fw)
+            session.add('cfg.cfg', image)
+            read = session.add('cfg.cfg')
+            session.run()
+    assert emu.firmware == fw and read.result == old_image  # Config was written after reboot of firmware update
+    assert emu.partition.config == image
+
+def test_async_clients(image, old_image):
+    async def push(emu: DeviceEmulator):
+        tftp = mstd.AsyncTFTPClient('127.0.0.1', port=emu.port, window_size=4)
+        await tftp.open()
+        try:
+            old = await tftp.read('cfg.cfg')
+            await tftp.send('cfg.cfg', image, False)
+            return old
+        finally:
+            tftp.close()
+
+    async def push_all(emus: list[DeviceEmulator]):
+        return await asyncio.gather(*(push(emu) for emu in emus))
+
+    emus = [booted_with(DeviceEmulator(port=0, impairment=Impairment(loss=0.05, seed=n)), old_image) for n in range(3)]
+    for emu in emus:
+        emu.__enter__()
+    try:
+        assert asyncio.run(push_all(emus)) == [old_image] * 3
+        assert [emu.partition.config for emu in emus] == [image] * 3
+    finally:
+        for emu in emus:
+            emu.__exit__(None, None, None)
+
+def data_of(block_num: int):
+    return lambda direction, pkt: direction == 'in' and pkt[:4] == bytes([0, DATA]) + block_num.to_bytes(2, 'big')
+
+@pytest.mark.parametrize('window_size', [1, 8])
+def test_lost_final_ack(image, window_size, capsys):
+    # MSTD never ACKs repeated last block - transfer is done after dally, but it is unconfirmed
+    with DeviceEmulator(port=0, impairment=Impairment(drop=ack_of(1))) as emu:
+        tftp = client(emu, window_size=window_size)
+        tftp.send('cfg.cfg', image, False)
+        tftp.close()
+    assert emu.partition.config == image
+    assert tftp.stats.unconfirmed and 'unconfirmed' in capsys.readouterr().err
+
+def test_silence_after_gap(image):
+    # Windowed server (RFC 7440) ACKed block 2 of 3 - silence after window is not a lost final ACK, transfer fails.
+    # Engine is driven directly - MSTD (and emulator) does not support 'windowsize'
+    tftp = mstd.TFTPClient('127.0.0.1', port=9, window_size=4, max_retry=4)
+    engine = tftp.send_engine('cfg.cfg', bytes(1100), False)
+    next(engine)
+    tftp.remote_addr = tftp.addr    # Set from answer by 'run'
+    engine.send((tftp.OACK, {'windowsize': '4', 'tsize': '1100', 'timeout': '5'}))
+    engine.send((tftp.ACK, 1))
+    with pytest.raises(AssertionError, match='Too many attempts'):
+        while True:
+            engine.throw(TimeoutError())
+    tftp.close()
+
+def test_lost_final_block():
+    # Loss of every copy of last block can't be told from lost final ACK - transfer is reported as unconfirmed
+    fw = firmware(3000)
+    with DeviceEmulator(port=0, recv_timeout=1, impairment=Impairment(drop=data_of(6))) as emu:
+        tftp = client(emu)
+        tftp.send('fw.bin', fw, False)
+        tftp.close()
+    assert tftp.stats.unconfirmed and emu.firmware is None
+
+def test_confirmed(image):
+    with DeviceEmulator(port=0) as emu:
+        tftp = client(emu)
+        tftp.send('cfg.cfg', image, False)
+        tftp.close()
+    assert not tftp.stats.unconfirmed
+
+def test_skip_unchanged(cfg, image, tmp_path):
+    cache = mstd.DeviceStateCache(str(tmp_path / 'devices.json'))
+    with DeviceEmulator(port=0) as emu, mstd.TFTPSession(f'127.0.0.1:{emu.port}') as session:
+        assert mstd.push_config_if_changed(session, cfg, image, 'read', cache, False)  # No config on MSTD yet
+        emu.reboot()
+        assert not mstd.push_config_if_changed(session, cfg, image, 'read', cache, False)
+        writes = [t for t in emu.transfers if t.op == 'write']
+    assert len(writes) == 1 and emu.partition.config == image
+
+def test_skip_unchanged_stale_read(cfg, image, old_image, tmp_path):
+    # MSTD serves boot-time config (old_image) until reboot - push of old_image after push of image is not skipped
+    cache = mstd.DeviceStateCache(str(tmp_path / 'devices.json'))
+    with booted_with(DeviceEmulator(port=0), old_image) as emu, mstd.TFTPSession(f'127.0.0.1:{emu.port}') as session:
+        assert mstd.push_config_if_changed(session, cfg, image, 'read', cache, False)
+        assert emu.partition.config == image
+        assert mstd.push_config_if_changed(session, cfg, old_image, 'read', cache, False)
+        assert emu.partition.config == old_image
+        assert not mstd.push_config_if_changed(session, cfg, old_image, 'read', cache, False)
+        emu.reboot()
+        assert not mstd.push_config_if_changed(session, cfg, old_image, 'read', cache, False)
+        assert mstd.push_config_if_changed(session, cfg, image, 'read', cache, False)
+        writes = [t for t in emu.transfers if t.op == 'write']
+    assert len(writes) == 3 and emu.partition.config == image
+
+class FailingSession:
+    """
+        Session whose read of current config fails with 'error'
+    """
+    host = 'mstd'
+
+    def __init__(self, error: AssertionError):
+        self.error = error
+        self.sent = []
+
+    def read(self, file_name: str):
+        raise self.error
+
+    def send(self, file_name: str, data: bytes, verbose: bool):
+        self.sent.append(file_name)
+
+def test_skip_unchanged_no_config(cfg, image, tmp_path):
+    session = FailingSession(mstd.TFTPServerError(mstd.TFTPClient.ERR_FILE_NOT_FOUND, 'cannot open file'))
+    assert mstd.push_config_if_changed(session, cfg, image, 'read', mstd.DeviceStateCache(str(tmp_path / 'devices.json')), False)
+    assert session.sent == ['cfg.cfg']
+
+@pytest.mark.parametrize('error', [AssertionError('Too many attempts'), mstd.TFTPServerError(2, 'cannot open file')])
+def test_skip_unchanged_read_error(cfg, image, tmp_path, error):
+    # Failed read-back is not 'no config' - config is not written blindly
+    session = FailingSession(error)
+    with pytest.raises(AssertionError):
+        mstd.push_config_if_changed(session, cfg, image, 'read', mstd.DeviceStateCache(str(tmp_path / 'devices.json')), False)
+    assert not session.sent
+
+def test_image_source_failed_send(tmp_path):
+    # Transfer error is not replaced by BufferError from closing of mmap
+    fname = tmp_path / 'fw.bin'
+    fname.write_bytes(bytes(range(256)) * 20)
+    ack0 = bytes([0, ACK, 0, 0])    # Only WRQ is answered
+    with DeviceEmulator(port=0, impairment=Impairment(drop=lambda direction, pkt: direction == 'out' and pkt[1] == ACK and pkt != ack0)) as emu:
+        tftp = client(emu, window_size=4, max_retry=1)
+        with pytest.raises(AssertionError):
+            with mstd.ImageSource(str(fname)) as view:
+                tftp.send('fw.bin', view, False)
+        tftp.close()
+
+def test_image_source_close_with_slice(tmp_path):
+    fname = tmp_path / 'fw.bin'
+    fname.write_bytes(b'\x55' * 1000)
+    src = mstd.ImageSource(str(fname))
+    block = src.view[10:20]
+    src.close()
+    assert bytes(block) == b'\x55' * 10
+
+def test_slow_wrq_answer():
+    # fw.bin WRQ is answered after OTA partition erase - request is not retransmitted meanwhile
+    with DeviceEmulator(port=0, ota_erase=2.0) as emu:
+        tftp = client(emu, max_retry=2)
+        tftp.send('fw.bin', b'\xE9' * 3000, False)
+        tftp.close()
+    assert emu.firmware == b'\xE9' * 3000
+    assert tftp.stats.timeouts == 0
@@ -0,0 +1,32 @@
+﻿"""
+    Watch mode sources
+"""
+import pytest
+
+from conftest import mstd
+
+def test_reload_error_keeps_content(cfg, tmp_path):
+    fname = tmp_path / 'base.toml'
+    fname.write_text("ssid = 'lab'\n")
+    src = mstd.WatchedSource(str(fname))
+    src.reload(src.poll())
+    good = src.stamp
+
+    fname.write_text("ssid = \n")
+    assert src.changed()
+    with pytest.raises(ValueError):
+        src.reload(src.poll())
+    assert src.stamp == good and not src.changed()  # Broken file is not reparsed on each poll
+
+    cdata = mstd.ConfigData(cfg)
+    src.apply(cdata, 0, None)   # Previous content still applies
+    assert cdata.get_toml_value('ssid') == 'lab'
+
+def test_apply_not_loaded(cfg, tmp_path):
+    fname = tmp_path / 'base.toml'
+    fname.write_text("ssid = \n")
+    src = mstd.WatchedSource(str(fname))
+    with pytest.raises(ValueError):
+        src.reload(src.poll())
+    with pytest.raises(AssertionError, match='not loaded'):
+        src.apply(mstd.ConfigData(cfg), 0, None)
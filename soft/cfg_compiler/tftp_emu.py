@@ -0,0 +1,477 @@
+﻿#!/usr/bin/python3
+"""
+    MSTD TFTP server emulator (bootloader/main/tftp) for testing of mstd.cfg.py without device.
+
+    Emulated as device does:
+        write of *.cfg (config record), full.cfg (config partition) and *.bin (firmware), read of *.cfg and full.cfg
+        block size is always 512, 'blksize' as first option of WRQ is answered by OACK blksize=512, ACK 0 otherwise
+        options of RRQ are ignored, read block is sent up to 3 times waiting for its ACK
+        one transfer at a time, answers come from server port
+        block numbers are compared as on device (no wrap over 65535 blocks)
+    Config partition is log of config records, last written record is active one in flash.
+    As on device, partition is loaded to RAM once at boot - reads return boot time config till 'reboot()'
+    (successful firmware write reboots device). Data of failed write (timeout, overflow) is not stored.
+
+    Link impairments (loss, duplication, reordering, latency) are applied to packets in both directions.
+    Random generator is seeded - same packet sequence gets same impairments.
+
+    Standalone:
+        python tftp_emu.py --port 6969 --loss 0.05 --seed 1
+        python mstd.cfg.py cfg.toml MSTD://127.0.0.1:6969
+    In test:
+        with DeviceEmulator(port=0, impairment=Impairment(loss=0.05)) as emu:
+            TFTPClient('127.0.0.1', port=emu.port).send('cfg.cfg', image, False)
+"""
+import argparse
+import sys
+import os
+import time
+import random
+import select
+import heapq
+import itertools
+import threading
+
+from dataclasses import dataclass, field
+from typing import *
+from socket import socket, AF_INET, SOCK_DGRAM
+
+from crc32 import eval_crc
+
+# TFTP packet types
+RRQ = 1
+WRQ = 2
+DATA = 3
+ACK = 4
+ERROR = 5
+OACK = 6
+
+# TFTP error codes (as sent by device)
+ERR_NOT_DEFINED = 0
+ERR_FILE_NOT_FOUND = 1
+ERR_ACCESS_VIOLATION = 2
+
+DATA_SIZE = 512                 # Device accepts only 512 bytes blocks
+PKT_SIZE = DATA_SIZE + 4        # Receive buffer of device - longer packets are truncated
+SEND_RETRY = 3                  # Attempts to send read block
+RECV_TOUT = 30                  # Device socket receive timeout (in seconds)
+EMU_PORT = 6969                 # Default port of emulator (69 needs root)
+
+MAX_CFG_SIZE = 4096             # Size of config partition
+CONFIG_V0_SIZE = 108            # sizeof(Config_V0) - minimal config record
+FW_MAGIC = 0xE9                 # First byte of ESP32 application image
+
+@dataclass
+class Impairment:
+    """
+        Link impairments. Probabilities are per packet, times in seconds (latency is one way)
+    """
+    loss: float = 0.0
+    duplicate: float = 0.0
+    reorder: float = 0.0
+    latency: float = 0.0
+    jitter: float = 0.0
+    reorder_delay: float = 0.02     # Reordered packet is held back for this time - next packets overtake it
+    seed: int = 0
+    drop: Optional[Callable[[str, bytes], bool]] = None     # drop(direction, packet) - deterministic loss ('in' or 'out' packet)
+    rnd: random.Random = field(init=False)
+
+    def __post_init__(self):
+        self.rnd = random.Random(self.seed)
+
+    def delays(self) -> list[float]:
+        """
+            Delivery delays of one packet: empty if lost, two for duplicated.
+            Same count of random numbers is drawn for each packet - decisions don't shift when probabilities change
+        """
+        lost, dup, reorder, jitter, dup_jitter = (self.rnd.random() for _ in range(5))
+        if lost < self.loss:
+            return []
+        result = [self.latency + jitter * self.jitter + (self.reorder_delay if reorder < self.reorder else 0)]
+        if dup < self.duplicate:
+            result.append(result[0] + dup_jitter * self.jitter)
+        return result
+
+@dataclass
+class LinkStats:
+    packets: int = 0
+    dropped: int = 0
+    duplicated: int = 0
+    delayed: int = 0
+
+@dataclass
+class Transfer:
+    op: str                     # 'read' or 'write'
+    file_name: str
+    size: int = 0
+    blocks: int = 0
+    duplicates: int = 0         # Write - duplicate blocks received
+    retries: int = 0            # Read - blocks sent again
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def throughput(self) -> float:
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        result = f'{self.op:<5} {self.file_name:<12} {self.size:>8} bytes {self.elapsed:7.3f}s {self.throughput/1024:8.1f} KB/s'
+        result += f' dup {self.duplicates} retry {self.retries}'
+        return result + (f' ERROR: {self.error}' if self.error else '')
+
+class ConfigPartition:
+    """
+        Config partition of device (setup_data.cpp): log of config records, last one with good CRC is active
+    """
+    def __init__(self, image: Optional[bytes] = None):
+        self.image = bytearray(image or b'\xFF' * MAX_CFG_SIZE)
+        assert len(self.image) == MAX_CFG_SIZE, f'Config partition image should be {MAX_CFG_SIZE} bytes'
+        self.active = None      # (offset, size) of active config
+        self.next_shift = -1    # Where next config can be written (-1 - partition should be erased first)
+        self.find_active()
+        self.reboot()
+
+    def reboot(self):
+        """
+            load_config: partition is read to RAM (cfg_full) at boot, reads are served from this copy
+        """
+        self.boot_image = bytes(self.image)
+        self.boot_config = self.config
+
+    def find_active(self):
+        self.active = None
+        self.next_shift = -1
+        ptr = 0
+        while ptr < MAX_CFG_SIZE:
+            crc = int.from_bytes(self.image[ptr:ptr+4], 'little')
+            size = int.from_bytes(self.image[ptr+4:ptr+6], 'little')
+            if crc == 0xFFFFFFFF:
+                if all(x == 0xFF for x in self.image[ptr:]):
+                    self.next_shift = ptr
+                break
+            if size >> 8 == 0xFF:   # Aborted write of size field - slot is reused
+                ptr += 8
+                continue
+            rec_size = (size & 0x3FF) * 4 + 4
+            if ptr + rec_size > MAX_CFG_SIZE:
+                break
+            if crc == eval_crc(self.image[ptr+4:ptr+rec_size]):
+                self.active = (ptr, rec_size)
+            ptr += rec_size
+
+    @property
+    def config(self) -> Optional[bytes]:
+        """
+            Active config in flash (device reads it after reboot)
+        """
+        if self.active is None:
+            return None
+        ptr, size = self.active
+        return bytes(self.image[ptr:ptr+size])
+
+    def save_image(self, image: bytes) -> Optional[str]:
+        """
+            save_config_image - return error message or None
+        """
+        image = bytearray(image)
+        size = len(image)
+        if size > MAX_CFG_SIZE: return 'Image too big'
+        if size < CONFIG_V0_SIZE: return 'Image too small'
+        if size & 3: return 'Image size is odd'
+        rec_size = int.from_bytes(image[4:6], 'little')
+        if (rec_size & 0x3FF) * 4 + 4 != size or rec_size >> 8 == 0xFF: return 'Image size wrong'
+        crc = eval_crc(image[4:])
+        if image[:4] == b'\xFF\xFF\xFF\xFF':
+            image[:4] = crc.to_bytes(4, 'little')
+        elif int.from_bytes(image[:4], 'little') != crc:
+            return 'Image CRC wrong'
+        if self.next_shift < 0 or self.next_shift + size > MAX_CFG_SIZE:
+            self.image[:] = b'\xFF' * MAX_CFG_SIZE
+            self.next_shift = 0
+        self.image[self.next_shift:self.next_shift+size] = image
+        self.find_active()
+        return None
+
+    def save_full(self, image: bytes) -> Optional[str]:
+        self.image[:] = image
+        self.find_active()
+        return None
+
+class DeviceEmulator:
+    """
+        TFTP server of MSTD on UDP socket. Use 'serve' (blocking), or as context manager (served by thread).
+        port=0 binds to any free port (see 'port' after creation)
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = EMU_PORT, impairment: Optional[Impairment] = None,
+                 partition: Optional[bytes] = None, recv_timeout: float = RECV_TOUT, out_dir: Optional[str] = None, verbose: bool = False,
+                 ota_erase: float = 0.0):
+        self.socket = socket(AF_INET, SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.port = self.socket.getsockname()[1]
+        self.impairment = impairment or Impairment()
+        self.partition = ConfigPartition(partition)
+        self.firmware = None            # Last firmware image written
+        self.recv_timeout = recv_timeout
+        self.out_dir = out_dir          # Save written files here
+        self.ota_erase = ota_erase      # Time to answer WRQ of firmware (esp_ota_begin erases OTA partition first)
+        self.verbose = verbose
+        self.transfers: list[Transfer] = []
+        self.link_in = LinkStats()
+        self.link_out = LinkStats()
+        self.events = []                # Heap of (time, seq, direction, packet, address) - packets in flight
+        self.seq = itertools.count()
+        self.stopping = False
+        self.thread = None
+
+    def __enter__(self) -> 'DeviceEmulator':
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reboot(self):
+        self.partition.reboot()
+
+    def stop(self):
+        self.stopping = True
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.socket.close()
+
+    def schedule(self, direction: str, pkt: bytes, addr: tuple):
+        stats = self.link_in if direction == 'in' else self.link_out
+        stats.packets += 1
+        delays = self.impairment.delays()
+        if self.impairment.drop and self.impairment.drop(direction, pkt):
+            delays = []
+        stats.dropped += not delays
+        stats.duplicated += len(delays) > 1
+        stats.delayed += any(delays)
+        now = time.monotonic()
+        for delay in delays:
+            heapq.heappush(self.events, (now + delay, next(self.seq), direction, pkt, addr))
+
+    def send(self, pkt: bytes, addr: tuple):
+        self.schedule('out', pkt, addr)
+
+    def recv(self, timeout: float) -> Optional[tuple[bytes, tuple]]:
+        """
+            Next packet passed through link (truncated to device buffer), None on timeout or stop.
+            Outgoing packets are sent here, when their time comes
+        """
+        end = time.monotonic() + timeout
+        while not self.stopping:
+            now = time.monotonic()
+            while self.events and self.events[0][0] <= now:
+                _, _, direction, pkt, addr = heapq.heappop(self.events)
+                if direction == 'in':
+                    return pkt[:PKT_SIZE], addr
+                self.socket.sendto(pkt, addr)
+            if now >= end:
+                return None
+            wait = min(end, self.events[0][0] if self.events else end, now + 0.1) - now
+            if select.select([self.socket], [], [], wait)[0]:
+                pkt, addr = self.socket.recvfrom(0x10000)
+                self.schedule('in', pkt, addr)
+        return None
+
+    def send_ack(self, block_num: int, addr: tuple):
+        self.send(bytes([0, ACK]) + (block_num & 0xFFFF).to_bytes(2, 'big'), addr)
+
+    def send_error(self, code: int, message: str, addr: tuple):
+        self.send(bytes([0, ERROR]) + code.to_bytes(2, 'big') + message.encode() + b'\0', addr)
+
+    @staticmethod
+    def job_of(file_name: str, is_write: bool) -> Optional[str]:
+        """
+            test_file_name: 'full', 'cfg', 'fw' or None
+        """
+        if file_name == 'full.cfg':
+            return 'full'
+        if file_name.endswith('.bin'):
+            return 'fw' if is_write else None
+        if file_name.endswith('.cfg'):
+            return 'cfg'
+        return None
+
+    def serve(self, count: Optional[int] = None):
+        """
+            Serve requests until stopped (or 'count' transfers done)
+        """
+        while not self.stopping and (count is None or len(self.transfers) < count):
+            got = self.recv(1)
+            while got:  # Packet which broke write transfer is parsed as new request
+                pkt, addr = got
+                code = int.from_bytes(pkt[:2], 'big')
+                if code == WRQ:
+                    got = self.process_write(pkt, addr)
+                elif code == RRQ:
+                    got = self.process_read(pkt, addr)
+                else:
+                    got = None
+
+    def log(self, transfer: Transfer):
+        self.transfers.append(transfer)
+        if self.verbose:
+            print(transfer, file=sys.stderr)
+
+    def process_write(self, pkt: bytes, addr: tuple) -> Optional[tuple[bytes, tuple]]:
+        fields = pkt[2:].split(b'\0')
+        transfer = Transfer('write', fields[0].decode(errors='replace'))
+        job = self.job_of(transfer.file_name, True)
+        if job is None:
+            self.send_error(ERR_ACCESS_VIOLATION, 'cannot open file', addr)
+            transfer.error = 'Wrong file name'
+            self.log(transfer)
+            return None
+        if job == 'fw' and self.ota_erase:
+            time.sleep(self.ota_erase)
+        if len(fields) > 3 and fields[2] == b'blksize':
+            self.send(bytes([0, OACK]) + b'blksize\0' + b'512\0', addr)
+        else:
+            self.send_ack(0, addr)
+        started = time.monotonic()
+        buffer = bytearray()
+        next_block_num = 1
+        repeat = None
+        while True:
+            got = self.recv(self.recv_timeout)
+            if got is None:
+                transfer.error = 'Timeout'
+                break
+            pkt, addr = got
+            code = int.from_bytes(pkt[:2], 'big')
+            if code != DATA:
+                if code == WRQ and next_block_num == 1: # Client repeats request
+                    self.send_ack(0, addr)
+                    continue
+                repeat = got
+                transfer.error = 'Not a data packet'
+                break
+            block_num = int.from_bytes(pkt[2:4], 'big')
+            self.send_ack(block_num, addr)
+            if block_num < next_block_num:
+                transfer.duplicates += 1
+            else:
+                next_block_num += 1
+                transfer.blocks += 1
+                if job != 'fw' and len(buffer) + len(pkt) - 4 > MAX_CFG_SIZE:
+                    transfer.error = 'Cfg buffer overflow'
+                else:
+                    buffer += pkt[4:]
+            if len(pkt) < PKT_SIZE:
+                break
+        transfer.elapsed = time.monotonic() - started
+        transfer.size = len(buffer)
+        if not transfer.error:  # Truncated image fails esp_ota_end or size check of config
+            transfer.error = self.close_write(job, transfer.file_name, bytes(buffer))
+        self.log(transfer)
+        return repeat
+
+    def close_write(self, job: str, file_name: str, data: bytes) -> Optional[str]:
+        """
+            on_close: store written image, return error message
+        """
+        if self.out_dir:
+            with open(os.path.join(self.out_dir, file_name), 'wb') as f:
+                f.write(data)
+        match job:
+            case 'fw':
+                if not data or data[0] != FW_MAGIC:
+                    return 'Fail img verification'
+                self.firmware = data
+                self.reboot()   # Device reboots after OTA update
+            case 'cfg':
+                return self.partition.save_image(data)
+            case 'full':
+                return self.partition.save_full(data + b'\xFF' * (MAX_CFG_SIZE - len(data)))
+        return None
+
+    def process_read(self, pkt: bytes, addr: tuple) -> Optional[tuple[bytes, tuple]]:
+        fields = pkt[2:].split(b'\0')
+        transfer = Transfer('read', fields[0].decode(errors='replace'))
+        data = {'full': self.partition.boot_image, 'cfg': self.partition.boot_config}.get(self.job_of(transfer.file_name, False))
+        if data is None:
+            self.send_error(ERR_FILE_NOT_FOUND, 'cannot open file', addr)
+            transfer.error = 'Wrong file name or no config'
+            self.log(transfer)
+            return None
+        started = time.monotonic()
+        block_num = 1
+        pos = 0
+        while True:
+            block = data[pos:pos+DATA_SIZE]
+            for attempt in range(SEND_RETRY):
+                self.send(bytes([0, DATA]) + (block_num & 0xFFFF).to_bytes(2, 'big') + block, addr)
+                result, addr = self.wait_for_ack(block_num, addr)
+                if result == 0:
+                    break
+                transfer.retries += 1
+            else:
+                transfer.error = 'No ack'
+                break
+            transfer.blocks += 1
+            pos += len(block)
+            if len(block) < DATA_SIZE:
+                break
+            block_num += 1
+        transfer.elapsed = time.monotonic() - started
+        transfer.size = pos
+        self.log(transfer)
+        return None
+
+    def wait_for_ack(self, block_num: int, addr: tuple) -> tuple[int, tuple]:
+        """
+            0 - ACK of 'block_num', 1 - other ACK, -1 - timeout or not an ACK (answered by error)
+        """
+        got = self.recv(self.recv_timeout)
+        if got is None:
+            self.send_error(ERR_NOT_DEFINED, 'incorrect ack', addr)
+            return -1, addr
+        pkt, addr = got
+        if len(pkt) < 4 or int.from_bytes(pkt[:2], 'big') != ACK:
+            self.send_error(ERR_NOT_DEFINED, 'incorrect ack', addr)
+            return -1, addr
+        return (0 if int.from_bytes(pkt[2:4], 'big') == block_num & 0xFFFF else 1), addr
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tftp_emu.py', description='MSTD TFTP server emulator with link impairments')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind')
+    parser.add_argument('--port', type=int, default=EMU_PORT, help='UDP port to bind')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability of packet loss (each direction)')
+    parser.add_argument('--duplicate', type=float, default=0.0, help='Probability of packet duplication')
+    parser.add_argument('--reorder', type=float, default=0.0, help='Probability of packet reordering')
+    parser.add_argument('--latency', type=float, default=0.0, help='One way latency (ms)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random addition to latency (ms)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of impairments random generator')
+    parser.add_argument('--timeout', type=float, default=RECV_TOUT, help='Device receive timeout (s)')
+    parser.add_argument('--partition', help='Initial image of config partition (full.cfg)')
+    parser.add_argument('--out-dir', help='Save written files to this directory')
+    parser.add_argument('--ota-erase', type=float, default=0.0, help='Delay of answer to firmware WRQ (s)')
+    parser.add_argument('--count', type=int, help='Exit after this number of transfers')
+    args = parser.parse_args()
+
+    partition = None
+    if args.partition:
+        with open(args.partition, 'rb') as f:
+            partition = f.read()
+    impairment = Impairment(args.loss, args.duplicate, args.reorder, args.latency / 1000, args.jitter / 1000, seed=args.seed)
+    emu = DeviceEmulator(args.host, args.port, impairment, partition, args.timeout, args.out_dir, verbose=True, ota_erase=args.ota_erase)
+    print(f'MSTD emulator on {args.host}:{emu.port}', file=sys.stderr)
+    try:
+        emu.serve(args.count)
+    except KeyboardInterrupt:
+        pass
+    for name, stats in (('in', emu.link_in), ('out', emu.link_out)):
+        print(f'{name:<3}: {stats.packets} packets, {stats.dropped} dropped, {stats.duplicated} duplicated, {stats.delayed} delayed', file=sys.stderr)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as exp:
+        print(f'ERROR: {exp}', file=sys.stderr)
+        sys.exit(1)